@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from glob import glob
+
+from .gompertz import GompertzParameters
+from .mortality_rate import KeyedMortality
+from .pipeline import hash_value
+
+HELPERS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ARTIFACT_DIRECTORY = os.path.join(os.path.dirname(HELPERS_DIRECTORY), 'artifacts')
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+
+# arrays of `save_model_results`
+PARAMETERS_ARRAY = 'parameters'
+INTERACTION_FACTORS_ARRAY = 'interaction_factors'
+EVALUATION_AGES_ARRAY = 'evaluation_ages'
+MORTALITY_RATE_ARRAY = 'mortality_rate'
+
+
+def compute_dataset_hash(dataset) -> str:
+    """Returns the content hash of a dataset file (its bytes) or of any
+       value `pipeline.hash_value` supports, e.g. a DataFrame"""
+    if isinstance(dataset, str) and os.path.isfile(dataset):
+        digest = hashlib.sha1()
+        with open(dataset, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return hash_value(dataset)
+
+def compute_code_version() -> str:
+    """Returns the hash of the helpers sources, which changes with any code change"""
+    digest = hashlib.sha1()
+    for path in sorted(glob(os.path.join(HELPERS_DIRECTORY, '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:12]
+
+
+@dataclass
+class Artifact:
+    """A loaded artifact, whose arrays are memory-mapped unless loaded with `mmap=False`"""
+    key: str
+    manifest: dict
+    arrays: dict = field(default_factory=dict)
+
+    @property
+    def metadata(self) -> dict:
+        return self.manifest['metadata']
+
+    def parameters(self) -> {str: GompertzParameters}:
+        keys = self.manifest['keys'][PARAMETERS_ARRAY]
+        return {key: GompertzParameters.from_sequence(row) for key, row in zip(keys, self.arrays[PARAMETERS_ARRAY])}
+
+    def interaction_factors(self) -> np.array:
+        return self.arrays[INTERACTION_FACTORS_ARRAY]
+
+    def evaluation_ages(self) -> np.array:
+        return self.arrays[EVALUATION_AGES_ARRAY]
+
+    def mortality_rate(self) -> KeyedMortality:
+        return KeyedMortality(self.manifest['keys'][MORTALITY_RATE_ARRAY], self.arrays[MORTALITY_RATE_ARRAY])
+
+
+class ArtifactStore:
+    """Directory of immutable artifacts, each a folder of `.npy` arrays and a
+       json manifest. An artifact is keyed by its name, the hash of the data it
+       was computed from and the version of the helpers code, so results of
+       other data or code are never mixed up:
+
+           <directory>/<name>-<dataset hash>-<code version>/manifest.json
+                                                           /<array>.npy
+
+       The arrays are stored uncompressed, so `load` memory-maps them and
+       only the manifest is parsed, which takes milliseconds."""
+
+    def __init__(self, directory: str = DEFAULT_ARTIFACT_DIRECTORY):
+        self.directory = directory
+
+    @staticmethod
+    def artifact_key(name: str, dataset_hash: str, code_version: str) -> str:
+        return f'{name}-{dataset_hash[:16]}-{code_version}'
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.path(key), MANIFEST_FILE))
+
+    def save(self, name: str, dataset_hash: str, arrays: {str: np.array}, keys: {str: [str]} = None,
+             metadata: dict = None, code_version: str = None, overwrite: bool = False) -> str:
+        """Stores `arrays` (and the row `keys` of any of them) as an artifact
+           and returns its key. The artifact is written to a temporary folder
+           first, so readers never see a partially written artifact."""
+        code_version = compute_code_version() if code_version is None else code_version
+        key = self.artifact_key(name, dataset_hash, code_version)
+        if key in self and not overwrite:
+            return key
+
+        manifest = {
+            'format_version': FORMAT_VERSION,
+            'name': name,
+            'dataset_hash': dataset_hash,
+            'code_version': code_version,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'arrays': {},
+            'keys': {array_name: list(array_keys) for array_name, array_keys in (keys or {}).items()},
+            'metadata': metadata or {}
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_directory = tempfile.mkdtemp(prefix=f'.{key}-', dir=self.directory)
+        try:
+            for array_name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                np.save(os.path.join(temporary_directory, f'{array_name}.npy'), array, allow_pickle=False)
+                manifest['arrays'][array_name] = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+            with open(os.path.join(temporary_directory, MANIFEST_FILE), 'w') as file:
+                json.dump(manifest, file, indent=1)
+
+            if os.path.exists(self.path(key)):
+                shutil.rmtree(self.path(key))
+            os.replace(temporary_directory, self.path(key))
+        except BaseException:
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+            raise
+        return key
+
+    def load(self, key: str, mmap: bool = True) -> Artifact:
+        with open(os.path.join(self.path(key), MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+
+        arrays = {}
+        for array_name in manifest['arrays']:
+            arrays[array_name] = np.load(os.path.join(self.path(key), f'{array_name}.npy'),
+                                         mmap_mode='r' if mmap else None, allow_pickle=False)
+        return Artifact(key=key, manifest=manifest, arrays=arrays)
+
+    def manifests(self, name: str = None, dataset_hash: str = None, code_version: str = None) -> [dict]:
+        """Returns the manifests of the matching artifacts, newest first"""
+        manifests = []
+        for path in glob(os.path.join(self.directory, '*', MANIFEST_FILE)):
+            with open(path, 'r') as file:
+                manifest = json.load(file)
+            if ((name is None or manifest['name'] == name)
+                    and (dataset_hash is None or manifest['dataset_hash'] == dataset_hash)
+                    and (code_version is None or manifest['code_version'] == code_version)):
+                manifest['key'] = os.path.basename(os.path.dirname(path))
+                manifests.append(manifest)
+        return sorted(manifests, key=lambda manifest: manifest['created'], reverse=True)
+
+    def find(self, name: str, dataset_hash: str, code_version: str = None, mmap: bool = True):
+        """Returns the artifact of `name` for the data and the current code, or None"""
+        code_version = compute_code_version() if code_version is None else code_version
+        key = self.artifact_key(name, dataset_hash, code_version)
+        return self.load(key, mmap=mmap) if key in self else None
+
+    def remove(self, key: str) -> None:
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def save_model_results(self, name: str, dataset_hash: str, parameters, interaction_factors,
+                           evaluation_ages: np.array, mortality_rate, metadata: dict = None,
+                           code_version: str = None, overwrite: bool = False) -> str:
+        """Stores the Gompertz parameters (`Parameters` or a dict of
+           `GompertzParameters`), the `InteractionFactors` (or its matrix), the
+           evaluation ages and the per-combination mortality rates (a
+           `KeyedMortality` or a dict of arrays)"""
+        parameter_keys = list(parameters.keys())
+        parameter_rows = [parameters[key].to_tuple() if isinstance(parameters[key], GompertzParameters)
+                          else tuple(parameters[key]) for key in parameter_keys]
+        if not isinstance(mortality_rate, KeyedMortality):
+            mortality_rate = KeyedMortality.from_dict(mortality_rate)
+        if hasattr(interaction_factors, 'to_numpy'):
+            interaction_factors = interaction_factors.to_numpy()
+
+        arrays = {
+            PARAMETERS_ARRAY: np.array(parameter_rows, dtype=np.float64).reshape(-1, 2),
+            INTERACTION_FACTORS_ARRAY: np.asarray(interaction_factors, dtype=np.float64),
+            EVALUATION_AGES_ARRAY: np.asarray(evaluation_ages, dtype=np.float64),
+            MORTALITY_RATE_ARRAY: mortality_rate.to_numpy()
+        }
+        keys = {PARAMETERS_ARRAY: parameter_keys, MORTALITY_RATE_ARRAY: list(mortality_rate.keys())}
+        return self.save(name, dataset_hash, arrays, keys=keys, metadata=metadata, code_version=code_version,
+                         overwrite=overwrite)
+
+    def save_pipeline(self, pipeline, name: str = 'second_order', overwrite: bool = False) -> str:
+        """Stores the results of a `SecondOrderPipeline`, keyed by its dataset file"""
+        mortality_rates = {}
+        for order in range(pipeline.n_interventions + 1):
+            values = pipeline.mortality_rate(order).mortality_rate.value()
+            if isinstance(values, Mapping):
+                mortality_rates.update(values.items())
+            else:
+                mortality_rates[pipeline['keys'][order]] = values
+
+        metadata = {'dataset_path': pipeline['dataset_path'], 'n_interventions': pipeline.n_interventions,
+                    'one_interventions': list(pipeline['one_interventions'])}
+        return self.save_model_results(name, compute_dataset_hash(pipeline['dataset_path']), pipeline['parameters'],
+                                       pipeline['interaction_factors'], pipeline['ages'], mortality_rates,
+                                       metadata=metadata, overwrite=overwrite)
+
+    def save_state_dict(self, name: str, model, dataset_hash: str, hyperparameters: dict = None,
+                        code_version: str = None, overwrite: bool = False) -> str:
+        """Stores the weights of a torch module (e.g. `MLPModel`) with its
+           hyperparameters; load them with `torch.from_numpy` per array"""
+        arrays = {parameter_name: tensor.detach().cpu().numpy()
+                  for parameter_name, tensor in model.state_dict().items()}
+        return self.save(name, dataset_hash, arrays, metadata={'hyperparameters': hyperparameters or {}},
+                         code_version=code_version, overwrite=overwrite)
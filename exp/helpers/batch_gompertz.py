@@ -0,0 +1,343 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .fit_cache import FitCache, compute_fit_key
+from .gompertz import *
+
+MIN_DAMPING = 1e-12
+MAX_DAMPING = 1e12
+DAMPING_FACTOR = 10.0
+
+# alpha is fitted in log space
+GOMPERTZ_LOG_PARAMETERS = (0,)
+
+
+@dataclass
+class StackedDatasets:
+    """Ages and mortality rates of every intervention stacked into
+       padded (groups x max points) arrays, where `mask` marks
+       the entries that hold actual data points"""
+    keys: [str]
+    ages: np.array
+    mortality_rate: np.array
+    mask: np.array
+
+
+@dataclass
+class BatchFitReport:
+    """Convergence information of a batched Gompertz fit. `failed` marks the
+       degenerate groups and the groups whose normal equations became singular,
+       which never count as converged"""
+    keys: [str]
+    converged: np.array
+    failed: np.array
+    iterations: np.array
+    cost: np.array
+    elapsed_seconds: float
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+                    'converged': self.converged,
+                    'failed': self.failed,
+                    'iterations': self.iterations,
+                    'cost': self.cost
+                }, index=self.keys)
+
+    def __str__(self) -> str:
+        n_converged = int(self.converged.sum())
+        n_failed = int(self.failed.sum())
+        return (f'{n_converged}/{len(self.keys)} groups converged, {n_failed} failed '
+                f'in {self.elapsed_seconds * 1_000:.2f}ms')
+
+
+def stack_datasets(dataset: dict) -> StackedDatasets:
+    """Stacks the ages and mortality rates of all interventions in `dataset`
+       into zero-padded arrays"""
+    keys = list(dataset.keys())
+    return stack_arrays(keys, [calculate_ages(dataset[key]) for key in keys],
+                        [calculate_mortality_rate(dataset[key]) for key in keys])
+
+def stack_arrays(keys: [str], all_ages: [np.array], all_mortality_rates: [np.array]) -> StackedDatasets:
+    """Stacks the ages and mortality rates of every key into zero-padded arrays"""
+    max_length = max([len(ages) for ages in all_ages], default=0)
+    ages = np.zeros((len(keys), max_length))
+    mortality_rate = np.zeros((len(keys), max_length))
+    mask = np.zeros((len(keys), max_length), dtype=bool)
+
+    for i, (current_ages, current_mortality_rate) in enumerate(zip(all_ages, all_mortality_rates)):
+        ages[i, :len(current_ages)] = current_ages
+        mortality_rate[i, :len(current_ages)] = current_mortality_rate
+        mask[i, :len(current_ages)] = True
+
+    return StackedDatasets(keys=keys, ages=ages, mortality_rate=mortality_rate, mask=mask)
+
+
+def log_linear_warm_start(ages: np.array,
+                          mortality_rate: np.array,
+                          mask: np.array,
+                          initial_parameters: GompertzParameters = DEFAULT_INITIAL_PARAMETERS) -> (np.array, np.array):
+    """Returns the closed-form least squares solution of
+       log(mortality) = log(alpha) + beta * age for every group
+       as (log_alphas, betas). Groups with less than two positive
+       mortality rates fall back to `initial_parameters`"""
+    valid = mask & (mortality_rate > 0)
+    weights = valid.astype(np.float64)
+    log_mortality = np.log(np.where(valid, mortality_rate, 1.0))
+
+    n = weights.sum(axis=1)
+    safe_n = np.maximum(n, 1)
+    mean_age = (weights * ages).sum(axis=1) / safe_n
+    mean_log_mortality = (weights * log_mortality).sum(axis=1) / safe_n
+
+    centered_ages = weights * (ages - mean_age[:, None])
+    age_variance = (centered_ages ** 2).sum(axis=1)
+    covariance = (centered_ages * (log_mortality - mean_log_mortality[:, None])).sum(axis=1)
+
+    solvable = (n >= 2) & (age_variance > 0)
+    betas = np.where(solvable, covariance / np.where(solvable, age_variance, 1.0), initial_parameters.beta)
+    log_alphas = np.where(solvable, mean_log_mortality - betas * mean_age, np.log(initial_parameters.alpha))
+
+    return log_alphas, betas
+
+
+def gompertz_warm_start(stacked: StackedDatasets,
+                        initial_parameters: GompertzParameters = DEFAULT_INITIAL_PARAMETERS) -> np.array:
+    """Returns the (groups x [alpha, beta]) log-linear starting points of a batched Gompertz fit"""
+    log_alphas, betas = log_linear_warm_start(stacked.ages, stacked.mortality_rate, stacked.mask, initial_parameters)
+    return np.stack([np.exp(log_alphas), betas], axis=-1)
+
+
+def _columns(parameters: np.array) -> [np.array]:
+    """Splits (groups x parameters) into one (groups x 1) column per parameter"""
+    return [parameters[:, [i]] for i in range(parameters.shape[1])]
+
+def _to_curve_parameters(fit_parameters: np.array, log_parameters: [int]) -> np.array:
+    curve_parameters = fit_parameters.copy()
+    curve_parameters[:, log_parameters] = np.exp(fit_parameters[:, log_parameters])
+    return curve_parameters
+
+def _compute_residuals(function, ages, mortality_rate, mask, curve_parameters: np.array):
+    predicted = function(ages, *_columns(curve_parameters))
+    residuals = np.where(mask, mortality_rate - predicted, 0.0)
+    return (residuals ** 2).sum(axis=1), residuals
+
+def _solve_normal_equations(damped: np.array, jtr: np.array) -> (np.array, np.array):
+    """Solves the (groups x parameters x parameters) damped normal equations,
+       returns the steps and whether each group was solvable"""
+    if damped.shape[-1] == 2:
+        # two parameter models (e.g. Gompertz) are solved in closed form
+        determinant = damped[:, 0, 0] * damped[:, 1, 1] - damped[:, 0, 1] * damped[:, 1, 0]
+        solvable = np.isfinite(determinant) & (np.abs(determinant) > 0)
+        safe_determinant = np.where(solvable, determinant, 1.0)
+        step = np.stack([damped[:, 1, 1] * jtr[:, 0] - damped[:, 0, 1] * jtr[:, 1],
+                         damped[:, 0, 0] * jtr[:, 1] - damped[:, 1, 0] * jtr[:, 0]], axis=1) / safe_determinant[:, None]
+        return np.where(solvable[:, None], step, 0.0), solvable
+
+    determinant = np.linalg.det(damped)
+    solvable = np.isfinite(determinant) & (np.abs(determinant) > 0)
+    safe_damped = np.where(solvable[:, None, None], damped, np.eye(damped.shape[-1]))
+    return np.where(solvable[:, None], np.linalg.solve(safe_damped, jtr[..., None])[..., 0], 0.0), solvable
+
+def find_degenerate_groups(stacked: StackedDatasets, n_parameters: int) -> np.array:
+    """Returns the groups whose points cannot determine `n_parameters`
+       parameters: groups with less distinct ages than parameters, and
+       groups whose mortality rate is zero everywhere"""
+    # the padding sorts to the end as NaN and never counts as a new age
+    sorted_ages = np.sort(np.where(stacked.mask, stacked.ages, np.nan), axis=1)
+    n_distinct_ages = stacked.mask.any(axis=1) + (np.diff(sorted_ages, axis=1) > 0).sum(axis=1)
+    has_mortality = (stacked.mask & (stacked.mortality_rate != 0)).any(axis=1)
+    return (n_distinct_ages < n_parameters) | ~has_mortality
+
+def fit_batch(function,
+              jacobian,
+              stacked: StackedDatasets,
+              initial_parameters: np.array,
+              max_fit_iterations: int = 200,
+              tolerance: float = 1.49012e-08,
+              log_parameters: [int] = ()) -> (np.array, np.array, np.array, np.array, np.array):
+    """Fits the curve `function(x, *parameters)` to every group of `stacked`
+       at once with a vectorized Levenberg-Marquardt iteration on its analytic
+       `jacobian` (the derivatives w.r.t. the parameters, stacked along the
+       last axis). This minimizes the same squared error as `curve_fit`.
+
+       `initial_parameters` holds the (groups x parameters) starting points.
+       The (positive) parameters at the `log_parameters` indices are iterated
+       in log space, e.g. the Gompertz alpha, which spans orders of magnitude.
+       Only the groups that have not converged yet are iterated.
+
+       Degenerate groups (see `find_degenerate_groups`) are not iterated, and
+       groups whose damped normal equations become singular stop iterating.
+       Both are marked as `failed` and never as `converged`. Returns the
+       (parameters, cost, converged, iterations, failed) of every group."""
+    n_groups = len(stacked.keys)
+    log_parameters = list(log_parameters)
+    parameters = np.array(initial_parameters, dtype=np.float64)
+    parameters = parameters.reshape(n_groups, parameters.shape[-1])
+    if np.any(parameters[:, log_parameters] <= 0):
+        raise ValueError('The parameters fitted in log space must start positive')
+    parameters[:, log_parameters] = np.log(parameters[:, log_parameters])
+    n_parameters = parameters.shape[1]
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        cost, _ = _compute_residuals(function, stacked.ages, stacked.mortality_rate, stacked.mask,
+                                     _to_curve_parameters(parameters, log_parameters))
+
+    damping = np.full(n_groups, 1e-3)
+    converged = np.zeros(n_groups, dtype=bool)
+    failed = find_degenerate_groups(stacked, n_parameters)
+    iterations = np.zeros(n_groups, dtype=np.int64)
+    identity = np.eye(n_parameters)
+
+    for _ in range(max_fit_iterations):
+        active = np.flatnonzero(~converged & ~failed)
+        if len(active) == 0:
+            break
+        iterations[active] += 1
+
+        ages = stacked.ages[active]
+        mortality_rate = stacked.mortality_rate[active]
+        mask = stacked.mask[active]
+        active_parameters = parameters[active]
+        active_cost = cost[active]
+        curve_parameters = _to_curve_parameters(active_parameters, log_parameters)
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            _, residuals = _compute_residuals(function, ages, mortality_rate, mask, curve_parameters)
+            active_jacobian = jacobian(ages, *_columns(curve_parameters))
+            # chain rule of the log space parameters, d/d log(p) = p * d/dp
+            active_jacobian[..., log_parameters] *= curve_parameters[:, None, log_parameters]
+        active_jacobian = np.where(mask[..., None] & np.isfinite(active_jacobian), active_jacobian, 0.0)
+
+        jacobian_transpose = active_jacobian.transpose(0, 2, 1)
+        jtj = jacobian_transpose @ active_jacobian
+        jtr = (jacobian_transpose @ residuals[..., None])[..., 0]
+
+        # Marquardt's scaling of the damping by the diagonal of J^T J
+        damped = jtj + damping[active, None, None] * (jtj * identity)
+        step, solvable = _solve_normal_equations(damped, jtr)
+
+        candidate_parameters = active_parameters + step
+        with np.errstate(over='ignore', invalid='ignore'):
+            candidate_cost, _ = _compute_residuals(function, ages, mortality_rate, mask,
+                                                   _to_curve_parameters(candidate_parameters, log_parameters))
+
+        improved = solvable & np.isfinite(candidate_cost) & (candidate_cost <= active_cost)
+
+        relative_reduction = np.abs(active_cost - candidate_cost) / np.maximum(active_cost,
+                                                                               np.finfo(np.float64).tiny)
+        step_size = np.linalg.norm(step, axis=1)
+        small_step = step_size <= tolerance * (np.linalg.norm(candidate_parameters, axis=1) + tolerance)
+
+        parameters[active] = np.where(improved[:, None], candidate_parameters, active_parameters)
+        cost[active] = np.where(improved, candidate_cost, active_cost)
+
+        damping[active] = np.clip(np.where(improved, damping[active] / DAMPING_FACTOR,
+                                           damping[active] * DAMPING_FACTOR), MIN_DAMPING, MAX_DAMPING)
+
+        converged[active] = solvable & ((improved & (relative_reduction <= tolerance)) | small_step)
+        failed[active] = ~solvable
+
+    return _to_curve_parameters(parameters, log_parameters), cost, converged, iterations, failed
+
+
+def fit_gompertz_batch(stacked: StackedDatasets,
+                       initial_parameters: GompertzParameters = DEFAULT_INITIAL_PARAMETERS,
+                       max_fit_iterations: int = 200,
+                       tolerance: float = 1.49012e-08) -> ({str: GompertzParameters}, BatchFitReport):
+    """Fits a Gompertz curve to every group of `stacked` at once with
+       `fit_batch` in (log(alpha), beta) space, starting from the log-linear
+       fit of every group. `initial_parameters` are the start of the groups
+       without a log-linear fit."""
+    start_time = time.perf_counter()
+
+    fitted, cost, converged, iterations, failed = fit_batch(gompertz, gompertz_jacobian, stacked,
+                                                            gompertz_warm_start(stacked, initial_parameters),
+                                                            max_fit_iterations=max_fit_iterations,
+                                                            tolerance=tolerance,
+                                                            log_parameters=GOMPERTZ_LOG_PARAMETERS)
+
+    parameters = {}
+    for i, key in enumerate(stacked.keys):
+        parameters[key] = GompertzParameters(alpha=fitted[i, 0], beta=fitted[i, 1])
+
+    elapsed_seconds = time.perf_counter() - start_time
+    report = BatchFitReport(keys=stacked.keys, converged=converged, failed=failed, iterations=iterations,
+                            cost=cost, elapsed_seconds=elapsed_seconds)
+    return parameters, report
+
+
+class BatchParameters(Parameters):
+    """Drop-in replacement for `Parameters` that fits all intervention
+       combinations at once instead of one `curve_fit` call per key.
+       If a `cache` is given, only the groups without a cached fit are fitted"""
+
+    FIT_METHOD = 'batch_lm'
+
+    def __init__(self, dataset, max_fit_iterations: int = 200, cache: Optional[FitCache] = None):
+        super().__init__(dataset, cache)
+        self.max_fit_iterations = max_fit_iterations
+        self.report = None
+
+    def compute(self):
+        if self.cache is None:
+            parameters, self.report = fit_gompertz_batch(stack_datasets(self.dataset),
+                                                         max_fit_iterations=self.max_fit_iterations)
+            self.alphas = {key: parameters[key].alpha for key in self.dataset.keys()}
+            self.betas = {key: parameters[key].beta for key in self.dataset.keys()}
+            return self
+
+        # only the groups that have not been fitted before are stacked and fitted
+        fit_keys = {}
+        uncached_dataset = {}
+        for key, current_dataset in self.dataset.items():
+            fit_key = compute_fit_key(calculate_ages(current_dataset),
+                                      calculate_mortality_rate(current_dataset),
+                                      DEFAULT_INITIAL_PARAMETERS.to_tuple(),
+                                      self.max_fit_iterations,
+                                      method=self.FIT_METHOD)
+            fit_keys[key] = fit_key
+
+            cached_parameters = self.cache.get(fit_key)
+            if cached_parameters is None:
+                uncached_dataset[key] = current_dataset
+            else:
+                self.alphas[key], self.betas[key] = np.array(cached_parameters)
+
+        stacked = stack_datasets(uncached_dataset)
+        parameters, self.report = fit_gompertz_batch(stacked, max_fit_iterations=self.max_fit_iterations)
+
+        for key, predicted_parameters in parameters.items():
+            self.cache.put(fit_keys[key], predicted_parameters.to_tuple())
+            self.alphas[key] = predicted_parameters.alpha
+            self.betas[key] = predicted_parameters.beta
+
+        # keep the same key order as the dataset
+        self.alphas = {key: self.alphas[key] for key in self.dataset.keys()}
+        self.betas = {key: self.betas[key] for key in self.dataset.keys()}
+        return self
+
+
+def compare_with_loop(dataset: dict) -> pd.DataFrame:
+    """Fits `dataset` with both the per-key `curve_fit` loop and the
+       batched fitter and returns the parameters and timings of both"""
+    start_time = time.perf_counter()
+    loop_parameters = Parameters(dataset).compute()
+    loop_seconds = time.perf_counter() - start_time
+
+    batch_parameters = BatchParameters(dataset).compute()
+    report = batch_parameters.report
+
+    comparison = report.to_frame()
+    comparison['loop_alpha'] = [loop_parameters.alphas[key] for key in report.keys]
+    comparison['loop_beta'] = [loop_parameters.betas[key] for key in report.keys]
+    comparison['batch_alpha'] = [batch_parameters.alphas[key] for key in report.keys]
+    comparison['batch_beta'] = [batch_parameters.betas[key] for key in report.keys]
+    comparison.attrs['loop_seconds'] = loop_seconds
+    comparison.attrs['batch_seconds'] = report.elapsed_seconds
+    comparison.attrs['speedup'] = loop_seconds / max(report.elapsed_seconds, np.finfo(np.float64).tiny)
+    return comparison
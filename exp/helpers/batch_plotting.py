@@ -0,0 +1,215 @@
+import gc
+import os
+
+import numpy as np
+
+from dataclasses import dataclass, field
+from math import ceil
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import Union
+
+from .data import NO_INTERVENTION_DATASET_KEY
+from .gompertz import calculate_ages, calculate_mortality_rate
+from .plotting import COLOR_MAP, EPS
+from .worker_pool import WorkerPool
+
+DEFAULT_FORMATS = ('png',)
+SUPPORTED_FORMATS = ('png', 'pdf', 'svg')
+AGE_LABEL = 'Age of Mice (Years)'
+
+SINGLE_FIGURE_SIZE = (6.4, 4.8)
+PANEL_FIGURE_SIZE = (15, 10)
+LINES_FIGURE_SIZE = (15, 5)
+N_PANEL_COLUMNS = 2
+
+
+@dataclass
+class RenderJob:
+    """Everything needed to draw one figure of `Plotter.plot(n_interventions)`.
+       `observed` holds the observed (ages, log mortality) of the plotted groups"""
+    name: str
+    n_interventions: int
+    ages: np.array
+    log_mortality: Union[dict, np.array]
+    observed: dict = field(default_factory=dict)
+    keys: Union[str, list] = NO_INTERVENTION_DATASET_KEY
+
+
+def compute_observed_log_mortality(dataset, keys: [str]) -> dict:
+    """Returns the observed (ages, log mortality) of `keys`, which is computed
+       once per group instead of on every plot"""
+    observed = {}
+    for key in keys:
+        if key in dataset and key not in observed:
+            observed[key] = (calculate_ages(dataset[key]), np.log(calculate_mortality_rate(dataset[key]) + EPS))
+    return observed
+
+def create_render_job(name: str, n_interventions: int, dataset, ages: np.array,
+                      log_mortality: Union[dict, np.array],
+                      keys: Union[str, list] = NO_INTERVENTION_DATASET_KEY) -> RenderJob:
+    """Creates the job of the figure that `Plotter(dataset, ages, log_mortality, keys).plot(n_interventions)` shows"""
+    if n_interventions == 0:
+        observed_keys = [keys]
+    elif n_interventions == 1:
+        observed_keys = list(keys)
+    elif n_interventions == 3:
+        observed_keys = list(log_mortality.keys())
+    else:
+        observed_keys = []
+
+    return RenderJob(name=name, n_interventions=n_interventions, ages=np.asarray(ages), log_mortality=log_mortality,
+                     observed=compute_observed_log_mortality(dataset, observed_keys), keys=keys)
+
+
+class _Panel:
+    """An axis with an observed data and a fitted line, which are updated in place"""
+
+    def __init__(self, axis):
+        self.axis = axis
+        self.observed, = axis.plot([], [], linestyle='none', marker='o', markersize=6,
+                                   color=COLOR_MAP[0], label='Observed Data')
+        self.fit, = axis.plot([], [], color=COLOR_MAP[1])
+        axis.set_xlabel(AGE_LABEL)
+
+    def update(self, observed: tuple, ages: np.array, log_mortality: np.array, fit_label: str, ylabel: str,
+               legend: bool) -> None:
+        self.axis.set_visible(True)
+        self.observed.set_visible(observed is not None)
+        if observed is not None:
+            self.observed.set_data(*observed)
+        self.fit.set_data(ages, log_mortality)
+        self.fit.set_label(fit_label)
+        self.axis.set_ylabel(ylabel)
+
+        self.axis.relim(visible_only=True)
+        self.axis.autoscale_view()
+
+        if legend:
+            self.axis.legend()
+        elif self.axis.get_legend() is not None:
+            self.axis.get_legend().remove()
+
+
+class FigureRenderer:
+    """Renders `RenderJob`s on the Agg canvas without pyplot.
+
+       One figure is kept per layout and its artists are updated with
+       `set_data`, so rendering many groups does not rebuild subplots. The
+       figures are never registered with pyplot, so they are freed on
+       `close` (or at the end of a `with` block) and cannot accumulate."""
+
+    def __init__(self, formats: [str] = DEFAULT_FORMATS, dpi: int = 100):
+        unsupported = set(formats) - set(SUPPORTED_FORMATS)
+        if unsupported:
+            raise ValueError(f'Unsupported formats {sorted(unsupported)}, use {SUPPORTED_FORMATS}')
+
+        self.formats = list(formats)
+        self.dpi = dpi
+        self.layouts = {}
+
+    def render(self, job: RenderJob, directory: str) -> [str]:
+        """Draws `job` and writes it in every format to `directory`, returns the paths"""
+        if job.n_interventions in (0, 4):
+            figure = self._render_single(job)
+        elif job.n_interventions in (1, 3):
+            figure = self._render_panels(job)
+        elif job.n_interventions == 2:
+            figure = self._render_lines(job)
+        else:
+            raise ValueError('There cannot be more than 4 interventions')
+
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for file_format in self.formats:
+            path = os.path.join(directory, f'{job.name}.{file_format}')
+            figure.savefig(path, format=file_format, dpi=self.dpi)
+            paths.append(path)
+        return paths
+
+    def _figure(self, layout, figure_size, n_rows: int = 1, n_columns: int = 1):
+        if layout not in self.layouts:
+            figure = Figure(figsize=figure_size)
+            FigureCanvasAgg(figure)
+            axes = figure.subplots(n_rows, n_columns, squeeze=False).flatten()
+            self.layouts[layout] = (figure, [_Panel(axis) for axis in axes])
+        return self.layouts[layout]
+
+    def _render_single(self, job: RenderJob) -> Figure:
+        figure, (panel,) = self._figure('single', SINGLE_FIGURE_SIZE)
+        if job.n_interventions == 0:
+            panel.update(job.observed.get(job.keys), job.ages, job.log_mortality, 'Fit',
+                         'Mortality Rate (Control Group)', legend=True)
+        else:
+            panel.update(None, job.ages, job.log_mortality, 'All Interventions', 'Mortality Rate', legend=True)
+        return figure
+
+    def _render_panels(self, job: RenderJob) -> Figure:
+        keys = list(job.keys) if job.n_interventions == 1 else list(job.log_mortality.keys())
+        n_rows = max(ceil(len(keys) / N_PANEL_COLUMNS), 1)
+        figure, panels = self._figure(('panels', n_rows), PANEL_FIGURE_SIZE, n_rows, N_PANEL_COLUMNS)
+
+        for panel, key in zip(panels, keys):
+            if job.n_interventions == 1:
+                panel.update(job.observed.get(key), job.ages, job.log_mortality[key], 'All Gompertz Fit',
+                             f'Mortality Rate ({key})', legend=False)
+            else:
+                panel.update(job.observed.get(key), job.ages, job.log_mortality[key], key,
+                             'Mortality Rate', legend=True)
+        for panel in panels[len(keys):]:
+            panel.axis.set_visible(False)
+
+        figure.tight_layout()
+        return figure
+
+    def _render_lines(self, job: RenderJob) -> Figure:
+        figure, (panel,) = self._figure('lines', LINES_FIGURE_SIZE)
+        axis = panel.axis
+        panel.observed.set_visible(False)
+        panel.fit.set_visible(False)
+
+        lines = [line for line in axis.get_lines() if line not in (panel.observed, panel.fit)]
+        for index, (key, log_mortality) in enumerate(job.log_mortality.items()):
+            if index < len(lines):
+                line = lines[index]
+            else:
+                line, = axis.plot([], [])
+                lines.append(line)
+            line.set_data(job.ages, log_mortality)
+            line.set_label(key)
+            line.set_color(COLOR_MAP[index % len(COLOR_MAP)])
+            line.set_visible(True)
+        for line in lines[len(job.log_mortality):]:
+            line.set_visible(False)
+            line.set_label('_hidden')
+
+        axis.set_title('Two Intervention Mortality Rate')
+        axis.set_ylabel('Log Mortality Rate')
+        axis.relim(visible_only=True)
+        axis.autoscale_view()
+        # invisible lines still get legend entries, so only the lines of this job are passed
+        axis.legend(handles=lines[:len(job.log_mortality)])
+        return figure
+
+    def close(self) -> None:
+        for figure, _ in self.layouts.values():
+            figure.clear()
+        self.layouts.clear()
+        gc.collect()
+
+    def __enter__(self) -> 'FigureRenderer':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+
+def render_batch(jobs: [RenderJob], directory: str, formats: [str] = DEFAULT_FORMATS, dpi: int = 100,
+                 n_workers: int = 1, chunk_size: int = 16, max_jobs_per_worker: int = None) -> [[str]]:
+    """Renders `jobs` headlessly into `directory`, in a process pool for
+       `n_workers` > 1. Every worker keeps one `FigureRenderer`;
+       `max_jobs_per_worker` additionally restarts the workers after that
+       many jobs. Returns the written paths of every job."""
+    with WorkerPool((list(formats), dpi), n_workers, create_state=FigureRenderer,
+                    max_tasks_per_child=max_jobs_per_worker) as pool:
+        return list(pool.map(FigureRenderer.render, jobs, [directory] * len(jobs), chunk_size=chunk_size))
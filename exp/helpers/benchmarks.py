@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import scipy
+
+from collections.abc import Mapping
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from functools import partial
+
+from .data import (ALL_GROUP, CATEGORY_COLUMN, CONTROL_GROUP, NO_INTERVENTION_DATASET_KEY, ONE_REMOVED_PREFIX,
+                   SEX_COLUMN, create_combination_keys, create_dataset_mapping, extract_one_intervention_keys,
+                   load_and_preprocess)
+from .gompertz import Parameters, gompertz
+from .interaction_factors import InteractionFactors
+from .intervention_slopes import InterventionSlopes
+from .mortality_rate import KeyedMortality, MortalityRateArguments, MortalityRateFactory
+
+EXP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIRECTORY = os.path.join(EXP_DIRECTORY, 'benchmark_results')
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+
+# ranges of the Gompertz parameters fitted to the RMR data (ages in years)
+LOG_ALPHA_RANGE = (np.log(1e-5), np.log(3e-3))
+BETA_RANGE = (2.0, 4.5)
+AGE_RANGE_IN_DAYS = (580, 880)
+
+
+@dataclass
+class BenchmarkScale:
+    n_groups: int
+    points_per_group: int
+    n_interventions: int
+    n_evaluation_ages: int
+    n_repeats: int
+
+
+SCALES = {
+    # the size of the RMR female dataset
+    'current': BenchmarkScale(n_groups=10, points_per_group=35, n_interventions=4, n_evaluation_ages=35, n_repeats=20),
+    'medium': BenchmarkScale(n_groups=500, points_per_group=200, n_interventions=8, n_evaluation_ages=1_000, n_repeats=5),
+    # 4000 groups x 250 points = 1M points
+    'large': BenchmarkScale(n_groups=4_000, points_per_group=250, n_interventions=12, n_evaluation_ages=10_000, n_repeats=3)
+}
+
+
+def _intervention_names(n_interventions: int) -> [str]:
+    return [f'Intervention{index:02d}' for index in range(n_interventions)]
+
+def _synthetic_survival(rng: np.random.Generator, n_points: int) -> (np.array, np.array):
+    """Returns digitized-like (x in days, survival y) points of a random Gompertz curve"""
+    alpha = np.exp(rng.uniform(*LOG_ALPHA_RANGE))
+    beta = rng.uniform(*BETA_RANGE)
+
+    x = np.sort(rng.uniform(*AGE_RANGE_IN_DAYS, n_points))
+    mortality_rate = gompertz(x / 365, alpha, beta) + rng.normal(0, 0.01, n_points)
+    y = np.clip(1 - mortality_rate, 0, 1)
+    return np.round(x, 4), np.round(y, 4)
+
+def create_synthetic_dataset(n_groups: int, points_per_group: int, n_interventions: int = 4,
+                             seed: int = 0) -> pd.DataFrame:
+    """Returns a dataset in the format of `female_final.csv` with Gompertz
+       survival curves of the RMR groups (no intervention, the single, the
+       one-removed and all interventions) and of additional replicate groups
+       up to `n_groups` groups"""
+    rng = np.random.default_rng(seed)
+    one_interventions = _intervention_names(n_interventions)
+
+    categories = [CONTROL_GROUP] + one_interventions
+    categories += [ONE_REMOVED_PREFIX + intervention for intervention in one_interventions] + [ALL_GROUP]
+    categories += [f'Replicate{index:05d}' for index in range(max(n_groups - len(categories), 0))]
+    categories = categories[:n_groups]
+
+    xs, ys = zip(*[_synthetic_survival(rng, points_per_group) for _ in categories])
+    return pd.DataFrame({
+        'x': np.concatenate(xs),
+        'y': np.concatenate(ys),
+        SEX_COLUMN: 'female',
+        CATEGORY_COLUMN: np.repeat(categories, points_per_group)
+    })
+
+
+@dataclass
+class SyntheticModel:
+    one_interventions: [str]
+    three_interventions: [str]
+    dataset: dict
+    parameters: Parameters
+    evaluation_ages: np.array
+    one_intervention_mortality: np.array
+    three_intervention_mortality: np.array
+
+def create_synthetic_model(n_interventions: int, n_evaluation_ages: int, points_per_group: int,
+                           seed: int = 0) -> SyntheticModel:
+    """Returns the inputs of the interaction model for `n_interventions`
+       interventions, i.e. the data and the Gompertz parameters of no
+       intervention, of every single and three intervention combination and
+       of all interventions"""
+    rng = np.random.default_rng(seed)
+    one_interventions = _intervention_names(n_interventions)
+    three_interventions = create_combination_keys(one_interventions, 3)
+    keys = [NO_INTERVENTION_DATASET_KEY] + one_interventions + three_interventions + [','.join(one_interventions)]
+
+    dataset = {}
+    parameters = Parameters(dataset)
+    for key in dict.fromkeys(keys):
+        x, y = _synthetic_survival(rng, points_per_group)
+        dataset[key] = pd.DataFrame({'x': x, 'y': y})
+        parameters.alphas[key] = np.exp(rng.uniform(*LOG_ALPHA_RANGE))
+        parameters.betas[key] = rng.uniform(*BETA_RANGE)
+
+    evaluation_ages = np.linspace(*AGE_RANGE_IN_DAYS, n_evaluation_ages) / 365
+    one_mortality = np.array([gompertz(evaluation_ages, *parameters[key]) for key in one_interventions])
+    three_mortality = np.array([gompertz(evaluation_ages, *parameters[key]) for key in three_interventions])
+
+    return SyntheticModel(one_interventions=one_interventions, three_interventions=three_interventions,
+                          dataset=dataset, parameters=parameters, evaluation_ages=evaluation_ages,
+                          one_intervention_mortality=one_mortality, three_intervention_mortality=three_mortality)
+
+
+def measure(function, n_repeats: int) -> dict:
+    """Times `n_repeats` calls of `function` after one warm-up call"""
+    function()
+
+    seconds = []
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+
+    seconds = np.array(seconds)
+    return {
+        'n_repeats': n_repeats,
+        'min_seconds': float(seconds.min()),
+        'median_seconds': float(np.median(seconds)),
+        'mean_seconds': float(seconds.mean()),
+        'std_seconds': float(seconds.std())
+    }
+
+
+def _dataset_benchmarks(scale: BenchmarkScale, directory: str) -> dict:
+    raw_dataset = create_synthetic_dataset(scale.n_groups, scale.points_per_group, min(scale.n_interventions, 4))
+    path = os.path.join(directory, 'synthetic_final.csv')
+    raw_dataset.to_csv(path, index=False)
+
+    dataset = load_and_preprocess(path)
+    one_interventions = extract_one_intervention_keys(dataset)
+    mapping = create_dataset_mapping(dataset, one_interventions)
+
+    return {
+        'load_and_preprocess': lambda: load_and_preprocess(path),
+        'create_dataset_mapping': lambda: create_dataset_mapping(dataset, one_interventions),
+        'Parameters.compute': lambda: Parameters(mapping).compute()
+    }
+
+def _model_benchmarks(scale: BenchmarkScale) -> dict:
+    model = create_synthetic_model(scale.n_interventions, scale.n_evaluation_ages, scale.points_per_group)
+    interaction_factors = InteractionFactors(model.one_intervention_mortality, model.three_intervention_mortality)
+    interaction_factors.calculate()
+
+    def create_arguments(intervention_keys):
+        return MortalityRateArguments(parameters=model.parameters, dataset=model.dataset,
+                                      intervention_keys=intervention_keys, interaction_factors=interaction_factors,
+                                      evaluation_ages=model.evaluation_ages,
+                                      one_intervention_mortality=model.one_intervention_mortality)
+
+    def calculate_interaction_factors():
+        InteractionFactors(model.one_intervention_mortality, model.three_intervention_mortality).calculate()
+
+    benchmarks = {'InteractionFactors.calculate': calculate_interaction_factors}
+
+    all_keys = {}
+    levels = {0: NO_INTERVENTION_DATASET_KEY, 1: model.one_interventions}
+    for order in sorted({2, 3, scale.n_interventions}):
+        levels[order] = create_combination_keys(model.one_interventions, order)
+    for n_interventions, intervention_keys in levels.items():
+        arguments = create_arguments(intervention_keys)
+        factory = MortalityRateFactory(n_interventions)
+        benchmarks[f'MortalityRateFactory({n_interventions})'] = partial(factory.create, arguments)
+        all_keys[n_interventions] = intervention_keys
+
+    # the log mortality of every combination of the predicted levels, as in 004_SecondOrderModel.ipynb
+    ranked_keys, log_mortality = [], []
+    for n_interventions, intervention_keys in all_keys.items():
+        if n_interventions == 0:
+            continue
+        mortality_rate = MortalityRateFactory(n_interventions).create(create_arguments(intervention_keys))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mortality_rate = mortality_rate.mortality_rate.log()
+        if isinstance(mortality_rate, Mapping):
+            ranked_keys += list(mortality_rate.keys())
+            log_mortality += list(mortality_rate.values())
+        else:
+            ranked_keys.append(','.join(model.one_interventions))
+            log_mortality.append(mortality_rate)
+    log_mortality = np.array(log_mortality)
+
+    def rank_interventions():
+        slopes = InterventionSlopes()
+        slopes.add_intervention_slopes(ranked_keys, model.evaluation_ages, log_mortality)
+        return slopes.calculate_best_intervention()
+
+    def rank_interventions_by_key():
+        slopes = InterventionSlopes()
+        for key, values in zip(ranked_keys, log_mortality):
+            slopes.add_intervention_slope(key, model.evaluation_ages, values)
+        return slopes.calculate_best_intervention()
+
+    keyed_mortality = KeyedMortality(ranked_keys, np.exp(log_mortality))
+
+    benchmarks['InterventionSlopes ranking'] = rank_interventions
+    benchmarks['KeyedMortality.argmin_slope'] = lambda: keyed_mortality.argmin_slope(model.evaluation_ages)
+    benchmarks['InterventionSlopes ranking (per key)'] = rank_interventions_by_key
+    return benchmarks
+
+
+def run_benchmarks(scale_name: str = 'current', selected: [str] = None) -> dict:
+    """Runs all benchmarks (or the `selected` ones) at one of `SCALES` and
+       returns the results with the metadata needed to compare runs"""
+    scale = SCALES[scale_name]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = _dataset_benchmarks(scale, directory)
+        benchmarks.update(_model_benchmarks(scale))
+
+        for name, function in benchmarks.items():
+            if selected is not None and name not in selected:
+                continue
+            result = {'name': name, 'scale': scale_name}
+            result.update(measure(function, scale.n_repeats))
+            results.append(result)
+
+    return {'metadata': collect_metadata(scale_name), 'results': results}
+
+def _git(*arguments) -> str:
+    try:
+        output = subprocess.run(['git', *arguments], cwd=EXP_DIRECTORY, capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def collect_metadata(scale_name: str) -> dict:
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'scale': scale_name,
+        'parameters': asdict(SCALES[scale_name]),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def save_results(results: dict, path: str = None) -> str:
+    """Stores `results` as json, by default as `benchmark_results/<commit>-<scale>.json`"""
+    if path is None:
+        commit = results['metadata']['commit'][:10] or 'unknown'
+        path = os.path.join(DEFAULT_RESULTS_DIRECTORY, f'{commit}-{results["metadata"]["scale"]}.json')
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    return path
+
+def load_results(path: str) -> dict:
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def compare_results(baseline: dict, current: dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> pd.DataFrame:
+    """Compares the median times of two runs. A benchmark is a regression
+       if it got more than `threshold` times slower"""
+    def to_series(results):
+        return pd.Series({(result['scale'], result['name']): result['median_seconds'] for result in results['results']})
+
+    comparison = pd.DataFrame({'baseline_seconds': to_series(baseline), 'current_seconds': to_series(current)})
+    comparison['ratio'] = comparison['current_seconds'] / comparison['baseline_seconds']
+    comparison['regression'] = comparison['ratio'] > threshold
+    comparison['improvement'] = comparison['ratio'] < 1 / threshold
+    comparison.index.names = ['scale', 'name']
+    return comparison
+
+
+def main(argv: [str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the hot paths of the helpers pipeline')
+    parser.add_argument('--scale', choices=list(SCALES), nargs='+', default=['current'])
+    parser.add_argument('--benchmark', action='append', help='only run the benchmarks with this name')
+    parser.add_argument('--output', help='json file of the results (default: benchmark_results/<commit>-<scale>.json)')
+    parser.add_argument('--compare', help='json file of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    arguments = parser.parse_args(argv)
+
+    n_regressions = 0
+    for scale_name in arguments.scale:
+        results = run_benchmarks(scale_name, arguments.benchmark)
+        output = arguments.output if len(arguments.scale) == 1 else None
+        path = save_results(results, output)
+
+        print(pd.DataFrame(results['results']).set_index('name').drop(columns='scale').to_string())
+        print(f'Saved the results to {path}')
+
+        if arguments.compare:
+            comparison = compare_results(load_results(arguments.compare), results, arguments.threshold)
+            print(comparison.dropna().to_string())
+            n_regressions += int(comparison['regression'].sum())
+
+    return 1 if n_regressions > 0 else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from .batch_gompertz import StackedDatasets, fit_gompertz_batch, stack_datasets
+from .data import CONTROL_GROUP, NO_INTERVENTION_DATASET_KEY, create_combination_keys
+from .gompertz import gompertz
+from .interaction_factors import InteractionFactors, create_combination_indices
+from .intervention_ranking import InterventionRanking, NO_INTERVENTION_KEY
+from .intervention_slopes import InterventionSlopes
+from .mortality_rate import EPS
+from .running_statistics import RunningMoments, RunningQuantile
+from .worker_pool import WorkerPool
+
+DEFAULT_QUANTILES = (0.025, 0.5, 0.975)
+
+
+@dataclass
+class BootstrapSetup:
+    stacked: StackedDatasets
+    one_interventions: [str]
+    evaluation_ages: np.array
+    max_fit_iterations: int = 200
+
+
+@dataclass
+class BootstrapResult:
+    parameter_intervals: pd.DataFrame
+    ranking_intervals: pd.DataFrame
+    n_replicates: int
+    n_ranked_replicates: int
+    elapsed_seconds: float
+
+
+def resample_stacked(stacked: StackedDatasets, rng: np.random.Generator) -> StackedDatasets:
+    """Resamples the points of every group with replacement, keeping the group sizes"""
+    group_sizes = stacked.mask.sum(axis=1)
+    indices = np.floor(rng.random(stacked.ages.shape) * group_sizes[:, None]).astype(np.int64)
+    indices = np.where(stacked.mask, indices, 0)
+
+    ages = np.take_along_axis(stacked.ages, indices, axis=1)
+    mortality_rate = np.take_along_axis(stacked.mortality_rate, indices, axis=1)
+    return StackedDatasets(keys=stacked.keys, ages=np.where(stacked.mask, ages, 0.0),
+                           mortality_rate=np.where(stacked.mask, mortality_rate, 0.0), mask=stacked.mask)
+
+
+def _ranked_keys(one_interventions: [str]) -> [str]:
+    keys = [NO_INTERVENTION_KEY]
+    for order in range(1, len(one_interventions) + 1):
+        keys += create_combination_keys(one_interventions, order)
+    return keys
+
+def _three_intervention_keys(setup: BootstrapSetup) -> [str]:
+    """Returns the observed three intervention groups, to which the interaction
+       factors are fitted (as in `fit_interaction_factors`)"""
+    return [key for key in create_combination_keys(setup.one_interventions, 3) if key in setup.stacked.keys]
+
+def _ranking_keys(setup: BootstrapSetup) -> [str]:
+    """Returns the dataset keys of the groups whose fits the ranking uses"""
+    return [NO_INTERVENTION_DATASET_KEY] + setup.one_interventions + _three_intervention_keys(setup)
+
+def _compute_slopes(setup: BootstrapSetup, parameters: dict) -> np.array:
+    """Returns the log mortality slope of no intervention and of every
+       intervention combination in the order of `_ranked_keys`"""
+    ages = setup.evaluation_ages
+    one_interventions = setup.one_interventions
+    three_interventions = _three_intervention_keys(setup)
+
+    one_intervention_mortality = [gompertz(ages, *parameters[key].to_tuple()) for key in one_interventions]
+    three_intervention_mortality = [gompertz(ages, *parameters[key].to_tuple()) for key in three_interventions]
+    no_intervention_mortality = gompertz(ages, *parameters[NO_INTERVENTION_DATASET_KEY].to_tuple())
+
+    interaction_factors = InteractionFactors(one_intervention_mortality, three_intervention_mortality,
+                                             one_interventions=one_interventions,
+                                             three_interventions=three_interventions)
+    interaction_factors.calculate()
+
+    ranking = InterventionRanking(one_interventions, one_intervention_mortality, interaction_factors, ages)
+    no_intervention_slope = InterventionSlopes.calculate_slopes(ages, np.log(no_intervention_mortality + EPS))
+
+    all_combinations = []
+    for order in range(1, len(one_interventions) + 1):
+        all_combinations += create_combination_indices(len(one_interventions), order)
+    return np.concatenate([[no_intervention_slope], ranking.score(all_combinations)])
+
+def run_replicate(setup: BootstrapSetup, seed_sequence: np.random.SeedSequence) -> np.array:
+    """Runs one bootstrap replicate and returns the concatenated
+       [alphas, betas, slopes] of the replicate. The parameters of the groups
+       that did not converge are NaN, and so are all slopes if any group the
+       ranking uses did not converge, so the replicate is left out of the ranking."""
+    rng = np.random.default_rng(seed_sequence)
+    resampled = resample_stacked(setup.stacked, rng)
+    parameters, report = fit_gompertz_batch(resampled, max_fit_iterations=setup.max_fit_iterations)
+
+    alphas = np.array([parameters[key].alpha for key in setup.stacked.keys])
+    betas = np.array([parameters[key].beta for key in setup.stacked.keys])
+    alphas[~report.converged] = np.nan
+    betas[~report.converged] = np.nan
+
+    slopes = _compute_slopes(setup, parameters)
+    converged = dict(zip(setup.stacked.keys, report.converged))
+    if not all([converged[key] for key in _ranking_keys(setup)]):
+        slopes = np.full(len(slopes), np.nan)
+
+    return np.concatenate([alphas, betas, slopes])
+
+
+class Bootstrap:
+    """Bootstrap confidence intervals of the Gompertz parameters of every group
+       and of the log mortality slopes and ranks of every intervention combination.
+
+       Each replicate resamples the points of every group, refits all groups at
+       once and recomputes the interaction model and the slopes. Replicates run
+       in a process pool; replicate i always uses the i-th child of `seed`, so
+       the results do not depend on the number of workers. The results stream
+       into running quantile and moment accumulators, so memory does not grow
+       with the number of replicates."""
+
+    def __init__(self, dataset, one_interventions: [str], evaluation_ages: np.array,
+                 quantiles: (float,) = DEFAULT_QUANTILES, max_fit_iterations: int = 200):
+        self.setup = BootstrapSetup(stacked=stack_datasets(dataset), one_interventions=list(one_interventions),
+                                    evaluation_ages=np.asarray(evaluation_ages), max_fit_iterations=max_fit_iterations)
+        self.quantiles = quantiles
+
+        missing_keys = [key for key in [NO_INTERVENTION_DATASET_KEY] + self.setup.one_interventions
+                        if key not in self.setup.stacked.keys]
+        if missing_keys:
+            raise ValueError(f'The ranking needs the control and single intervention groups, '
+                             f'{missing_keys} are missing')
+
+    def run(self, n_replicates: int, seed: int = 42, n_workers: int = 1, chunk_size: int = 8) -> BootstrapResult:
+        start_time = time.perf_counter()
+        seed_sequences = np.random.SeedSequence(seed).spawn(n_replicates)
+
+        n_groups = len(self.setup.stacked.keys)
+        ranked_keys = _ranked_keys(self.setup.one_interventions)
+
+        moments = None
+        quantiles = None
+        rank_moments = RunningMoments(len(ranked_keys))
+        best_counts = np.zeros(len(ranked_keys))
+        n_ranked_replicates = 0
+
+        for replicate in self._map_replicates(seed_sequences, n_workers, chunk_size):
+            if moments is None:
+                moments = RunningMoments(len(replicate))
+                quantiles = [RunningQuantile(len(replicate), quantile) for quantile in self.quantiles]
+
+            moments.update(replicate)
+            for quantile in quantiles:
+                quantile.update(replicate)
+
+            # the slopes of replicates with non-converged fits are NaN and are not ranked
+            slopes = replicate[2 * n_groups:]
+            if not np.isnan(slopes).any():
+                ranks = np.empty(len(slopes))
+                ranks[np.argsort(slopes, kind='stable')] = np.arange(len(slopes))
+                rank_moments.update(ranks)
+                best_counts[np.argmin(slopes)] += 1
+                n_ranked_replicates += 1
+
+        parameter_intervals = self._create_parameter_intervals(moments, quantiles, n_groups)
+        ranking_intervals = self._create_ranking_intervals(moments, quantiles, n_groups, ranked_keys,
+                                                           rank_moments, best_counts / n_ranked_replicates
+                                                           if n_ranked_replicates > 0 else np.nan)
+        return BootstrapResult(parameter_intervals=parameter_intervals, ranking_intervals=ranking_intervals,
+                               n_replicates=n_replicates, n_ranked_replicates=n_ranked_replicates,
+                               elapsed_seconds=time.perf_counter() - start_time)
+
+    def _map_replicates(self, seed_sequences, n_workers, chunk_size):
+        # map keeps the replicate order, which keeps the streaming estimates deterministic
+        with WorkerPool(self.setup, n_workers) as pool:
+            yield from pool.map(run_replicate, seed_sequences, chunk_size=chunk_size)
+
+    def _summarize(self, moments, quantiles, columns: slice, prefix: str) -> dict:
+        mean = np.where(moments.count > 0, moments.mean, np.nan)
+        summary = {f'{prefix}_mean': mean[columns], f'{prefix}_std': np.sqrt(moments.variance()[columns])}
+        for quantile in quantiles:
+            summary[f'{prefix}_q{quantile.quantile:g}'] = quantile.value()[columns]
+        return summary
+
+    def _create_parameter_intervals(self, moments, quantiles, n_groups) -> pd.DataFrame:
+        keys = [CONTROL_GROUP if key == NO_INTERVENTION_DATASET_KEY else key for key in self.setup.stacked.keys]
+        if moments is None:
+            return pd.DataFrame(index=keys)
+
+        summary = self._summarize(moments, quantiles, slice(0, n_groups), 'alpha')
+        summary.update(self._summarize(moments, quantiles, slice(n_groups, 2 * n_groups), 'beta'))
+        return pd.DataFrame(summary, index=keys)
+
+    def _create_ranking_intervals(self, moments, quantiles, n_groups, ranked_keys,
+                                  rank_moments, best_probability) -> pd.DataFrame:
+        if moments is None:
+            return pd.DataFrame(index=ranked_keys)
+
+        summary = self._summarize(moments, quantiles, slice(2 * n_groups, None), 'slope')
+        summary['rank_mean'] = np.where(rank_moments.count > 0, rank_moments.mean, np.nan)
+        summary['p_best'] = best_probability
+        return pd.DataFrame(summary, index=ranked_keys).sort_values('rank_mean')
@@ -0,0 +1,273 @@
+import argparse
+import os
+import time
+
+from contextlib import contextmanager
+
+# only the standard library is imported here, so `--help` and the argument
+# parsing stay fast; every stage imports what it needs (scipy, torch or
+# matplotlib) when it runs
+
+EXP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATASET_PATHS = [os.path.join(EXP_DIRECTORY, '..', 'dat', 'final_datasets', file_name)
+                         for file_name in ('female_final.csv', 'male_final.csv')]
+DEFAULT_OUTPUT_DIRECTORY = 'results'
+
+STAGES = ('second-order', 'validation', 'mlp', 'plots')
+DEFAULT_STAGES = ('second-order', 'mlp')
+
+# ages (in days) at which notebook 005 scores the MLP predictions
+MLP_SCORING_AGES = (580, 900, 20)
+DAYS_PER_YEAR = 365
+
+
+@contextmanager
+def timed_stage(name: str, timings: dict):
+    """Prints the name and the duration of a stage and records the duration in `timings`"""
+    print(f'[{name}] running', flush=True)
+    start_time = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start_time
+    print(f'[{name}] done in {timings[name]:.2f}s', flush=True)
+
+
+def load_filtered_dataset(arguments: argparse.Namespace):
+    """Loads and concatenates the datasets and keeps the rows of the requested sexes, cohorts and sites"""
+    from .stratified import COHORT_COLUMN, SITE_COLUMN, load_combined_dataset
+    from .data import SEX_COLUMN
+
+    combined = load_combined_dataset(arguments.dataset)
+    for column, values in ((SEX_COLUMN, arguments.sex), (COHORT_COLUMN, arguments.cohort),
+                           (SITE_COLUMN, arguments.site)):
+        if not values:
+            continue
+        if column not in combined.columns:
+            raise ValueError(f'Cannot filter by {column}, the datasets have no {column} column')
+        combined = combined[combined[column].astype(str).isin(values)]
+
+    if combined.empty:
+        raise ValueError('No rows are left after filtering the datasets')
+    return combined.reset_index(drop=True)
+
+
+def run_second_order(arguments: argparse.Namespace, combined, context: dict) -> [str]:
+    """Runs the second-order model (notebook 004) for every stratum and writes the ranked combinations"""
+    from .stratified import StratifiedAnalysis
+
+    analysis = StratifiedAnalysis(combined)
+    results = analysis.run()
+    context['analysis'] = analysis
+
+    path = os.path.join(arguments.output, 'second_order.csv')
+    results.to_csv(path, index=False)
+    for stratum_key, stratum in analysis.strata.items():
+        best_key, best_slope = stratum.mortality_rate.argmin_slope(stratum.evaluation_ages)
+        print(f'  {"/".join(map(str, stratum_key)) or "all"}: lowest log mortality slope {best_key} ({best_slope:.4f})')
+
+    if arguments.save_artifacts:
+        from .artifacts import ArtifactStore, compute_dataset_hash
+
+        store = ArtifactStore() if arguments.artifacts is None else ArtifactStore(arguments.artifacts)
+        for stratum_key, stratum in analysis.strata.items():
+            name = '-'.join(['second_order'] + [str(value) for value in stratum_key])
+            key = store.save_model_results(name, compute_dataset_hash(combined), stratum.parameters,
+                                           stratum.interaction_factors, stratum.evaluation_ages,
+                                           stratum.mortality_rate,
+                                           metadata={'stratum': list(map(str, stratum_key)),
+                                                     'one_interventions': list(stratum.one_interventions),
+                                                     'three_interventions':
+                                                         list(stratum.interaction_factors.three_interventions)})
+            print(f'  saved artifact {key}')
+    return [path]
+
+
+def run_validation(arguments: argparse.Namespace, combined, context: dict) -> [str]:
+    """Cross-validates the second-order model on held-out points of every stratum"""
+    import pandas as pd
+
+    from .cross_validation import CrossValidation
+    from .stratified import STRATUM_COLUMNS
+
+    stratum_columns = [column for column in STRATUM_COLUMNS if column in combined.columns]
+    groups = combined.groupby(stratum_columns, sort=False) if stratum_columns else [((), combined)]
+
+    summaries = []
+    for stratum_key, rows in groups:
+        stratum_key = stratum_key if isinstance(stratum_key, tuple) else (stratum_key,)
+        result = CrossValidation(rows.reset_index(drop=True), n_splits=arguments.n_splits,
+                                 n_repeats=arguments.n_repeats).run(n_workers=arguments.workers)
+        print(f'  {"/".join(map(str, stratum_key)) or "all"}: {result}')
+
+        summary = result.summary().reset_index(names='score')
+        for column, value in zip(stratum_columns, stratum_key):
+            summary.insert(0, column, value)
+        summaries.append(summary)
+
+    path = os.path.join(arguments.output, 'validation.csv')
+    pd.concat(summaries, ignore_index=True).to_csv(path, index=False)
+    return [path]
+
+
+def run_mlp(arguments: argparse.Namespace, combined, context: dict) -> [str]:
+    """Scores every intervention combination by the rate of change per day of
+       the MLP predicted mortality rate at the scoring ages of notebook 005,
+       next to the rate of change of the second-order model of every stratum
+       at the same ages, so all sources are ranked by the same statistic. The
+       log mortality slope per year (see `InterventionSlopes.calculate_slopes`)
+       is added where the predicted mortality rate is positive; the MLP
+       predicts non-positive rates at the youngest ages of some combinations"""
+    import numpy as np
+    import pandas as pd
+
+    from .data import NO_INTERVENTION_DATASET_KEY, count_interventions, create_combination_keys
+    from .intervention_slopes import InterventionSlopes
+    from .mlp import ALL_TREATMENTS, MortalityPredictor
+    from .mortality_rate import EPS, compute_all_orders_mortality
+    from .stratified import StratifiedAnalysis
+
+    ages = np.arange(*MLP_SCORING_AGES)
+    ages_in_years = ages / DAYS_PER_YEAR
+
+    def score(source: str, keys: [str], mortality_rates: np.array) -> pd.DataFrame:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slopes = InterventionSlopes.calculate_slopes(ages_in_years, np.log(mortality_rates + EPS))
+        return pd.DataFrame({'source': source, 'key': keys,
+                             'n_interventions': [count_interventions(key) for key in keys],
+                             'slope': slopes,
+                             'rate_of_change': np.abs(mortality_rates[:, -1] - mortality_rates[:, 0])
+                                               / (ages[-1] - ages[0])})
+
+    predictor = MortalityPredictor.load(arguments.model)
+    keys = [key for n_interventions in range(len(ALL_TREATMENTS) + 1)
+            for key in create_combination_keys(ALL_TREATMENTS, n_interventions)]
+    predictions = predictor.predict_keys(ages, keys)
+    frames = [score('mlp', keys, np.array([predictions[key] for key in keys]))]
+
+    analysis = context.get('analysis')
+    if analysis is None:
+        analysis = StratifiedAnalysis(combined).fit()
+    for stratum_key, stratum in analysis.strata.items():
+        mortality = compute_all_orders_mortality(stratum.dataset, stratum.parameters, stratum.one_interventions,
+                                                 ages_in_years)
+        frames.append(score('/'.join(map(str, stratum_key)) or 'second-order', list(mortality.keys()),
+                            mortality.to_numpy()))
+
+    scores = pd.concat(frames, ignore_index=True)
+    scores['rank'] = scores.groupby('source')['rate_of_change'].rank(method='min').astype('Int64')
+    for source, source_scores in scores.groupby('source', sort=False):
+        best = source_scores.nsmallest(1, 'rate_of_change')
+        best_key = best['key'].iloc[0]
+        best_name = 'no interventions' if best_key == NO_INTERVENTION_DATASET_KEY else best_key
+        print(f'  {source}: lowest rate of change {best_name} '
+              f'({best["rate_of_change"].iloc[0]:.3e} per day)')
+
+    path = os.path.join(arguments.output, 'mlp_scores.csv')
+    scores.to_csv(path, index=False)
+    return [path]
+
+
+def run_plots(arguments: argparse.Namespace, combined, context: dict) -> [str]:
+    """Renders the figures of notebook 004 for every stratum"""
+    from .batch_plotting import create_render_job, render_batch
+    from .data import NO_INTERVENTION_DATASET_KEY
+    from .stratified import StratifiedAnalysis
+
+    analysis = context.get('analysis')
+    if analysis is None:
+        analysis = StratifiedAnalysis(combined)
+        analysis.run()
+
+    jobs = []
+    for stratum_key, stratum in analysis.strata.items():
+        log_mortality = stratum.mortality_rate.log()
+        four_interventions_key = next(iter(log_mortality.order(len(stratum.one_interventions))))
+        orders = [
+            (log_mortality[NO_INTERVENTION_DATASET_KEY], NO_INTERVENTION_DATASET_KEY),
+            (log_mortality.order(1), stratum.one_interventions),
+            (log_mortality.order(2), stratum.one_interventions),
+            (log_mortality.order(3).to_dict(), list(log_mortality.order(3).keys())),
+            (log_mortality[four_interventions_key], four_interventions_key)
+        ]
+        prefix = '-'.join(['second_order'] + [str(value) for value in stratum_key])
+        for n_interventions, (values, keys) in enumerate(orders):
+            jobs.append(create_render_job(f'{prefix}-{n_interventions}', n_interventions, stratum.dataset,
+                                          stratum.evaluation_ages, values, keys))
+
+    directory = os.path.join(arguments.output, 'figures')
+    os.makedirs(directory, exist_ok=True)
+    paths = render_batch(jobs, directory, formats=arguments.format, dpi=arguments.dpi, n_workers=arguments.workers)
+    return [path for job_paths in paths for path in job_paths]
+
+
+STAGE_RUNNERS = {
+    'second-order': run_second_order,
+    'validation': run_validation,
+    'mlp': run_mlp,
+    'plots': run_plots
+}
+
+
+def run(arguments: argparse.Namespace) -> int:
+    os.makedirs(arguments.output, exist_ok=True)
+    stages = [stage for stage in STAGES if stage in arguments.stages]
+
+    timings = {}
+    context = {}
+    with timed_stage('load', timings):
+        combined = load_filtered_dataset(arguments)
+        print(f'  {len(combined)} rows from {len(arguments.dataset)} datasets')
+
+    for stage in stages:
+        with timed_stage(stage, timings):
+            for path in STAGE_RUNNERS[stage](arguments, combined, context):
+                print(f'  wrote {path}')
+
+    print('timings: ' + ', '.join([f'{name} {seconds:.2f}s' for name, seconds in timings.items()])
+          + f', total {sum(timings.values()):.2f}s')
+    return 0
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m helpers',
+                                     description='Runs the analyses of the notebooks without Jupyter')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='runs the second-order model, its validation, '
+                                                   'the MLP scoring and the figures')
+    run_parser.add_argument('--dataset', action='append',
+                            help='final dataset csv, may be repeated (default: the female and male datasets)')
+    run_parser.add_argument('--sex', action='append', help='only use the rows of this sex, may be repeated')
+    run_parser.add_argument('--cohort', action='append', help='only use the rows of this cohort, may be repeated')
+    run_parser.add_argument('--site', action='append', help='only use the rows of this site, may be repeated')
+    run_parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(DEFAULT_STAGES))
+    run_parser.add_argument('--workers', type=int, default=1, help='processes of the validation and the plots')
+    run_parser.add_argument('--output', default=DEFAULT_OUTPUT_DIRECTORY, help='directory of the results')
+    run_parser.add_argument('--model', default=None, help='MLP model file (default: MLP_model.pth)')
+    run_parser.add_argument('--n-splits', type=int, default=5, help='folds of the validation')
+    run_parser.add_argument('--n-repeats', type=int, default=20, help='repeats of the validation')
+    run_parser.add_argument('--format', action='append', choices=('png', 'pdf', 'svg'),
+                            help='figure format, may be repeated (default: png)')
+    run_parser.add_argument('--dpi', type=int, default=100)
+    run_parser.add_argument('--save-artifacts', action='store_true',
+                            help='stores the second-order results in the artifact store')
+    run_parser.add_argument('--artifacts', default=None, help='directory of the artifact store')
+    return parser
+
+
+def main(argv: [str] = None) -> int:
+    parser = create_parser()
+    arguments = parser.parse_args(argv)
+
+    arguments.dataset = arguments.dataset or DEFAULT_DATASET_PATHS
+    arguments.format = arguments.format or ['png']
+    if arguments.model is None:
+        arguments.model = os.path.join(EXP_DIRECTORY, 'MLP_model.pth')
+
+    try:
+        return run(arguments)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
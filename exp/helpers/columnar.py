@@ -0,0 +1,179 @@
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from glob import glob
+from typing import Optional
+
+COLUMNAR_SUFFIX = '.columns'
+METADATA_FILENAME = 'metadata.json'
+MISSING_CODE = -1
+
+NUMERIC_COLUMN = 'numeric'
+CATEGORICAL_COLUMN = 'categorical'
+
+DEFAULT_DATASET_DIRECTORIES = ['final_datasets', 'RMR_data', 'ITP1_data']
+
+
+def detect_separator(csv_path: str) -> str:
+    """Returns ';' for the ITP style files and ',' otherwise"""
+    with open(csv_path, 'r', encoding='utf-8-sig') as file:
+        header = file.readline()
+    return ';' if header.count(';') > header.count(',') else ','
+
+def columnar_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + COLUMNAR_SUFFIX
+
+def read_csv(csv_path: str, sep: Optional[str] = None, dtype: Optional[dict] = None) -> pd.DataFrame:
+    """Reads a csv file with the C parser"""
+    if sep is None:
+        sep = detect_separator(csv_path)
+    return pd.read_csv(csv_path, sep=sep, decimal='.', dtype=dtype, encoding='utf-8-sig')
+
+
+def _source_signature(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def convert_csv_to_columnar(csv_path: str, output_path: Optional[str] = None, dtype: Optional[dict] = None) -> str:
+    """Writes `csv_path` as a directory of typed .npy column files. Numeric columns
+       are stored as is, all other columns as int32 codes into a category table
+       stored in the metadata (missing values get the code -1)"""
+    if output_path is None:
+        output_path = columnar_path(csv_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    sep = detect_separator(csv_path)
+    dataset = read_csv(csv_path, sep=sep, dtype=dtype)
+
+    columns = []
+    for index, name in enumerate(dataset.columns):
+        column = dataset[name]
+        filename = f'column_{index}.npy'
+
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            np.save(os.path.join(output_path, filename), column.to_numpy())
+            columns.append({'name': name, 'kind': NUMERIC_COLUMN, 'file': filename})
+        else:
+            codes, categories = pd.factorize(column.astype(object), use_na_sentinel=True)
+            np.save(os.path.join(output_path, filename), codes.astype(np.int32))
+            columns.append({'name': name, 'kind': CATEGORICAL_COLUMN, 'file': filename,
+                            'categories': [str(category) for category in categories]})
+
+    metadata = {
+        'source': os.path.basename(csv_path),
+        'source_signature': _source_signature(csv_path),
+        'sep': sep,
+        'n_rows': len(dataset),
+        'columns': columns
+    }
+    with open(os.path.join(output_path, METADATA_FILENAME), 'w') as file:
+        json.dump(metadata, file, indent=1)
+
+    return output_path
+
+def convert_directory(directory: str) -> [str]:
+    """Converts all csv files in `directory` and returns the written paths"""
+    return [convert_csv_to_columnar(csv_path) for csv_path in sorted(glob(os.path.join(directory, '*.csv')))]
+
+def convert_all_datasets(data_root: str, directories: [str] = DEFAULT_DATASET_DIRECTORIES) -> [str]:
+    """Converts the analysis datasets below `data_root` (i.e. the `dat` directory)"""
+    written_paths = []
+    for directory in directories:
+        written_paths += convert_directory(os.path.join(data_root, directory))
+    return written_paths
+
+
+def _read_metadata(path: str) -> Optional[dict]:
+    metadata_path = os.path.join(path, METADATA_FILENAME)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, 'r') as file:
+        return json.load(file)
+
+def is_columnar_up_to_date(csv_path: str) -> bool:
+    metadata = _read_metadata(columnar_path(csv_path))
+    if metadata is None:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return metadata['source_signature'] == _source_signature(csv_path)
+
+def load_columnar(path: str, mmap: bool = True, categorical: bool = False) -> pd.DataFrame:
+    """Loads a dataset written by `convert_csv_to_columnar`. Numeric columns are
+       memory-mapped if `mmap` is set. Category codes are decoded into strings
+       unless `categorical` is set, in which case pandas categoricals are returned"""
+    metadata = _read_metadata(path)
+    if metadata is None:
+        raise FileNotFoundError(f'No columnar dataset found at {path}')
+
+    mmap_mode = 'r' if mmap else None
+
+    data = {}
+    for column in metadata['columns']:
+        values = np.load(os.path.join(path, column['file']), mmap_mode=mmap_mode)
+
+        if column['kind'] == NUMERIC_COLUMN:
+            data[column['name']] = values
+        elif categorical:
+            data[column['name']] = pd.Categorical.from_codes(values, categories=column['categories'])
+        else:
+            categories = np.array(column['categories'] + [np.nan], dtype=object)
+            data[column['name']] = categories[values]
+
+    return pd.DataFrame(data, copy=False)
+
+def load_dataset(csv_path: str, dtype: Optional[dict] = None, mmap: bool = True) -> pd.DataFrame:
+    """Loads `csv_path` from its columnar copy if there is an up to date one
+       and falls back to parsing the csv file otherwise"""
+    if is_columnar_up_to_date(csv_path):
+        dataset = load_columnar(columnar_path(csv_path), mmap=mmap)
+        if dtype is not None:
+            dataset = dataset.astype(dtype)
+        return dataset
+
+    return read_csv(csv_path, dtype=dtype)
+
+
+def _measure(load, n_repeats: int) -> dict:
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    load()
+    cold_seconds = time.perf_counter() - start_time
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    warm_seconds = []
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        load()
+        warm_seconds.append(time.perf_counter() - start_time)
+
+    return {
+        'cold_seconds': cold_seconds,
+        'warm_seconds': float(np.median(warm_seconds)) if warm_seconds else np.nan,
+        'peak_memory_bytes': peak_bytes
+    }
+
+def benchmark_load(csv_path: str, n_repeats: int = 10) -> pd.DataFrame:
+    """Compares the load time (first and median repeated load) and the peak
+       allocated memory of the previous python engine csv path, the C engine
+       csv path and the columnar path for `csv_path`"""
+    sep = detect_separator(csv_path)
+    if not is_columnar_up_to_date(csv_path):
+        convert_csv_to_columnar(csv_path)
+    path = columnar_path(csv_path)
+
+    loaders = {
+        'csv (python engine)': lambda: pd.read_csv(csv_path, sep=sep, engine='python', decimal='.', encoding='utf-8-sig'),
+        'csv (c engine)': lambda: read_csv(csv_path, sep=sep),
+        'columnar': lambda: load_columnar(path),
+        'columnar (categorical)': lambda: load_columnar(path, categorical=True)
+    }
+
+    results = {name: _measure(load, n_repeats) for name, load in loaders.items()}
+    return pd.DataFrame(results).T
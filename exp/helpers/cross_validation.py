@@ -0,0 +1,209 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+from sklearn.model_selection import RepeatedKFold, RepeatedStratifiedKFold, ShuffleSplit, StratifiedShuffleSplit
+
+from .batch_gompertz import fit_gompertz_batch, stack_arrays
+from .data import CATEGORY_COLUMN, count_interventions, create_dataset_mapping, extract_one_intervention_keys
+from .fit_cache import compute_fit_key
+from .gompertz import DEFAULT_INITIAL_PARAMETERS, FIT_METHOD, Parameters, calculate_ages, calculate_mortality_rate, \
+                      fit_gompertz_model
+from .mortality_rate import compute_all_orders_mortality
+from .worker_pool import WorkerPool
+
+DEFAULT_N_SPLITS = 5
+DEFAULT_N_REPEATS = 20
+MAX_FIT_ITERATIONS = 50_000
+FIT_METHODS = ('batch', 'curve_fit')
+# a split takes ~10ms to evaluate, so smaller runs are faster without a process pool
+MIN_SPLITS_PER_WORKER = 50
+
+
+@dataclass
+class ValidationSplit:
+    """Row positions of the training and the held-out part of a split"""
+    repeat: int
+    fold: int
+    train_index: np.array
+    validation_index: np.array
+
+
+@dataclass
+class CrossValidationResult:
+    """`errors` holds the squared error of the held-out points of every group in every split"""
+    errors: pd.DataFrame
+    n_splits: int
+    n_fits: int
+    n_unique_fits: int
+    elapsed_seconds: float
+
+    def scores(self) -> pd.DataFrame:
+        """Returns the held-out mean squared error of every split, overall and per number of interventions"""
+        by_order = self.errors.groupby(['repeat', 'fold', 'n_interventions'])[['squared_error', 'n_points']].sum()
+        by_order = (by_order['squared_error'] / by_order['n_points']).unstack('n_interventions')
+        by_order.columns = [f'mse_{n_interventions}' for n_interventions in by_order.columns]
+
+        overall = self.errors.groupby(['repeat', 'fold'])[['squared_error', 'n_points']].sum()
+        scores = pd.DataFrame({'mse': overall['squared_error'] / overall['n_points'],
+                               'n_points': overall['n_points']})
+        return scores.join(by_order)
+
+    def summary(self) -> pd.DataFrame:
+        """Returns the mean and standard deviation of the split scores"""
+        return self.scores().agg(['mean', 'std']).T
+
+    def __str__(self) -> str:
+        mse = self.scores()['mse']
+        return (f'held-out mse {mse.mean():.6f} +- {mse.std():.6f} over {self.n_splits} splits '
+                f'({self.n_unique_fits}/{self.n_fits} fits) in {self.elapsed_seconds:.2f}s')
+
+
+def create_splits(raw_dataset: pd.DataFrame, n_splits: int = DEFAULT_N_SPLITS, n_repeats: int = DEFAULT_N_REPEATS,
+                  validation_percentage: float = None, stratify: bool = True, seed: int = 42,
+                  validation_categories: [str] = None) -> [ValidationSplit]:
+    """Returns `n_repeats` times `n_splits` k-fold splits of the rows of
+       `raw_dataset`, or with a `validation_percentage` `n_repeats` random
+       splits with that share of held-out rows. Stratified splits keep the
+       share of every category in the training and the held-out rows.
+
+       With `validation_categories`, only rows of these categories are held
+       out and all other rows are part of every training set."""
+    if validation_percentage is None:
+        splitter_class = RepeatedStratifiedKFold if stratify else RepeatedKFold
+        splitter = splitter_class(n_splits=n_splits, n_repeats=n_repeats, random_state=seed)
+        folds_per_repeat = n_splits
+    else:
+        splitter_class = StratifiedShuffleSplit if stratify else ShuffleSplit
+        splitter = splitter_class(n_splits=n_repeats, test_size=validation_percentage, random_state=seed)
+        folds_per_repeat = 1
+
+    categories = raw_dataset[CATEGORY_COLUMN].to_numpy()
+    if validation_categories is None:
+        splittable = np.arange(len(categories))
+    else:
+        splittable = np.flatnonzero(np.isin(categories, list(validation_categories)))
+    always_train = np.setdiff1d(np.arange(len(categories)), splittable)
+
+    splits = []
+    for index, (train_index, validation_index) in enumerate(splitter.split(splittable, categories[splittable])):
+        # sorted positions keep the original row order inside every group
+        train_index = np.sort(np.concatenate([always_train, splittable[train_index]]))
+        splits.append(ValidationSplit(repeat=index // folds_per_repeat, fold=index % folds_per_repeat,
+                                      train_index=train_index, validation_index=np.sort(splittable[validation_index])))
+    return splits
+
+
+def _split_datasets(raw_dataset: pd.DataFrame, split: ValidationSplit):
+    raw_train = raw_dataset.iloc[split.train_index]
+    raw_validation = raw_dataset.iloc[split.validation_index]
+
+    one_interventions = extract_one_intervention_keys(raw_train)
+    return (one_interventions, create_dataset_mapping(raw_train, one_interventions),
+            create_dataset_mapping(raw_validation, one_interventions))
+
+def _fit_group(ages: np.array, mortality_rate: np.array) -> tuple:
+    return fit_gompertz_model(ages, mortality_rate).to_tuple()
+
+def evaluate_split(raw_dataset: pd.DataFrame, split: ValidationSplit, fitted_parameters: dict) -> pd.DataFrame:
+    """Runs the second-order model on the training rows of `split` and returns
+       the squared errors of the held-out points of every group.
+
+       `fitted_parameters` holds the Gompertz fits of the training groups. The
+       model is evaluated at the held-out ages with `compute_all_orders_mortality`,
+       which is the model of `MortalityRateFactory` for all orders at once."""
+    one_interventions, train_dataset, validation_dataset = _split_datasets(raw_dataset, split)
+    parameters = Parameters.from_dict(train_dataset, fitted_parameters)
+
+    ages = np.unique(np.concatenate([calculate_ages(validation_dataset[key]) for key in validation_dataset]))
+    predicted_mortality = compute_all_orders_mortality(train_dataset, parameters, one_interventions, ages)
+
+    rows = []
+    for key in validation_dataset:
+        if key not in predicted_mortality:
+            continue
+        group_ages = calculate_ages(validation_dataset[key])
+        predicted = predicted_mortality[key][np.searchsorted(ages, group_ages)]
+        squared_error = (predicted - calculate_mortality_rate(validation_dataset[key])) ** 2
+        rows.append((split.repeat, split.fold, key, count_interventions(key),
+                     len(squared_error), squared_error.sum()))
+
+    return pd.DataFrame(rows, columns=['repeat', 'fold', 'key', 'n_interventions', 'n_points', 'squared_error'])
+
+
+class CrossValidation:
+    """Repeated k-fold (or repeated random split) validation of the
+       second-order model on held-out points.
+
+       Every split runs `create_dataset_mapping` -> `Parameters` ->
+       `InteractionFactors` -> mortality rates on its training rows and
+       scores the held-out rows of every group. The Gompertz fits are
+       deduplicated by their training data first, so a group whose training
+       rows are identical in several splits is only fitted once, e.g. the
+       groups outside of the `validation_categories`.
+
+       By default, all unique fits run at once in `fit_gompertz_batch`, and
+       the groups it does not converge for are refitted with `curve_fit`.
+       With `fit_method='curve_fit'`, every group is fitted with `curve_fit`
+       like `Parameters` does. The splits (and the `curve_fit` fits) run in
+       a process pool of up to `n_workers` processes, but only with at least
+       `MIN_SPLITS_PER_WORKER` splits per process."""
+
+    def __init__(self, raw_dataset: pd.DataFrame, n_splits: int = DEFAULT_N_SPLITS,
+                 n_repeats: int = DEFAULT_N_REPEATS, validation_percentage: float = None,
+                 stratify: bool = True, seed: int = 42, validation_categories: [str] = None):
+        self.raw_dataset = raw_dataset
+        self.splits = create_splits(raw_dataset, n_splits=n_splits, n_repeats=n_repeats,
+                                    validation_percentage=validation_percentage, stratify=stratify, seed=seed,
+                                    validation_categories=validation_categories)
+
+    def run(self, n_workers: int = 1, chunk_size: int = 4, fit_method: str = 'batch') -> CrossValidationResult:
+        if fit_method not in FIT_METHODS:
+            raise ValueError(f'Unknown fit method {fit_method}, expected any of {list(FIT_METHODS)}')
+        start_time = time.perf_counter()
+
+        # the fit key of every training group of every split, and the data of the unique ones
+        split_fit_keys = []
+        unique_fits = {}
+        for split in self.splits:
+            _, train_dataset, _ = _split_datasets(self.raw_dataset, split)
+            fit_keys = {}
+            for key in train_dataset:
+                ages = calculate_ages(train_dataset[key])
+                mortality_rate = calculate_mortality_rate(train_dataset[key])
+                fit_key = compute_fit_key(ages, mortality_rate, DEFAULT_INITIAL_PARAMETERS.to_tuple(),
+                                          MAX_FIT_ITERATIONS, method=FIT_METHOD)
+                fit_keys[key] = fit_key
+                unique_fits.setdefault(fit_key, (ages, mortality_rate))
+            split_fit_keys.append(fit_keys)
+
+        n_workers = max(1, min(n_workers, os.cpu_count() or 1, len(self.splits) // MIN_SPLITS_PER_WORKER))
+        with WorkerPool(self.raw_dataset, n_workers) as pool:
+            all_ages, all_mortality_rates = zip(*unique_fits.values()) if unique_fits else ((), ())
+            if fit_method == 'batch':
+                fitted = self._fit_batch(list(unique_fits), all_ages, all_mortality_rates)
+            else:
+                fitted = dict(zip(unique_fits, pool.map(_fit_group, all_ages, all_mortality_rates,
+                                                        chunk_size=max(chunk_size * 8, 1), with_state=False)))
+            split_parameters = self._split_parameters(split_fit_keys, fitted)
+            errors = list(pool.map(evaluate_split, self.splits, split_parameters, chunk_size=chunk_size))
+
+        return CrossValidationResult(errors=pd.concat(errors, ignore_index=True), n_splits=len(self.splits),
+                                     n_fits=sum([len(fit_keys) for fit_keys in split_fit_keys]),
+                                     n_unique_fits=len(unique_fits),
+                                     elapsed_seconds=time.perf_counter() - start_time)
+
+    @staticmethod
+    def _fit_batch(fit_keys: [str], all_ages: [np.array], all_mortality_rates: [np.array]) -> dict:
+        parameters, report = fit_gompertz_batch(stack_arrays(fit_keys, all_ages, all_mortality_rates))
+        fitted = {fit_key: parameters[fit_key].to_tuple() for fit_key in fit_keys}
+        for row in np.flatnonzero(~report.converged):
+            fitted[fit_keys[row]] = _fit_group(all_ages[row], all_mortality_rates[row])
+        return fitted
+
+    @staticmethod
+    def _split_parameters(split_fit_keys: [dict], fitted: dict) -> [dict]:
+        return [{key: fitted[fit_key] for key, fit_key in fit_keys.items()} for fit_keys in split_fit_keys]
@@ -1,12 +1,34 @@
+import copy
+import os
+import time
+
+import numpy as np
 import pandas as pd
 
+from collections.abc import Mapping
+from glob import glob
+from itertools import combinations
+
+from .columnar import load_dataset, read_csv
+
 CATEGORY_COLUMN = 'category'
 SEX_COLUMN = 'sex'
 
 CONTROL_GROUP = 'None'
+# the key of the control group in the dataset mappings
+NO_INTERVENTION_DATASET_KEY = ''
 ALL_GROUP = 'All'
 ONE_REMOVED_PREFIX = 'no_'
 
+ROUNDING_DIGITS = 4
+X_SNAPPING_DISTANCE_IN_DAYS = 2
+RMR_FILE_PATTERN = '*_*.csv'
+
+# order and names of the categories in `female_final.csv` and `male_final.csv`
+RMR_CATEGORY_ORDER = [CONTROL_GROUP, 'Rapamycin', 'HSCs', 'Gal-Nav', 'no_Rapamycin', 'no_HSCs',
+                      'mTERT', 'no_Gal-Nav', 'no_mTERT', ALL_GROUP]
+RMR_CATEGORY_NAMES = {'no_Gal-Nav': 'no_Gal_Nav'}
+
 
 def is_one_removed_intervention(key: str) -> bool:
     """Returns true if the key includes threes interventions
@@ -47,14 +69,9 @@ def create_canonical_intervention_key(key: str, intervention_list: []):
 
 
 def load_csv(path: str) -> pd.DataFrame:
-    return pd.read_csv(
-                        path,
-                        skiprows=0,
-                        sep=',',
-                        engine='python',
-                        decimal='.',
-                        dtype={'x': 'float64', 'y': 'float64'}
-            )
+    """Loads the dataset at `path`, preferring an up to date columnar copy
+       (see `columnar.convert_all_datasets`) over parsing the csv file"""
+    return load_dataset(path, dtype={'x': 'float64', 'y': 'float64'})
 
 def extract_one_intervention_keys(dataset: pd.DataFrame) -> [str]:
     """Returns the list of intervention names where there is exactly one intervention"""
@@ -82,6 +99,15 @@ def create_two_intervention_keys(one_interventions: [str]) -> [str]:
             two_interventions.append(intervention_pair)
     return two_interventions
 
+def create_combination_keys(one_interventions: [str], order: int) -> [str]:
+    """Returns the names of all combinations of `order` interventions in the
+       lexicographic order used by the interaction model"""
+    return [','.join(intervention_combination) for intervention_combination in combinations(one_interventions, order)]
+
+def count_interventions(key: str) -> int:
+    """Returns the number of interventions of a combination key"""
+    return 0 if key == NO_INTERVENTION_DATASET_KEY else key.count(',') + 1
+
 def extract_three_intervention_keys(dataset: dict) -> [str]:
     """Returns the list of intervention names where there is exactly three interventions"""
     return [intervention for intervention in dataset.keys() if intervention.count(',') == 2]    
@@ -93,25 +119,90 @@ def extract_four_intervention_keys(dataset: dict) -> str:
             return intervention
     raise ValueError('No four intervention data found')
 
-def create_dataset_mapping(dataset, single_interventions: []) -> dict:
-    """Returns the dictionary mapping intervention names to their resp. data
+class GroupedDataset(Mapping):
+    """Read-only mapping from canonical intervention keys to their data.
+
+       The rows are sorted once by category into one frame, and every group
+       is the row slice `offsets[i]:offsets[i + 1]` of it, so no group is
+       ever copied. `arrays(key)` returns the raw column views and indexing
+       returns the `iloc` slice of the sorted frame, which shares its memory,
+       for compatibility with the dict-of-DataFrames interface."""
+
+    def __init__(self, dataset: pd.DataFrame, single_interventions: [], category_column: str = CATEGORY_COLUMN,
+                 drop_columns: [str] = (SEX_COLUMN,)):
+        codes, categories = pd.factorize(dataset[category_column])
+
+        # a stable sort keeps the original row order inside each group
+        order = np.argsort(codes, kind='stable')
+        is_sorted = bool(np.all(order == np.arange(len(order))))
+
+        value_columns = [column for column in dataset.columns
+                         if column != category_column and column not in drop_columns]
+
+        self.frame = dataset[value_columns] if is_sorted else dataset[value_columns].take(order)
+        self.columns = {}
+        for column in value_columns:
+            values = self.frame[column].to_numpy()
+            values.flags.writeable = False
+            self.columns[column] = values
+
+        self.index = self.frame.index.to_numpy()
+
+        counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        if (codes < 0).any():
+            # rows with a missing category are sorted to the front and skipped
+            self.offsets += (codes < 0).sum()
+
+        self.keys_to_group = {}
+        for group, category in enumerate(categories):
+            key = create_canonical_intervention_key(category, single_interventions)
+            self.keys_to_group[key] = group
+
+    def slice(self, key: str) -> slice:
+        group = self.keys_to_group[key]
+        return slice(self.offsets[group], self.offsets[group + 1])
+
+    def arrays(self, key: str) -> dict:
+        """Returns the column views of `key` as a dict of read-only arrays"""
+        group_slice = self.slice(key)
+        return {column: values[group_slice] for column, values in self.columns.items()}
+
+    def xy(self, key: str) -> (np.array, np.array):
+        group_slice = self.slice(key)
+        return self.columns['x'][group_slice], self.columns['y'][group_slice]
+
+    def __getitem__(self, key: str) -> pd.DataFrame:
+        return self.frame.iloc[self.slice(key)]
+
+    def __iter__(self):
+        return iter(self.keys_to_group)
+
+    def __len__(self) -> int:
+        return len(self.keys_to_group)
+
+    def copy(self) -> 'GroupedDataset':
+        """The underlying arrays are read-only, so copies can share them"""
+        return copy.copy(self)
+
+    def to_dict(self) -> dict:
+        return {key: self[key].copy() for key in self.keys()}
+
+
+def create_dataset_mapping(dataset, single_interventions: []) -> GroupedDataset:
+    """Returns the mapping of intervention names to their resp. data
        where `single_interventions` is a list of the interventions names
        with only one intervention"""
-    dataset_by_category = {}
-    for intervention in dataset[CATEGORY_COLUMN].unique():
-        key = create_canonical_intervention_key(intervention, single_interventions)
-        intervention_indices = dataset[CATEGORY_COLUMN] == intervention
-        
-        dataset_category = dataset[intervention_indices].copy()
-        dataset_category = dataset_category.drop([SEX_COLUMN, CATEGORY_COLUMN], axis=1)
+    return GroupedDataset(dataset, single_interventions)
 
-        dataset_by_category[key] = dataset_category
+def load_and_preprocess(dataset_path: str) -> pd.DataFrame:
+    return preprocess_dataset(load_csv(dataset_path))
 
-    return dataset_by_category
+def preprocess_dataset(dataset: pd.DataFrame) -> pd.DataFrame:
+    """Fixes the category names of rows in the format of the final datasets
+       and removes the rows with missing values. `dataset` is not modified"""
+    dataset = dataset.copy()
 
-def load_and_preprocess(dataset_path: str) -> pd.DataFrame:
-    dataset = load_csv(dataset_path)
-    
     # fixes naming of no Gal-Nav in dataset for preprocessing
     misnamed_no_gal_nav_index = dataset[CATEGORY_COLUMN] == 'no_Gal_Nav'
     dataset.loc[misnamed_no_gal_nav_index, CATEGORY_COLUMN] = 'no_Gal-Nav'
@@ -122,3 +213,171 @@ def load_and_preprocess(dataset_path: str) -> pd.DataFrame:
     
     # remove nan rows, if applicable
     return dataset.dropna()
+
+
+def _grouped_cummin(values: np.array, groups: np.array) -> np.array:
+    return pd.Series(values).groupby(groups, sort=False).cummin().to_numpy()
+
+def snap_x(x: np.array, groups: np.array, distance: float = X_SNAPPING_DISTANCE_IN_DAYS) -> np.array:
+    """Merges x values of digitized points that are within `distance` days of
+       the (merged) x value of the previous point into the smaller of the two.
+
+       Merged points form runs of consecutive points whose x values are a
+       running minimum. Runs start where two neighbours are more than
+       `distance` apart; a run that drifts more than `distance` away from its
+       running minimum is split at the first such point and rechecked, which
+       gives exactly the result of merging point by point. `groups` labels
+       the curve of every point and runs never cross curves."""
+    x = np.asarray(x, dtype=np.float64)
+    groups = np.asarray(groups)
+    if len(x) == 0:
+        return x.copy()
+
+    starts = np.ones(len(x), dtype=bool)
+    starts[1:] = (groups[1:] != groups[:-1]) | (np.abs(np.diff(x)) > distance)
+
+    while True:
+        runs = np.cumsum(starts)
+        snapped = _grouped_cummin(x, runs)
+
+        failures = np.flatnonzero(~starts[1:] & (np.abs(x[1:] - snapped[:-1]) > distance)) + 1
+        if len(failures) == 0:
+            return snapped
+
+        # only the first failure of a run is certain, the rest of it depends on the split
+        is_first_failure = np.concatenate([[True], runs[failures[1:]] != runs[failures[:-1]]])
+        starts[failures[is_first_failure]] = True
+
+def clean_survival_curves(dataset: pd.DataFrame, group_columns: [str] = (SEX_COLUMN, CATEGORY_COLUMN)) -> pd.DataFrame:
+    """Cleans digitized survival curves (the `preprocess_data` of
+       002_ExtractingPointsFromPlot.ipynb) of all groups at once:
+
+       1. x values within 2 days of the previous point are merged (`snap_x`)
+       2. the points are sorted by x (ascending) and y (descending)
+       3. y is made monotonically decreasing, where the first point at a new
+          x keeps the survival of the previous point (the step of the curve)
+       4. duplicate points are removed
+
+       The groups keep their order of first appearance in `dataset`."""
+    group_columns = list(group_columns)
+    groups, _ = pd.factorize(pd.MultiIndex.from_frame(dataset[group_columns]) if len(group_columns) > 1
+                             else dataset[group_columns[0]])
+
+    # the curves are cleaned in file order, so group the rows without reordering them
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    x = snap_x(dataset['x'].to_numpy(dtype=np.float64)[order], groups)
+    y = dataset['y'].to_numpy(dtype=np.float64)[order]
+
+    order_by_point = np.lexsort((-y, x, groups))
+    groups, x, y = groups[order_by_point], x[order_by_point], y[order_by_point]
+    order = order[order_by_point]
+
+    is_group_start = np.ones(len(x), dtype=bool)
+    is_group_start[1:] = groups[1:] != groups[:-1]
+    is_new_x = np.ones(len(x), dtype=bool)
+    is_new_x[1:] = x[1:] > x[:-1]
+    y = _grouped_cummin(np.where(is_new_x & ~is_group_start, np.inf, y), groups)
+
+    cleaned = dataset.iloc[order].copy()
+    cleaned['x'] = x
+    cleaned['y'] = y
+    return cleaned.drop_duplicates(subset=group_columns + ['x', 'y'])
+
+def _rmr_category_rank(category: str) -> (int, str):
+    if category in RMR_CATEGORY_ORDER:
+        return RMR_CATEGORY_ORDER.index(category), category
+    return len(RMR_CATEGORY_ORDER), category
+
+def load_rmr_datasets(directory: str = '../dat/RMR_data', pattern: str = RMR_FILE_PATTERN) -> dict:
+    """Reads all digitized `<sex>_<category>.csv` files in `directory` into
+       one frame, cleans all curves at once and returns the `female_final.csv`
+       and `male_final.csv` equivalent frames keyed by sex"""
+    files = []
+    for path in glob(os.path.join(directory, pattern)):
+        sex, category = os.path.splitext(os.path.basename(path))[0].split('_', 1)
+        files.append((sex, _rmr_category_rank(category), path))
+
+    frames = []
+    for sex, (_, category), path in sorted(files):
+        frame = read_csv(path, sep=',', dtype={'x': 'float64', 'y': 'float64'})[['x', 'y']].round(ROUNDING_DIGITS)
+        frame[SEX_COLUMN] = sex
+        frame[CATEGORY_COLUMN] = RMR_CATEGORY_NAMES.get(category, category)
+        frames.append(frame)
+
+    if not frames:
+        return {}
+
+    cleaned = clean_survival_curves(pd.concat(frames, ignore_index=True))
+    return {sex: dataset.reset_index(drop=True) for sex, dataset in cleaned.groupby(SEX_COLUMN, sort=False)}
+
+
+def _preprocess_data_rowwise(df: pd.DataFrame) -> pd.DataFrame:
+    """The row-wise `preprocess_data` of 002_ExtractingPointsFromPlot.ipynb, kept for `benchmark_rmr_cleaning`"""
+    def adjust_x(row, prev_row):
+        if prev_row is not None:
+            if abs(row['x'] - prev_row['x']) <= X_SNAPPING_DISTANCE_IN_DAYS:
+                row['x'] = min(row['x'], prev_row['x'])
+        return row
+
+    def adjust_y(row, prev_row):
+        if prev_row is not None:
+            if row['y'] > prev_row['y']:
+                row['y'] = prev_row['y']
+            elif row['x'] > prev_row['x']:
+                row['y'] = prev_row['y']
+        return row
+
+    prev_row = None
+    for index, row in df.iterrows():
+        df.loc[index] = adjust_x(row, prev_row)
+        prev_row = row
+
+    df = df.sort_values(by=['x', 'y'], ascending=[True, False])
+
+    prev_row = None
+    for index, row in df.iterrows():
+        df.loc[index] = adjust_y(row, prev_row)
+        prev_row = row
+
+    return df.drop_duplicates(subset=['x', 'y'])
+
+def _load_rmr_datasets_rowwise(directory: str) -> dict:
+    datasets = {}
+    for sex in ['female', 'male']:
+        frames = []
+        for category in RMR_CATEGORY_ORDER:
+            path = os.path.join(directory, f'{sex}_{category}.csv')
+            if not os.path.exists(path):
+                continue
+            frame = pd.read_csv(path, sep=',', engine='python', decimal='.', dtype={'x': 'float64', 'y': 'float64'})
+            frame = frame.apply(lambda column: round(column, ROUNDING_DIGITS))
+            frame[SEX_COLUMN] = sex
+            frame[CATEGORY_COLUMN] = RMR_CATEGORY_NAMES.get(category, category)
+            frames.append(_preprocess_data_rowwise(frame))
+        datasets[sex] = pd.concat(frames, ignore_index=True)
+    return datasets
+
+def benchmark_rmr_cleaning(directory: str = '../dat/RMR_data', n_repeats: int = 5) -> pd.DataFrame:
+    """Compares the row-wise notebook path with `load_rmr_datasets` and
+       checks that both produce the same final datasets"""
+    loaders = {'row-wise (notebook)': lambda: _load_rmr_datasets_rowwise(directory),
+               'vectorized': lambda: load_rmr_datasets(directory)}
+
+    results, outputs = {}, {}
+    for name, load in loaders.items():
+        timings = []
+        for _ in range(n_repeats):
+            start_time = time.perf_counter()
+            outputs[name] = load()
+            timings.append(time.perf_counter() - start_time)
+        results[name] = {'median_seconds': np.median(timings)}
+
+    reference = outputs['row-wise (notebook)']
+    for name, datasets in outputs.items():
+        results[name]['identical'] = datasets.keys() == reference.keys() and all(
+            np.array_equal(datasets[sex][['x', 'y']].to_numpy(dtype=np.float64),
+                           reference[sex][['x', 'y']].to_numpy(dtype=np.float64)) and
+            datasets[sex][CATEGORY_COLUMN].tolist() == reference[sex][CATEGORY_COLUMN].tolist()
+            for sex in reference)
+    return pd.DataFrame(results).T
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from collections import OrderedDict
+from typing import Any, Optional
+
+DEFAULT_MAX_ENTRIES = 4_096
+
+
+def compute_fit_key(ages: Any,
+                    mortality_rate: Any,
+                    initial_parameters: tuple,
+                    max_fit_iterations: int,
+                    method: str = 'curve_fit') -> str:
+    """Returns a content hash identifying a fit of `mortality_rate` against `ages`.
+       Two fits with the same key are guaranteed to produce the same parameters."""
+    ages = np.ascontiguousarray(ages, dtype=np.float64)
+    mortality_rate = np.ascontiguousarray(mortality_rate, dtype=np.float64)
+
+    digest = hashlib.sha1()
+    digest.update(method.encode())
+    digest.update(np.array(ages.shape, dtype=np.int64).tobytes())
+    digest.update(ages.tobytes())
+    digest.update(np.array(mortality_rate.shape, dtype=np.int64).tobytes())
+    digest.update(mortality_rate.tobytes())
+    digest.update(np.array(initial_parameters, dtype=np.float64).tobytes())
+    digest.update(np.int64(max_fit_iterations).tobytes())
+    return digest.hexdigest()
+
+
+class FitCache:
+    """Least recently used cache of fitted curve parameters keyed by
+       `compute_fit_key`. If `directory` is given, every entry is also
+       persisted there as a small json file so later runs can reuse it.
+       The files are never evicted, so the directory is the caller's to clean.
+
+       Fits are only cached when a cache is passed to them, e.g.
+       `Parameters(dataset, cache=FitCache())`."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, directory: Optional[str] = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[tuple]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        parameters = self._load(key)
+        if parameters is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._insert(key, parameters)
+        return parameters
+
+    def put(self, key: str, parameters: tuple) -> None:
+        parameters = tuple(float(parameter) for parameter in parameters)
+        self._insert(key, parameters)
+        self._store(key, parameters)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries or (self._path(key) is not None and os.path.exists(self._path(key)))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _insert(self, key: str, parameters: tuple) -> None:
+        self.entries[key] = parameters
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _path(self, key: str) -> Optional[str]:
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _load(self, key: str) -> Optional[tuple]:
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'r') as file:
+                return tuple(json.load(file)['parameters'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, key: str, parameters: tuple) -> None:
+        path = self._path(key)
+        if path is None:
+            return
+
+        # write to a temporary file first so concurrent readers never see partial files
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'parameters': parameters}, file)
+        os.replace(temporary_path, path)
+
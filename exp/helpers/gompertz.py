@@ -4,18 +4,26 @@ import pandas as pd
 from scipy.optimize import curve_fit
 
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Optional
+
+from .fit_cache import FitCache, compute_fit_key
 
 
 def gompertz(x: Any, alpha: np.float64, beta: np.float64):
     return alpha * np.exp(beta * x)
 
+def gompertz_jacobian(x: Any, alpha: np.float64, beta: np.float64) -> np.array:
+    """Returns the derivatives (d/d alpha, d/d beta) of `gompertz`, stacked along the last axis"""
+    exponential = np.exp(beta * x)
+    return np.stack([exponential, alpha * x * exponential], axis=-1)
+
 class Parameters:
     """Stores the alpha and beta parameters of the Gompertz curve
        for all intervention combinations in the dataset"""
 
-    def __init__(self, dataset):
+    def __init__(self, dataset, cache: Optional[FitCache] = None):
         self.dataset = dataset
+        self.cache = cache
 
         self.alphas = {}
         self.betas = {}
@@ -25,21 +33,31 @@ class Parameters:
             all_ages = calculate_ages(current_dataset)
             all_mortality_rate = calculate_mortality_rate(current_dataset)
             
-            predicted_parameters = fit_gompertz_model(all_ages, all_mortality_rate)
+            predicted_parameters = fit_gompertz_model(all_ages, all_mortality_rate, cache=self.cache)
             
             self.alphas[key] = predicted_parameters.alpha
             self.betas[key] = predicted_parameters.beta
         return self
 
+    @staticmethod
+    def from_dict(dataset, parameters: dict) -> 'Parameters':
+        """Returns the `Parameters` of `dataset` from already fitted (alpha, beta) per key"""
+        fitted_parameters = Parameters(dataset)
+        for key, (alpha, beta) in parameters.items():
+            fitted_parameters.alphas[key] = alpha
+            fitted_parameters.betas[key] = beta
+        return fitted_parameters
+
     def __getitem__(self, key):
         return (self.alphas[key], self.betas[key])
 
     def keys(self):
         return self.alphas.keys()
 
-def compute_alpha_and_beta(dataset):
+def compute_alpha_and_beta(dataset, cache: Optional[FitCache] = None):
     """Returns all alpha and beta parameters of the Gompertz curve
-       for each intervention combination in the dataset"""
+       for each intervention combination in the dataset, looking up
+       the fits in `cache` if one is given"""
 
     alpha_parameters = {}
     beta_parameters = {}
@@ -48,7 +66,7 @@ def compute_alpha_and_beta(dataset):
         all_ages = calculate_ages(current_dataset)
         all_mortality_rate = calculate_mortality_rate(current_dataset)
         
-        predicted_parameters = fit_gompertz_model(all_ages, all_mortality_rate)
+        predicted_parameters = fit_gompertz_model(all_ages, all_mortality_rate, cache=cache)
         
         alpha_parameters[key] = predicted_parameters.alpha
         beta_parameters[key] = predicted_parameters.beta
@@ -75,13 +93,28 @@ class GompertzParameters:
 
 
 DEFAULT_INITIAL_PARAMETERS = GompertzParameters(alpha=0.1, beta=0.085)
+FIT_METHOD = 'curve_fit_jacobian'
 
 def fit_gompertz_model(ages: pd.DataFrame,
                        mortality_rate: pd.DataFrame,
                        initial_parameters: GompertzParameters = DEFAULT_INITIAL_PARAMETERS,
-                       max_fit_iterations: int = 50_000) -> GompertzParameters:
+                       max_fit_iterations: int = 50_000,
+                       cache: Optional[FitCache] = None) -> GompertzParameters:
+    """Fits a Gompertz curve with `curve_fit` and the analytic `gompertz_jacobian`.
+       If a `cache` is given, previously computed fits of the same data are
+       looked up in it and new fits are stored in it"""
     p0 = initial_parameters.to_tuple()
-    predicted_parameters, covariance = curve_fit(gompertz, ages, mortality_rate, p0=p0, maxfev=max_fit_iterations)
+
+    if cache is not None:
+        key = compute_fit_key(ages, mortality_rate, p0, max_fit_iterations, method=FIT_METHOD)
+        cached_parameters = cache.get(key)
+        if cached_parameters is not None:
+            return GompertzParameters.from_sequence(np.array(cached_parameters))
+
+    predicted_parameters, covariance = curve_fit(gompertz, ages, mortality_rate, p0=p0, jac=gompertz_jacobian,
+                                                 maxfev=max_fit_iterations)
+    if cache is not None:
+        cache.put(key, predicted_parameters)
     return GompertzParameters.from_sequence(predicted_parameters)
 
 def calculate_ages(dataset) -> np.array:
@@ -89,4 +122,4 @@ def calculate_ages(dataset) -> np.array:
 
 def calculate_mortality_rate(dataset) -> np.array:
     """Converts a survival rate dataset into a mortality rate dataset"""
-    return np.array(1 - dataset.y)
+    return 1 - np.array(dataset.y)
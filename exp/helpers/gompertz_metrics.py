@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from scipy.special import exp1
+
+from .gompertz import GompertzParameters, Parameters
+
+CUMULATIVE_FORM = 'cumulative'
+HAZARD_FORM = 'hazard'
+GOMPERTZ_FORMS = (CUMULATIVE_FORM, HAZARD_FORM)
+
+# above this, e^c * E1(c) is evaluated with its asymptotic series as e^c overflows
+ASYMPTOTIC_THRESHOLD = 50.0
+
+
+def stack_parameters(parameters) -> ([str], np.array, np.array):
+    """Returns (keys, alphas, betas) of `Parameters`, a dict of `GompertzParameters`
+       or (alpha, beta) tuples, a list of `GompertzParameters` or an (n x 2) array"""
+    if isinstance(parameters, GompertzParameters):
+        parameters = [parameters]
+
+    if isinstance(parameters, Parameters):
+        keys = list(parameters.keys())
+        values = [parameters[key] for key in keys]
+    elif isinstance(parameters, dict):
+        keys = list(parameters.keys())
+        values = [_to_tuple(parameters[key]) for key in keys]
+    elif isinstance(parameters, np.ndarray):
+        keys = list(range(len(parameters)))
+        values = parameters
+    else:
+        values = [_to_tuple(value) for value in parameters]
+        keys = list(range(len(values)))
+
+    values = np.asarray(values, dtype=np.float64).reshape(-1, 2)
+    return keys, values[:, 0], values[:, 1]
+
+def _to_tuple(value) -> tuple:
+    return value.to_tuple() if isinstance(value, GompertzParameters) else tuple(value)
+
+def _check_form(form: str) -> None:
+    if form not in GOMPERTZ_FORMS:
+        raise ValueError(f'Unknown Gompertz form {form}, use one of {GOMPERTZ_FORMS}')
+
+
+def log_slope(betas: np.array) -> np.array:
+    """Returns the slope of the log of the Gompertz curve alpha * exp(beta * x),
+       which is beta at every age and therefore independent of the evaluation ages"""
+    return np.array(betas, dtype=np.float64)
+
+def survival(alphas: np.array, betas: np.array, ages: np.array, form: str = CUMULATIVE_FORM) -> np.array:
+    """Returns the survival probabilities of every parameter set (rows) at `ages` (columns).
+
+       In the cumulative form, which is what `fit_gompertz_model` fits,
+       alpha * exp(beta * x) is the fraction of deaths 1 - S(x). In the
+       hazard form it is the force of mortality, as in the Gompertz law."""
+    _check_form(form)
+    alphas, betas = _column(alphas), _column(betas)
+    ages = np.asarray(ages, dtype=np.float64)[np.newaxis, :]
+
+    if form == CUMULATIVE_FORM:
+        return np.clip(1 - alphas * np.exp(betas * ages), 0, 1)
+    return np.exp(-alphas / betas * np.expm1(betas * ages))
+
+def median_remaining_lifespan(alphas: np.array, betas: np.array, age: float = 0.0,
+                              form: str = CUMULATIVE_FORM) -> np.array:
+    """Returns the time after `age` until half of the survivors at `age` died"""
+    _check_form(form)
+    alphas, betas = _as_arrays(alphas, betas)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if form == CUMULATIVE_FORM:
+            deaths_at_age = alphas * np.exp(betas * age)
+            median_age = np.log((1 + deaths_at_age) / (2 * alphas)) / betas
+            median = np.where(deaths_at_age < 1, median_age - age, 0.0)
+        else:
+            hazard_at_age = alphas * np.exp(betas * age)
+            median = np.log1p(betas * np.log(2) / hazard_at_age) / betas
+    return _invalid_to_nan(median, alphas, betas)
+
+def mean_remaining_lifespan(alphas: np.array, betas: np.array, age: float = 0.0,
+                            form: str = CUMULATIVE_FORM) -> np.array:
+    """Returns the life expectancy after `age` of the survivors at `age`"""
+    _check_form(form)
+    alphas, betas = _as_arrays(alphas, betas)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if form == CUMULATIVE_FORM:
+            deaths_at_age = alphas * np.exp(betas * age)
+            survival_at_age = 1 - deaths_at_age
+            remaining = _cumulative_integral(alphas, betas, age, _last_age(alphas, betas)) / survival_at_age
+            mean = np.where(survival_at_age > 0, remaining, 0.0)
+        else:
+            mean = _scaled_exp1(alphas * np.exp(betas * age) / betas) / betas
+    return _invalid_to_nan(mean, alphas, betas)
+
+def restricted_mean_survival(alphas: np.array, betas: np.array, horizon: float,
+                             form: str = CUMULATIVE_FORM) -> np.array:
+    """Returns the restricted mean survival time, the area under the survival
+       curve from birth to `horizon`"""
+    _check_form(form)
+    alphas, betas = _as_arrays(alphas, betas)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if form == CUMULATIVE_FORM:
+            end = np.clip(np.minimum(horizon, _last_age(alphas, betas)), 0, None)
+            rmst = np.where(alphas < 1, _cumulative_integral(alphas, betas, 0.0, end), 0.0)
+        else:
+            scaled_alphas = alphas / betas
+            rmst = (_scaled_exp1(scaled_alphas)
+                    - np.exp(-scaled_alphas * np.expm1(betas * horizon)) * _scaled_exp1(
+                        scaled_alphas * np.exp(betas * horizon))) / betas
+    return _invalid_to_nan(rmst, alphas, betas)
+
+
+def _as_arrays(alphas, betas) -> (np.array, np.array):
+    return np.broadcast_arrays(np.asarray(alphas, dtype=np.float64), np.asarray(betas, dtype=np.float64))
+
+def _column(values) -> np.array:
+    return np.asarray(values, dtype=np.float64).reshape(-1, 1)
+
+def _last_age(alphas, betas):
+    """Age at which the cumulative form reaches all deaths"""
+    return -np.log(alphas) / betas
+
+def _cumulative_integral(alphas, betas, start, end):
+    """Integral of 1 - alpha * exp(beta * x) from `start` to `end`"""
+    return (end - start) - alphas * (np.exp(betas * end) - np.exp(betas * start)) / betas
+
+def _scaled_exp1(values):
+    """Returns e^c * E1(c), which is the integral of e^-u / u from c to infinity times e^c"""
+    values = np.asarray(values, dtype=np.float64)
+    large = values > ASYMPTOTIC_THRESHOLD
+    safe_values = np.where(large, ASYMPTOTIC_THRESHOLD, values)
+    inverse = 1 / np.where(large, values, 1.0)
+    asymptotic = inverse * (1 - inverse + 2 * inverse ** 2 - 6 * inverse ** 3 + 24 * inverse ** 4)
+    return np.where(large, asymptotic, np.exp(safe_values) * exp1(safe_values))
+
+def _invalid_to_nan(values, alphas, betas):
+    """Without a positive beta (and alpha) the curve never reaches all deaths,
+       so the lifespans are undefined"""
+    valid = (alphas > 0) & (betas > 0)
+    return np.where(valid, values, np.nan)
+
+
+def compute_gompertz_metrics(parameters, horizon: float = None, age: float = 0.0,
+                             form: str = CUMULATIVE_FORM) -> pd.DataFrame:
+    """Returns the log slope (beta), median and mean remaining lifespan after
+       `age` and, with a `horizon`, the restricted mean survival time of every
+       parameter set (see `stack_parameters`), in the time unit of the fits
+       (years for `Parameters`). Unlike `InterventionSlopes`, none of them
+       depend on an evaluation grid."""
+    keys, alphas, betas = stack_parameters(parameters)
+    metrics = pd.DataFrame({
+                'alpha': alphas,
+                'beta': betas,
+                'log_slope': log_slope(betas),
+                'median_remaining_lifespan': median_remaining_lifespan(alphas, betas, age=age, form=form),
+                'mean_remaining_lifespan': mean_remaining_lifespan(alphas, betas, age=age, form=form)
+            }, index=keys)
+    if horizon is not None:
+        metrics['restricted_mean_survival'] = restricted_mean_survival(alphas, betas, horizon, form=form)
+    return metrics
+
+def rank_by_log_slope(parameters) -> pd.Series:
+    """Returns the log slopes sorted from the best (flattest) to the worst, which
+       is the order of `InterventionSlopes` without evaluating any curve"""
+    keys, alphas, betas = stack_parameters(parameters)
+    return pd.Series(log_slope(betas), index=keys, name='log_slope').sort_values(kind='stable')
@@ -0,0 +1,225 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .data import CATEGORY_COLUMN, NO_INTERVENTION_DATASET_KEY, create_canonical_intervention_key, \
+                  create_dataset_mapping, extract_four_intervention_keys, extract_one_intervention_keys, \
+                  preprocess_dataset
+from .fit_cache import FitCache
+from .gompertz import GompertzParameters, Parameters, calculate_ages, calculate_mortality_rate, fit_gompertz_model, \
+                      gompertz
+from .interaction_factors import InteractionFactors, create_combination_indices, create_subset_indices, \
+                                 create_subset_matrix
+from .mortality_rate import KeyedMortality
+
+
+
+@dataclass
+class UpdateReport:
+    """What an `IncrementalModel.update` recomputed"""
+    refitted_keys: [str]
+    changed_effects: int
+    recomputed_predictions: int
+    full_recompute: bool
+    elapsed_seconds: float
+
+    def __str__(self) -> str:
+        scope = 'all predictions' if self.full_recompute else f'{self.recomputed_predictions} predictions'
+        return (f'refitted {len(self.refitted_keys)} groups, recomputed {scope} '
+                f'in {self.elapsed_seconds * 1_000:.2f}ms')
+
+
+class IncrementalModel:
+    """The second-order model of all intervention combinations, kept up to
+       date as new survival points arrive.
+
+       The model is the stacked effects
+
+           [no intervention mortality; single intervention mortality; interaction factors]
+
+       and the predictions are the subset indicator matrix times the effects
+       (see `AllOrdersMortalityRate`). `update` appends points to the groups
+       that received them, refits only these groups, warm-started from their
+       previous parameters, and recomputes only the effects and the
+       predictions that depend on these groups:
+
+           control group            -> its own prediction
+           single intervention      -> its effect, the interaction factors, and
+                                       every combination containing a changed effect
+           three intervention group -> the interaction factors and their combinations
+           all interventions group  -> its parameters only
+
+       unless the evaluation ages are the (changed) ages of the all
+       interventions group, in which case all predictions are recomputed.
+       Only a new category rebuilds the model from all rows."""
+
+    def __init__(self, raw_dataset: pd.DataFrame, evaluation_ages: np.array = None,
+                 cache: Optional[FitCache] = None):
+        self._raw_parts = [raw_dataset.reset_index(drop=True)]
+        self._n_rows = len(raw_dataset)
+        self.fixed_evaluation_ages = None if evaluation_ages is None else np.asarray(evaluation_ages)
+        self.cache = cache
+        self._rebuild()
+
+    @property
+    def raw_dataset(self) -> pd.DataFrame:
+        """All rows so far, the appended rows are only concatenated when needed"""
+        if len(self._raw_parts) > 1:
+            self._raw_parts = [pd.concat(self._raw_parts, ignore_index=True)]
+        return self._raw_parts[0]
+
+    def _rebuild(self) -> None:
+        raw_dataset = self.raw_dataset
+        self.categories = set(raw_dataset[CATEGORY_COLUMN].unique())
+        self.one_interventions = extract_one_intervention_keys(raw_dataset)
+        # every group is its own frame, so an update only appends to the groups that received points
+        grouped = create_dataset_mapping(raw_dataset, self.one_interventions)
+        self.dataset = {key: grouped[key] for key in grouped}
+        self.parameters = Parameters(self.dataset, cache=self.cache).compute()
+
+        n_interventions = len(self.one_interventions)
+        self.three_interventions = []
+        self.combination_indices = []
+        for indices in create_combination_indices(n_interventions, 3):
+            key = self._combination_key(indices)
+            if key in self.dataset:
+                self.three_interventions.append(key)
+                self.combination_indices.append(indices)
+
+        self.subset_matrix = create_subset_matrix(n_interventions, n_interventions)
+        self.subset_columns = self.subset_matrix.tocsc()
+        self.keys = [self._combination_key(indices) for indices in create_subset_indices(n_interventions,
+                                                                                          n_interventions)]
+        self._compute_all()
+
+    def _combination_key(self, indices: tuple) -> str:
+        return ','.join([self.one_interventions[index] for index in indices])
+
+    def _compute_evaluation_ages(self) -> np.array:
+        if self.fixed_evaluation_ages is not None:
+            return self.fixed_evaluation_ages
+        return calculate_ages(self.dataset[extract_four_intervention_keys(self.dataset)])
+
+    def _evaluate(self, key: str) -> np.array:
+        if key not in self.parameters.keys():
+            return np.full(np.shape(self.ages), np.nan)
+        return gompertz(self.ages, *self.parameters[key])
+
+    def _compute_interaction_factors(self) -> np.array:
+        self.interaction_factors = InteractionFactors(self.effects[1:1 + len(self.one_interventions)],
+                                                      self.three_interventions_mortality,
+                                                      combination_indices=self.combination_indices)
+        self.interaction_factors.calculate()
+        return np.asarray(self.interaction_factors.to_numpy()).T
+
+    def _compute_all(self) -> None:
+        self.ages = self._compute_evaluation_ages()
+        n_interventions = len(self.one_interventions)
+
+        self.three_interventions_mortality = np.array([self._evaluate(key) for key in self.three_interventions])
+        self.three_interventions_mortality = self.three_interventions_mortality.reshape(len(self.three_interventions),
+                                                                                        len(self.ages))
+        self.effects = np.vstack([self._evaluate(NO_INTERVENTION_DATASET_KEY)[None, :]]
+                                 + [self._evaluate(key)[None, :] for key in self.one_interventions]
+                                 + [np.zeros((n_interventions * (n_interventions - 1) // 2, len(self.ages)))])
+        self.effects[1 + n_interventions:] = self._compute_interaction_factors()
+        self.mortality_rate = KeyedMortality(self.keys, self.subset_matrix @ self.effects)
+
+    def append(self, category: str, x: np.array, y: np.array) -> UpdateReport:
+        """Appends the survival points (x in days, y) of one category and updates the model"""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        return self.update(pd.DataFrame({'x': x, 'y': np.broadcast_to(y, x.shape), CATEGORY_COLUMN: category}))
+
+    def update(self, new_rows: pd.DataFrame) -> UpdateReport:
+        """Appends `new_rows` (x, y and category columns, as in the final
+           datasets, whose category names are fixed like `load_and_preprocess`
+           does) and updates the parameters, effects and predictions that
+           depend on the groups which received points"""
+        start_time = time.perf_counter()
+        new_rows = preprocess_dataset(new_rows)
+        new_rows.index = pd.RangeIndex(self._n_rows, self._n_rows + len(new_rows))
+        self._n_rows += len(new_rows)
+        self._raw_parts.append(new_rows)
+
+        # a new category changes the interventions, so everything is rebuilt
+        if not set(new_rows[CATEGORY_COLUMN].unique()) <= self.categories:
+            self._rebuild()
+            return UpdateReport(refitted_keys=list(self.dataset.keys()), changed_effects=len(self.effects),
+                                recomputed_predictions=len(self.keys), full_recompute=True,
+                                elapsed_seconds=time.perf_counter() - start_time)
+
+        changed_keys = []
+        for category, rows in new_rows.groupby(CATEGORY_COLUMN, sort=False):
+            key = create_canonical_intervention_key(category, self.one_interventions)
+            group = self.dataset[key]
+            self.dataset[key] = pd.concat([group, rows.reindex(columns=group.columns)])
+            changed_keys.append(key)
+
+        for key in changed_keys:
+            self._refit(key)
+
+        if self.fixed_evaluation_ages is None and extract_four_intervention_keys(self.dataset) in changed_keys:
+            self._compute_all()
+            return UpdateReport(refitted_keys=changed_keys, changed_effects=len(self.effects),
+                                recomputed_predictions=len(self.keys), full_recompute=True,
+                                elapsed_seconds=time.perf_counter() - start_time)
+
+        changed_effects = self._update_effects(changed_keys)
+        recomputed_rows = self._update_predictions(changed_effects)
+        return UpdateReport(refitted_keys=changed_keys, changed_effects=len(changed_effects),
+                            recomputed_predictions=len(recomputed_rows), full_recompute=False,
+                            elapsed_seconds=time.perf_counter() - start_time)
+
+    def _refit(self, key: str) -> None:
+        previous_parameters = GompertzParameters.from_sequence(self.parameters[key])
+        predicted_parameters = fit_gompertz_model(calculate_ages(self.dataset[key]),
+                                                  calculate_mortality_rate(self.dataset[key]),
+                                                  initial_parameters=previous_parameters, cache=self.cache)
+        self.parameters.alphas[key] = predicted_parameters.alpha
+        self.parameters.betas[key] = predicted_parameters.beta
+
+    def _update_effects(self, changed_keys: [str]) -> np.array:
+        """Recomputes the effects of `changed_keys` and returns the indices of the changed effect rows"""
+        n_interventions = len(self.one_interventions)
+        changed_effects = []
+        interactions_changed = False
+
+        for key in changed_keys:
+            if key == NO_INTERVENTION_DATASET_KEY:
+                self.effects[0] = self._evaluate(key)
+                changed_effects.append(0)
+            elif key in self.one_interventions:
+                index = self.one_interventions.index(key)
+                self.effects[1 + index] = self._evaluate(key)
+                changed_effects.append(1 + index)
+                interactions_changed = True
+            elif key in self.three_interventions:
+                self.three_interventions_mortality[self.three_interventions.index(key)] = self._evaluate(key)
+                interactions_changed = True
+
+        if interactions_changed:
+            previous_factors = self.effects[1 + n_interventions:].copy()
+            self.effects[1 + n_interventions:] = self._compute_interaction_factors()
+            changed_pairs = np.flatnonzero(np.any(self.effects[1 + n_interventions:] != previous_factors, axis=1))
+            changed_effects += list(1 + n_interventions + changed_pairs)
+
+        return np.array(sorted(changed_effects), dtype=np.int64)
+
+    def _update_predictions(self, changed_effects: np.array) -> np.array:
+        """Recomputes the predictions of the subsets with a changed effect and returns their rows"""
+        if len(changed_effects) == 0:
+            return changed_effects
+
+        rows = np.flatnonzero(self.subset_columns[:, changed_effects].getnnz(axis=1) > 0)
+        mortality_rate = self.mortality_rate.to_numpy().copy()
+        mortality_rate[rows] = self.subset_matrix[rows] @ self.effects
+        self.mortality_rate = KeyedMortality(self.keys, mortality_rate)
+        return rows
+
+    def slopes(self) -> pd.Series:
+        """The log mortality slopes of all combinations (see `InterventionSlopes.calculate_slopes`)"""
+        return pd.Series(self.mortality_rate.slopes(self.ages), index=self.keys, name='slope')
@@ -0,0 +1,284 @@
+import functools
+import importlib
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from collections.abc import Mapping
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+PACKAGE = __package__
+
+# (module, attribute) of the instrumented hot paths, `Class.method` for methods
+DEFAULT_TARGETS = [
+    ('columnar', 'read_csv'),
+    ('columnar', 'load_columnar'),
+    ('data', 'load_csv'),
+    ('data', 'load_and_preprocess'),
+    ('data', 'create_dataset_mapping'),
+    ('gompertz', 'curve_fit'),
+    ('gompertz', 'fit_gompertz_model'),
+    ('gompertz', 'Parameters.compute'),
+    ('gompertz', 'compute_alpha_and_beta'),
+    ('interaction_factors', 'InteractionFactors.calculate'),
+    ('mortality_rate', 'MortalityRateFactory.create'),
+    ('mortality_rate', 'compute_mortality_per_intervention'),
+    ('mortality_rate', 'compute_mortality_by_n_interventions'),
+    ('mortality_rate', 'compute_actual_mortalities'),
+    ('plotting', 'Plotter.plot'),
+]
+
+CURVE_FIT_TARGET = 'curve_fit'
+
+
+@dataclass
+class TraceEvent:
+    name: str
+    depth: int
+    parent: Optional[int]
+    start_seconds: float
+    seconds: float = 0.0
+    child_seconds: float = 0.0
+    input_elements: int = 0
+    output_elements: int = 0
+    function_evaluations: int = 0   # of `curve_fit`, including nested calls
+    peak_bytes: Optional[int] = None
+    error: Optional[str] = None
+    recursive: bool = False   # called (indirectly) by itself
+
+
+def count_elements(value) -> int:
+    """Returns the number of array elements in `value` (one level deep for containers)"""
+    if isinstance(value, (np.ndarray, pd.DataFrame, pd.Series)):
+        return int(value.size)
+    if isinstance(value, Mapping):
+        return sum([_count_leaf_elements(item) for item in value.values()])
+    if isinstance(value, (list, tuple)):
+        return sum([_count_leaf_elements(item) for item in value])
+    return 0
+
+def _count_leaf_elements(value) -> int:
+    if isinstance(value, (np.ndarray, pd.DataFrame, pd.Series)):
+        return int(value.size)
+    if isinstance(value, (int, float, np.number)):
+        return 1
+    return 0
+
+
+class Trace:
+    """Structured trace of the instrumented calls (see `instrument`)"""
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.events = []
+        self.stack = []
+        self.start_time = time.perf_counter()
+
+        # the highest traced memory of every open call, tracemalloc only keeps one global peak
+        self.memory_stack = []
+
+    def call(self, name: str, function, args: tuple, kwargs: dict):
+        event = TraceEvent(name=name, depth=len(self.stack), parent=self.stack[-1] if self.stack else None,
+                           start_seconds=time.perf_counter() - self.start_time,
+                           input_elements=count_elements(args) + count_elements(kwargs),
+                           recursive=any([self.events[parent].name == name for parent in self.stack]))
+        index = len(self.events)
+        self.events.append(event)
+        self.stack.append(index)
+        memory_at_start = self._enter_memory()
+
+        start_time = time.perf_counter()
+        try:
+            if name == CURVE_FIT_TARGET:
+                result = self._call_curve_fit(function, args, kwargs)
+            else:
+                result = function(*args, **kwargs)
+            event.output_elements = count_elements(result if isinstance(result, tuple) else (result,))
+            return result
+        except Exception as exception:
+            event.error = type(exception).__name__
+            raise
+        finally:
+            event.seconds = time.perf_counter() - start_time
+            self.stack.pop()
+            self._exit_memory(event, memory_at_start)
+            if event.parent is not None:
+                self.events[event.parent].child_seconds += event.seconds
+
+    def _call_curve_fit(self, function, args: tuple, kwargs: dict):
+        if kwargs.get('full_output', False):
+            result = function(*args, **kwargs)
+            function_evaluations = result[2]['nfev']
+        else:
+            predicted_parameters, covariance, information, _, _ = function(*args, full_output=True, **kwargs)
+            result = (predicted_parameters, covariance)
+            function_evaluations = information['nfev']
+
+        for index in self.stack:
+            self.events[index].function_evaluations += function_evaluations
+        return result
+
+    def _enter_memory(self) -> int:
+        if not self.memory or not tracemalloc.is_tracing():
+            return 0
+        current, peak = tracemalloc.get_traced_memory()
+        if self.memory_stack:
+            self.memory_stack[-1] = max(self.memory_stack[-1], peak)
+        tracemalloc.reset_peak()
+        self.memory_stack.append(current)
+        return current
+
+    def _exit_memory(self, event: TraceEvent, memory_at_start: int) -> None:
+        if not self.memory or not self.memory_stack:
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, self.memory_stack.pop())
+        event.peak_bytes = peak - memory_at_start
+        if self.memory_stack:
+            self.memory_stack[-1] = max(self.memory_stack[-1], peak)
+
+    def to_frame(self) -> pd.DataFrame:
+        frame = pd.DataFrame([asdict(event) for event in self.events], columns=list(TraceEvent.__dataclass_fields__))
+        frame['self_seconds'] = frame['seconds'] - frame['child_seconds']
+        return frame
+
+    def summary(self) -> pd.DataFrame:
+        """Returns the calls, times, curve_fit evaluations, array sizes and
+           memory peaks per instrumented function, slowest first"""
+        frame = self.to_frame()
+        if frame.empty:
+            return frame
+
+        summary = frame.groupby('name').agg(calls=('seconds', 'size'), total_seconds=('seconds', 'sum'),
+                                            self_seconds=('self_seconds', 'sum'), mean_seconds=('seconds', 'mean'),
+                                            max_seconds=('seconds', 'max'),
+                                            function_evaluations=('function_evaluations', 'sum'),
+                                            input_elements=('input_elements', 'sum'),
+                                            output_elements=('output_elements', 'sum'),
+                                            peak_bytes=('peak_bytes', 'max'), errors=('error', 'count'))
+
+        # recursive calls would otherwise be counted twice
+        summary['total_seconds'] = frame[~frame['recursive']].groupby('name')['seconds'].sum()
+        return summary.sort_values('total_seconds', ascending=False)
+
+    def to_json(self, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump([asdict(event) for event in self.events], file, indent=1)
+
+    def clear(self) -> None:
+        self.events = []
+        self.stack = []
+        self.memory_stack = []
+        self.start_time = time.perf_counter()
+
+
+_active_trace = None
+_patches = []
+_started_tracemalloc = False
+
+
+def _instrumented(function, name: str):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # calls during a disable (e.g. from another thread) fall through
+        trace = _active_trace
+        if trace is None:
+            return function(*args, **kwargs)
+        return trace.call(name, function, args, kwargs)
+    wrapper.__instrumented__ = function
+    return wrapper
+
+def _namespaces() -> list:
+    """The helpers modules and the notebook namespace, which may hold `from helpers.x import *` copies"""
+    modules = [module for name, module in list(sys.modules.items())
+               if name.startswith(PACKAGE + '.') and module is not None]
+    if '__main__' in sys.modules:
+        modules.append(sys.modules['__main__'])
+    return modules
+
+def _patch_function(module, attribute: str) -> None:
+    original = getattr(module, attribute)
+    wrapper = _instrumented(original, attribute if attribute == CURVE_FIT_TARGET
+                            else f'{module.__name__.split(".")[-1]}.{attribute}')
+
+    for namespace in _namespaces():
+        for name, value in list(vars(namespace).items()):
+            if value is original:
+                setattr(namespace, name, wrapper)
+                _patches.append((namespace, name, original))
+
+def _patch_method(module, attribute: str) -> None:
+    class_name, method_name = attribute.split('.')
+    cls = getattr(module, class_name)
+    original = cls.__dict__[method_name]
+
+    name = f'{class_name}.{method_name}'
+    if isinstance(original, staticmethod):
+        wrapper = staticmethod(_instrumented(original.__func__, name))
+    else:
+        wrapper = _instrumented(original, name)
+
+    setattr(cls, method_name, wrapper)
+    _patches.append((cls, method_name, original))
+
+def is_enabled() -> bool:
+    return _active_trace is not None
+
+def enable(memory: bool = False, targets: [(str, str)] = DEFAULT_TARGETS) -> Trace:
+    """Wraps the `targets` into recording wrappers and returns the trace they
+       record into. With `memory`, allocation peaks are traced with tracemalloc,
+       which slows the traced code down noticeably.
+
+       Nothing is wrapped while the instrumentation is disabled, so it has no
+       cost then. Only names bound at the time of `enable` are instrumented,
+       so import the notebook helpers before enabling it."""
+    global _active_trace, _started_tracemalloc
+    if _active_trace is not None:
+        disable()
+
+    for module_name, attribute in targets:
+        module = importlib.import_module(f'.{module_name}', PACKAGE)
+        if '.' in attribute:
+            _patch_method(module, attribute)
+        else:
+            _patch_function(module, attribute)
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+
+    _active_trace = Trace(memory=memory)
+    return _active_trace
+
+def disable() -> Optional[Trace]:
+    """Restores the original functions and returns the recorded trace"""
+    global _active_trace, _started_tracemalloc
+    for namespace, name, original in reversed(_patches):
+        setattr(namespace, name, original)
+    _patches.clear()
+
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+    trace, _active_trace = _active_trace, None
+    return trace
+
+@contextmanager
+def instrument(memory: bool = False, targets: [(str, str)] = DEFAULT_TARGETS):
+    """Instruments the helpers inside the `with` block, e.g.
+
+           with instrument() as trace:
+               parameters = Parameters(female_dataset).compute()
+           trace.summary()"""
+    trace = enable(memory=memory, targets=targets)
+    try:
+        yield trace
+    finally:
+        disable()
@@ -1,6 +1,113 @@
 import numpy as np
 
+from collections.abc import Mapping
+from functools import lru_cache
 from itertools import combinations
+from scipy.sparse import csr_matrix, hstack
+
+
+@lru_cache(maxsize=None)
+def create_pair_indices(n_interventions: int) -> [(int, int)]:
+    """Returns the (i, j) intervention pairs in the column order of the design matrix"""
+    return list(combinations(range(n_interventions), 2))
+
+@lru_cache(maxsize=None)
+def create_combination_indices(n_interventions: int, order: int) -> [tuple]:
+    """Returns all combinations of `order` out of `n_interventions` interventions
+       in lexicographic order, which is the row order used for combination data"""
+    return list(combinations(range(n_interventions), order))
+
+def create_combination_indices_from_keys(one_interventions: [str], keys: [str], order: int = None) -> [tuple]:
+    """Returns the (sorted) indices into `one_interventions` of the single
+       interventions of every combination key, e.g. 'Rapamycin,mTERT' -> (0, 3)
+       for `ALL_TREATMENTS`. Raises a ValueError for unknown interventions and
+       for keys that are not a combination of `order` interventions"""
+    positions = {intervention: index for index, intervention in enumerate(one_interventions)}
+
+    combination_indices = []
+    for key in keys:
+        interventions = key.split(',') if key else []
+        unknown = [intervention for intervention in interventions if intervention not in positions]
+        if unknown:
+            raise ValueError(f'Unknown interventions {unknown} in {key!r}, expected any of {list(one_interventions)}')
+        indices = tuple(sorted(positions[intervention] for intervention in interventions))
+        if len(set(indices)) != len(indices) or (order is not None and len(indices) != order):
+            raise ValueError(f'{key!r} is not a combination of {order} different interventions')
+        combination_indices.append(indices)
+    return combination_indices
+
+def _pair_column(i: int, j: int, n_interventions: int) -> int:
+    """Returns the column of pair (i, j), i < j, in lexicographic pair order"""
+    return i * n_interventions - i * (i + 1) // 2 + (j - i - 1)
+
+@lru_cache(maxsize=None)
+def create_design_matrix(n_interventions: int, combination_indices: tuple) -> csr_matrix:
+    """Returns the sparse (combinations x pairs) linear model, where the (c, p)
+       entry is one if pair p is part of combination c. For four interventions
+       and their four three intervention combinations this is `LINEAR_MODEL`"""
+    rows = []
+    columns = []
+    for row, indices in enumerate(combination_indices):
+        for i, j in combinations(sorted(indices), 2):
+            rows.append(row)
+            columns.append(_pair_column(i, j, n_interventions))
+
+    n_pairs = n_interventions * (n_interventions - 1) // 2
+    values = np.ones(len(rows), dtype=np.float64)
+    return csr_matrix((values, (rows, columns)), shape=(len(combination_indices), n_pairs))
+
+@lru_cache(maxsize=None)
+def create_membership_matrix(n_interventions: int, combination_indices: tuple) -> csr_matrix:
+    """Returns the sparse (combinations x interventions) matrix, where the (c, i)
+       entry is one if intervention i is part of combination c"""
+    rows = [row for row, indices in enumerate(combination_indices) for _ in indices]
+    columns = [index for indices in combination_indices for index in indices]
+    values = np.ones(len(rows), dtype=np.float64)
+    return csr_matrix((values, (rows, columns)), shape=(len(combination_indices), n_interventions))
+
+@lru_cache(maxsize=None)
+def create_subset_indices(n_interventions: int, max_order: int) -> [tuple]:
+    """Returns all subsets of up to `max_order` interventions, ordered by
+       their number of interventions and lexicographically within an order"""
+    subset_indices = []
+    for order in range(max_order + 1):
+        subset_indices += create_combination_indices(n_interventions, order)
+    return subset_indices
+
+@lru_cache(maxsize=None)
+def create_subset_matrix(n_interventions: int, max_order: int) -> csr_matrix:
+    """Returns the sparse (subsets x [no intervention, interventions, pairs])
+       indicator matrix of all subsets of up to `max_order` interventions, i.e.
+       the no intervention column of the empty subset next to the membership
+       and the design matrix of all subsets"""
+    subset_indices = tuple(create_subset_indices(n_interventions, max_order))
+    no_intervention = csr_matrix(([1.0], ([0], [0])), shape=(len(subset_indices), 1))
+    return hstack([no_intervention,
+                   create_membership_matrix(n_interventions, subset_indices),
+                   create_design_matrix(n_interventions, subset_indices)], format='csr')
+
+
+class InteractionSolver:
+    """Minimum norm least squares solver for the interaction factors of a design.
+
+       The pseudo-inverse of the (pairs x pairs) gram matrix is computed once,
+       after which every solve is one sparse and one dense product, so this
+       scales to hundreds of pairs and thousands of combinations"""
+
+    def __init__(self, design: csr_matrix):
+        self.design = design
+        gram = (design.T @ design).toarray()
+        self.inverse_gram = np.linalg.pinv(gram, hermitian=True)
+
+    def solve(self, diffs: np.array) -> np.array:
+        """Solves design @ factors = diffs for a (combinations x ...) `diffs`"""
+        flat_diffs = diffs.reshape(diffs.shape[0], int(np.prod(diffs.shape[1:])))
+        factors = self.inverse_gram @ (self.design.T @ flat_diffs)
+        return factors.reshape((self.inverse_gram.shape[0],) + diffs.shape[1:])
+
+@lru_cache(maxsize=32)
+def get_interaction_solver(n_interventions: int, combination_indices: tuple) -> InteractionSolver:
+    return InteractionSolver(create_design_matrix(n_interventions, combination_indices))
 
 
 class InteractionFactors:
@@ -10,7 +117,7 @@ class InteractionFactors:
        then the interaction factor will be e_ab - e_a - e_b.
        That is, it measures the non-linearity of the interaction"""
 
-    # Here we have the linear model
+    # Here we have the linear model for four interventions
     # the (i, j) entry being one in a row
     # represents the (i, j) factor
     # being included.
@@ -20,6 +127,9 @@ class InteractionFactors:
     #
     # the columns represent factors:
     # (1,2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)
+    #
+    # For any other number of interventions the
+    # model is generated by `create_design_matrix`
     LINEAR_MODEL = np.array([
                 [1, 1, 0, 1, 0, 0],
                 [1, 0, 1, 0, 1, 0],
@@ -27,40 +137,82 @@ class InteractionFactors:
                 [0, 0, 0, 1, 1, 1],
     ])
 
-    def __init__(self, one_interventions_mortality, three_interventions_mortality):
+    def __init__(self, one_interventions_mortality, three_interventions_mortality, combination_indices: [tuple] = None,
+                 one_interventions: [str] = None, three_interventions: [str] = None):
+        """`combination_indices[c]` are the single interventions that make up
+           the c-th row of `three_interventions_mortality`.
+
+           The rows are best matched by key: with the names of the single
+           (`one_interventions`) and of the three intervention rows
+           (`three_interventions`, e.g. from `extract_three_intervention_keys`,
+           which keeps the dataset order), the indices are derived from the
+           keys. Mappings of keys to mortality rates are matched the same way.
+           Without keys the rows must be all three intervention combinations
+           in lexicographic order. Raises a ValueError if the keys, the indices
+           and the rows do not match."""
+        if isinstance(one_interventions_mortality, Mapping):
+            one_interventions = list(one_interventions_mortality.keys()) if one_interventions is None \
+                else list(one_interventions)
+            one_interventions_mortality = [one_interventions_mortality[key] for key in one_interventions]
+        if isinstance(three_interventions_mortality, Mapping):
+            three_interventions = list(three_interventions_mortality.keys()) if three_interventions is None \
+                else list(three_interventions)
+            three_interventions_mortality = [three_interventions_mortality[key] for key in three_interventions]
+
         self.one_interventions_mortality = one_interventions_mortality
         self.three_interventions_mortality = three_interventions_mortality
 
+        n_interventions = np.shape(one_interventions_mortality)[-2]
+        if one_interventions is not None and len(one_interventions) != n_interventions:
+            raise ValueError(f'{len(one_interventions)} single intervention keys for {n_interventions} rows')
+
+        if three_interventions is not None:
+            if one_interventions is None:
+                raise ValueError('Matching the three intervention rows by key needs the single intervention keys')
+            key_indices = create_combination_indices_from_keys(one_interventions, three_interventions, order=3)
+            if combination_indices is not None and [tuple(indices) for indices in combination_indices] != key_indices:
+                raise ValueError('The combination indices do not match the three intervention keys')
+            combination_indices = key_indices
+        elif combination_indices is None:
+            combination_indices = create_combination_indices(n_interventions, 3)
+
+        n_rows = np.shape(three_interventions_mortality)[-2] if np.ndim(three_interventions_mortality) >= 2 \
+            else len(three_interventions_mortality)
+        if n_rows != len(combination_indices):
+            raise ValueError(f'{n_rows} three intervention rows for {len(combination_indices)} combinations, '
+                             'pass the keys of the rows to match them')
+
+        self.n_interventions = n_interventions
+        self.combination_indices = tuple(tuple(indices) for indices in combination_indices)
+        self.one_interventions = None if one_interventions is None else list(one_interventions)
+        self.three_interventions = None if self.one_interventions is None else \
+            [','.join([self.one_interventions[index] for index in indices]) for indices in self.combination_indices]
+
         self.interaction_factors = np.array([])
 
     def calculate(self):
         diffs = self._compute_intervention_differences()
-    
-        inverse_linear_model = np.linalg.pinv(self.LINEAR_MODEL)
-        
-        interaction_factors = []
-        for time_step in range(len(diffs[0])):
-            current_time_step_diff = np.array(list([diff[time_step] for diff in diffs]))
-            time_step_interaction_factors = inverse_linear_model @ current_time_step_diff
-            interaction_factors.append(time_step_interaction_factors)
-        
-        self.interaction_factors = np.array(interaction_factors)
+
+        # solves all time steps at once, which gives (pairs x ... x steps).
+        # Leading dimensions (e.g. bootstrap replicates) are broadcast.
+        solver = get_interaction_solver(self.n_interventions, self.combination_indices)
+        interaction_factors = solver.solve(np.moveaxis(diffs, -2, 0))
+        self.interaction_factors = np.moveaxis(interaction_factors, 0, -1)
 
     def _compute_intervention_differences(self):
         """
-        Here we compute the different between the predicted mortality rates of three interventions
-        and the individual interventions mortality rates that make up the three interventions
+        Here we compute the different between the predicted mortality rates of the combinations
+        and the individual interventions mortality rates that make up the combinations
+        as a (combinations x steps) matrix. The inputs are not modified.
         """
-        three_intervention_indices = list(combinations(range(4), 3))
-    
-        diffs = []
-        for i in range(len(three_intervention_indices)):
-            diff = self.three_interventions_mortality[i]
-            for index in three_intervention_indices[i]:
-                diff -= np.array(self.one_interventions_mortality[index])
-            diffs.append(diff)
-    
-        return diffs
+        one_interventions_mortality = np.asarray(self.one_interventions_mortality, dtype=np.float64)
+        three_interventions_mortality = np.asarray(self.three_interventions_mortality, dtype=np.float64)
+
+        membership = create_membership_matrix(self.n_interventions, self.combination_indices)
+        one_interventions_mortality = np.moveaxis(one_interventions_mortality, -2, 0)
+        flat_mortality = one_interventions_mortality.reshape(self.n_interventions, -1)
+        single_contributions = (membership @ flat_mortality).reshape((membership.shape[0],) + one_interventions_mortality.shape[1:])
+        return three_interventions_mortality - np.moveaxis(single_contributions, 0, -2)
 
     def to_numpy(self):
         return self.interaction_factors
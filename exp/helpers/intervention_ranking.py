@@ -0,0 +1,145 @@
+import heapq
+
+import numpy as np
+
+from itertools import combinations, islice
+from math import comb
+
+from .interaction_factors import create_design_matrix, create_membership_matrix
+from .intervention_slopes import InterventionSlopes
+from .mortality_rate import EPS, MortalityRateArguments
+
+NO_INTERVENTION_KEY = 'No Interventions'
+DEFAULT_BATCH_SIZE = 4_096
+DEFAULT_MAX_COMBINATIONS = 5_000_000
+
+# the sparse builders are cached per design, which is not wanted for one-off batches
+_create_design_matrix = create_design_matrix.__wrapped__
+_create_membership_matrix = create_membership_matrix.__wrapped__
+
+
+class InterventionRanking:
+    """Ranks intervention combinations by the slope of their predicted
+       log mortality rate (lower is better, see `InterventionSlopes.calculate_slopes`).
+
+       The mortality rate of a combination is the sum of its single
+       intervention mortality rates and of the interaction factors of all
+       pairs in it, which is the model of `MortalityRateFactory`. Combinations
+       are scored in vectorized batches and only the best `k` are kept in
+       a heap, so memory does not depend on the number of combinations."""
+
+    def __init__(self, one_interventions: [str], one_intervention_mortality, interaction_factors,
+                 evaluation_ages, no_intervention_mortality=None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.one_interventions = list(one_interventions)
+        self.one_intervention_mortality = np.asarray(one_intervention_mortality, dtype=np.float64)
+        self.interaction_factors = np.asarray(interaction_factors.to_numpy(), dtype=np.float64)
+        self.evaluation_ages = np.asarray(evaluation_ages)
+        self.no_intervention_mortality = no_intervention_mortality
+        self.batch_size = batch_size
+
+        self.n_interventions = len(self.one_interventions)
+        self.n_scored = 0
+
+    @staticmethod
+    def from_arguments(arguments: MortalityRateArguments, one_interventions: [str],
+                       no_intervention_mortality=None, batch_size: int = DEFAULT_BATCH_SIZE) -> 'InterventionRanking':
+        return InterventionRanking(one_interventions, arguments.one_intervention_mortality,
+                                   arguments.interaction_factors, arguments.evaluation_ages,
+                                   no_intervention_mortality=no_intervention_mortality, batch_size=batch_size)
+
+    def combination_key(self, indices: tuple) -> str:
+        return ','.join([self.one_interventions[index] for index in indices])
+
+    def score(self, combination_indices: [tuple]) -> np.array:
+        """Returns the log mortality slopes of the given combinations"""
+        combination_indices = tuple(combination_indices)
+        membership = _create_membership_matrix(self.n_interventions, combination_indices)
+        design = _create_design_matrix(self.n_interventions, combination_indices)
+
+        mortality = membership @ self.one_intervention_mortality + design @ self.interaction_factors.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_mortality = np.log(mortality + EPS)
+            slopes = InterventionSlopes.calculate_slopes(self.evaluation_ages, log_mortality)
+
+        self.n_scored += len(combination_indices)
+
+        # combinations with non-positive predicted mortality cannot be ranked
+        return np.where(np.isfinite(slopes), slopes, np.inf)
+
+    def top_k(self, k: int = 10, max_order: int = None, beam_width: int = None,
+              max_combinations: int = DEFAULT_MAX_COMBINATIONS) -> [(str, float)]:
+        """Returns the `k` best combinations as (key, slope) pairs, best first.
+
+           All combinations up to `max_order` interventions are enumerated,
+           unless `beam_width` is given, in which case order n + 1 only extends
+           the `beam_width` best combinations of order n (bounded search).
+           Exhaustive searches over more than `max_combinations` raise."""
+        if max_order is None:
+            max_order = self.n_interventions
+        max_order = min(max_order, self.n_interventions)
+
+        if beam_width is None:
+            n_combinations = sum([comb(self.n_interventions, order) for order in range(1, max_order + 1)])
+            if n_combinations > max_combinations:
+                raise ValueError(f'Exhaustive search over {n_combinations} combinations, '
+                                 f'set `max_order` or `beam_width` to bound the search')
+
+        self.n_scored = 0
+
+        # min heap of (-slope, key), i.e. the worst kept combination is on top
+        best = []
+        if self.no_intervention_mortality is not None:
+            log_mortality = np.log(np.asarray(self.no_intervention_mortality) + EPS)
+            slope = InterventionSlopes.calculate_slopes(self.evaluation_ages, log_mortality)
+            self._push(best, k, NO_INTERVENTION_KEY, float(slope))
+
+        beam = None
+        for order in range(1, max_order + 1):
+            if beam_width is None:
+                candidates = combinations(range(self.n_interventions), order)
+            else:
+                candidates = self._extend_beam(beam, order)
+
+            order_best = []
+            for batch in iter(lambda: list(islice(candidates, self.batch_size)), []):
+                slopes = self.score(batch)
+                for indices, slope in zip(batch, slopes):
+                    if np.isfinite(slope):
+                        self._push(best, k, indices, slope)
+                        if beam_width is not None:
+                            self._push(order_best, beam_width, indices, slope)
+
+            if beam_width is not None:
+                beam = [indices for _, indices in order_best]
+
+        ranked = sorted([(-negative_slope, key) for negative_slope, key in best])
+        return [(self._to_key(key), slope) for slope, key in ranked]
+
+    def to_slopes(self, ranked: [(str, float)]) -> InterventionSlopes:
+        """Wraps a ranking into `InterventionSlopes`, e.g. for `plot_inverse_slopes`"""
+        slopes = InterventionSlopes()
+        for key, slope in ranked:
+            slopes.slopes[key] = slope
+        return slopes
+
+    def _extend_beam(self, beam, order):
+        if beam is None:
+            return combinations(range(self.n_interventions), order)
+
+        extended = set()
+        for indices in beam:
+            for index in range(self.n_interventions):
+                if index not in indices:
+                    extended.add(tuple(sorted(indices + (index,))))
+        return iter(sorted(extended))
+
+    def _to_key(self, key) -> str:
+        return key if isinstance(key, str) else self.combination_key(key)
+
+    @staticmethod
+    def _push(heap, k, key, slope):
+        entry = (-float(slope), key)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
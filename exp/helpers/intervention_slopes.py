@@ -1,4 +1,4 @@
-import matplotlib.pyplot as plt
+import numpy as np
 
 class InterventionSlopes:
     """Compute and stores the slop of the log mortality rate"""
@@ -9,12 +9,33 @@ class InterventionSlopes:
     def add_intervention_slope(self, key, ages, log_mortality):
         self.slopes[key] = self._calculate_slope(ages, log_mortality)
 
+    def add_intervention_slopes(self, keys, ages, log_mortality):
+        """Adds the slopes of all rows of the (keys x ages) `log_mortality` at
+           once, with the same definition as `add_intervention_slope`"""
+        log_mortality = np.asarray(log_mortality)
+        numerator = log_mortality[..., -1] - log_mortality[..., 0]
+        denominator = ages[-1] - log_mortality[..., 0]
+        for key, slope in zip(keys, numerator / denominator):
+            self.slopes[key] = slope
+
     def _calculate_slope(self, ages, log_mortality):
+        # the definition of 004_SecondOrderModel.ipynb, which is kept to
+        # reproduce its results. The denominator subtracts a log mortality
+        # from an age, so new rankings use `calculate_slopes`
         numerator = log_mortality[-1] - log_mortality[0]
         denominator = ages[-1] - log_mortality[0]
         slope = numerator / denominator
         return slope
 
+    @staticmethod
+    def calculate_slopes(ages, log_mortality):
+        """Returns the slopes (log_mortality[-1] - log_mortality[0]) / (ages[-1] - ages[0])
+           of the rows of `log_mortality`, i.e. the average change of the log
+           mortality rate per unit of age"""
+        log_mortality = np.asarray(log_mortality)
+        numerator = log_mortality[..., -1] - log_mortality[..., 0]
+        return numerator / (ages[-1] - ages[0])
+
     def calculate_best_intervention(self):
         best_intervention = None
         best_slope = None
@@ -27,6 +48,9 @@ class InterventionSlopes:
         return best_intervention
     
     def plot_inverse_slopes(self):
+        # pyplot is only imported for plotting, so the slope computations stay light to import
+        import matplotlib.pyplot as plt
+
         fig = plt.figure(figsize=(15, 3))
 
         inverse_sorted_slopes = self._calculate_inverse_sorted_slopes()
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+from glob import glob
+
+AGE_IN_DAYS_COLUMN = 'age(days)'
+STATUS_COLUMN = 'status'
+DEATH_COLUMN = 'dead'
+COHORT_COLUMN = 'cohort'
+GROUP_COLUMN = 'group'
+# the group names repeat across the cohort files, so a group is keyed by its cohort too
+DEFAULT_GROUP_COLUMNS = (COHORT_COLUMN, GROUP_COLUMN)
+DEAD_STATUS = 'dead'
+
+DEATHS_COLUMN = 'deaths'
+CENSORED_COLUMN = 'censored'
+AT_RISK_COLUMN = 'at risk'
+PROBABILITY_OF_DEATH_PER_PERIOD_COLUMN = 'p(death per time period)'
+
+DEFAULT_BIN_PERIOD_IN_DAYS = 13
+DEFAULT_CHUNK_SIZE = 100_000
+ITP_FILE_PATTERN = 'Lifespan_C20*.csv'
+
+
+class LifeTableBuilder:
+    """Builds binned life tables (deaths, censored, number at risk and the
+       probability of death per time period) from individual lifespan records
+       in a single streaming pass. Only the (groups x bins) counts are kept,
+       so memory does not depend on the number of records.
+
+       A record is a death if its status is 'dead' and is censored otherwise
+       (e.g. 'removed' or 'Live'). Censored animals are counted at risk in the
+       period in which they are censored. Groups are keyed by the values of
+       `group_columns`, by default (cohort, group)."""
+
+    def __init__(self, bin_period_in_days: int = DEFAULT_BIN_PERIOD_IN_DAYS,
+                 group_columns: [str] = DEFAULT_GROUP_COLUMNS):
+        self.bin_period_in_days = bin_period_in_days
+        self.group_columns = list(group_columns)
+
+        self.group_keys = []
+        self.group_indices = {}
+        self.deaths = np.zeros((0, 0), dtype=np.int64)
+        self.censored = np.zeros((0, 0), dtype=np.int64)
+
+    def update(self, records: pd.DataFrame) -> 'LifeTableBuilder':
+        ages = pd.to_numeric(records[AGE_IN_DAYS_COLUMN], errors='coerce').to_numpy()
+        valid = np.isfinite(ages)
+        if not valid.any():
+            return self
+
+        if STATUS_COLUMN in records.columns:
+            is_death = (records[STATUS_COLUMN] == DEAD_STATUS).to_numpy()
+        else:
+            is_death = (records[DEATH_COLUMN] == 1).to_numpy()
+
+        chunk_codes, chunk_keys = self._factorize_groups(records)
+        valid &= chunk_codes >= 0
+        group_indices = np.array([self._get_group_index(key) for key in chunk_keys], dtype=np.int64)
+
+        groups = group_indices[chunk_codes[valid]]
+        bins = (ages[valid] // self.bin_period_in_days).astype(np.int64)
+        is_death = is_death[valid]
+
+        self._grow(len(self.group_keys), bins.max() + 1)
+
+        n_bins = self.deaths.shape[1]
+        flat_indices = groups * n_bins + bins
+        self.deaths += np.bincount(flat_indices[is_death], minlength=self.deaths.size).reshape(self.deaths.shape)
+        self.censored += np.bincount(flat_indices[~is_death], minlength=self.censored.size).reshape(self.censored.shape)
+        return self
+
+    def update_from_files(self, paths: [str], chunk_size: int = DEFAULT_CHUNK_SIZE, sep: str = ';') -> 'LifeTableBuilder':
+        """Streams the records of all `paths` in chunks of `chunk_size` rows"""
+        columns = set(self.group_columns + [AGE_IN_DAYS_COLUMN, STATUS_COLUMN, DEATH_COLUMN])
+        for path in paths:
+            chunks = pd.read_csv(path, sep=sep, encoding='utf-8-sig', chunksize=chunk_size,
+                                 usecols=lambda column: column in columns)
+            for chunk in chunks:
+                self.update(chunk)
+        return self
+
+    def life_table(self, key) -> pd.DataFrame:
+        return self._create_life_table(self.group_indices[key])
+
+    def life_tables(self, remove_periods_without_deaths: bool = False) -> dict:
+        life_tables = {}
+        for key, group_index in self.group_indices.items():
+            life_table = self._create_life_table(group_index)
+            if remove_periods_without_deaths:
+                life_table = life_table[life_table[DEATHS_COLUMN] != 0]
+            life_tables[key] = life_table
+        return life_tables
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns all life tables as one tidy frame indexed by (group..., period)"""
+        life_tables = []
+        for key, life_table in self.life_tables().items():
+            key = key if isinstance(key, tuple) else (key,)
+            life_table = life_table.assign(**dict(zip(self.group_columns, key)))
+            life_tables.append(life_table.reset_index())
+        if not life_tables:
+            return pd.DataFrame()
+        return pd.concat(life_tables, ignore_index=True).set_index(self.group_columns + [self._index_name()])
+
+    def _create_life_table(self, group_index: int) -> pd.DataFrame:
+        deaths = self.deaths[group_index]
+        censored = self.censored[group_index]
+
+        # animals that died or were censored before the start of each period
+        exits = np.concatenate([[0], np.cumsum(deaths + censored)[:-1]])
+        at_risk = (deaths + censored).sum() - exits
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            probability_of_death = np.where(at_risk > 0, deaths / at_risk, np.nan)
+
+        life_table = pd.DataFrame({
+            AGE_IN_DAYS_COLUMN: np.arange(len(deaths)) * self.bin_period_in_days,
+            DEATHS_COLUMN: deaths,
+            CENSORED_COLUMN: censored,
+            AT_RISK_COLUMN: at_risk,
+            PROBABILITY_OF_DEATH_PER_PERIOD_COLUMN: probability_of_death
+        })
+        life_table.index.name = self._index_name()
+
+        # drop the periods after the last animal left the study
+        return life_table[at_risk > 0]
+
+    def _index_name(self) -> str:
+        return f'age(per {self.bin_period_in_days} days)'
+
+    def _factorize_groups(self, records: pd.DataFrame) -> (np.array, list):
+        if len(self.group_columns) == 1:
+            codes, keys = pd.factorize(records[self.group_columns[0]])
+            return codes, list(keys)
+
+        codes, keys = pd.factorize(pd.MultiIndex.from_frame(records[self.group_columns]))
+        return codes, list(keys)
+
+    def _get_group_index(self, key) -> int:
+        if key not in self.group_indices:
+            self.group_indices[key] = len(self.group_keys)
+            self.group_keys.append(key)
+        return self.group_indices[key]
+
+    def _grow(self, n_groups: int, n_bins: int) -> None:
+        current_groups, current_bins = self.deaths.shape
+        if n_groups <= current_groups and n_bins <= current_bins:
+            return
+
+        padding = ((0, max(n_groups - current_groups, 0)), (0, max(n_bins - current_bins, 0)))
+        self.deaths = np.pad(self.deaths, padding)
+        self.censored = np.pad(self.censored, padding)
+
+
+def build_itp_life_tables(directory: str, bin_period_in_days: int = DEFAULT_BIN_PERIOD_IN_DAYS,
+                          group_columns: [str] = DEFAULT_GROUP_COLUMNS,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE) -> LifeTableBuilder:
+    """Streams all ITP cohort files (`Lifespan_C20*.csv`) in `directory`"""
+    paths = sorted(glob(f'{directory}/{ITP_FILE_PATTERN}'))
+    builder = LifeTableBuilder(bin_period_in_days=bin_period_in_days, group_columns=group_columns)
+    return builder.update_from_files(paths, chunk_size=chunk_size)
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from collections import OrderedDict
+from functools import lru_cache
+
+ALL_TREATMENTS = ['Rapamycin', 'HSCs', 'Gal-Nav', 'mTERT']
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'MLP_model.pth')
+
+INPUT_SIZE = 1 + len(ALL_TREATMENTS)  # Age + Treatment vector size
+HIDDEN_SIZE = 64
+OUTPUT_SIZE = 1
+
+DEFAULT_MAX_CACHED_PREDICTIONS = 1_024
+
+
+class MLPModel(nn.Module):
+    """The MLP of 005_MLPModel.ipynb"""
+
+    def __init__(self, input_size, hidden_size, output_size):
+        super(MLPModel, self).__init__()
+        self.fc1 = nn.Linear(input_size, hidden_size)
+        self.fc2 = nn.Linear(hidden_size, output_size)
+        self.fc3 = nn.Linear(hidden_size, hidden_size)
+        self.relu = nn.ReLU()
+        self.elu = nn.ELU()
+        self.softpluts = nn.Softplus()
+
+    def forward(self, x):
+        x = self.fc1(x)
+        x = self.relu(x)
+        x = self.fc3(x)
+        x = self.elu(x)
+        x = self.fc2(x)
+        return x
+
+
+def create_treatment_vector(treatment_key: str, all_treatments: [str] = ALL_TREATMENTS) -> [int]:
+    """Returns the binary treatment vector of a canonical intervention key"""
+    treatments = treatment_key.split(',') if treatment_key else []
+    return [1 if treatment in treatments else 0 for treatment in all_treatments]
+
+
+class _NotebookModelUnpickler(pickle.Unpickler):
+    """The model file was saved from the notebook, so its class is `__main__.MLPModel`"""
+
+    def find_class(self, module, name):
+        if name == 'MLPModel':
+            return MLPModel
+        return super().find_class(module, name)
+
+class _NotebookPickleModule:
+    Unpickler = _NotebookModelUnpickler
+    load = pickle.load
+
+def load_model(path: str = DEFAULT_MODEL_PATH) -> MLPModel:
+    """Loads a model saved with `torch.save(model, path)` or `torch.save(model.state_dict(), path)`"""
+    loaded = torch.load(path, map_location='cpu', pickle_module=_NotebookPickleModule, weights_only=False)
+    state_dict = loaded.state_dict() if isinstance(loaded, nn.Module) else loaded
+
+    model = MLPModel(INPUT_SIZE, HIDDEN_SIZE, OUTPUT_SIZE)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+class MortalityPredictor:
+    """Batched inference for the MLP mortality model. A whole
+       (treatments x ages) mortality surface is predicted in one forward
+       pass, and the predictions of the `max_cached_predictions` most
+       recently used (treatment vector, ages) pairs are cached."""
+
+    def __init__(self, model: MLPModel, max_cached_predictions: int = DEFAULT_MAX_CACHED_PREDICTIONS):
+        self.model = model.eval()
+        self.max_cached_predictions = max_cached_predictions
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def load(path: str = DEFAULT_MODEL_PATH) -> 'MortalityPredictor':
+        """Returns the predictor of the model at `path`, which is only loaded
+           again when the file changed"""
+        stat = os.stat(path)
+        return _load_predictor(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def predict_surface(self, ages, treatment_vectors) -> np.array:
+        """Returns the predicted mortality rate of every treatment vector
+           at every age (in days) as a (treatments x ages) array"""
+        ages = np.asarray(ages, dtype=np.float32)
+        treatment_vectors = [tuple(int(treatment) for treatment in vector) for vector in treatment_vectors]
+        ages_key = hashlib.sha1(ages.tobytes()).hexdigest()
+
+        unique_vectors = list(dict.fromkeys(treatment_vectors))
+        predictions = {}
+        for vector in unique_vectors:
+            if (vector, ages_key) in self.cache:
+                self.cache.move_to_end((vector, ages_key))
+                predictions[vector] = self.cache[(vector, ages_key)]
+
+        missing = [vector for vector in unique_vectors if vector not in predictions]
+        if missing:
+            for vector, prediction in zip(missing, self._forward(ages, np.array(missing, dtype=np.float32))):
+                prediction.flags.writeable = False
+                predictions[vector] = prediction
+                self._insert((vector, ages_key), prediction)
+
+        return np.stack([predictions[vector] for vector in treatment_vectors])
+
+    def predict(self, ages, treatment) -> np.array:
+        """Predicts the mortality rate of one treatment vector at `ages` (in days)"""
+        return self.predict_surface(ages, [treatment])[0]
+
+    def predict_keys(self, ages, treatment_keys: [str]) -> dict:
+        """Predicts the mortality rates of canonical intervention keys"""
+        treatment_vectors = [create_treatment_vector(key) for key in treatment_keys]
+        surface = self.predict_surface(ages, treatment_vectors)
+        return {key: prediction for key, prediction in zip(treatment_keys, surface)}
+
+    def clear_cache(self) -> None:
+        self.cache.clear()
+
+    def _insert(self, key: tuple, prediction: np.array) -> None:
+        self.cache[key] = prediction
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cached_predictions:
+            self.cache.popitem(last=False)
+
+    def _forward(self, ages: np.array, treatment_vectors: np.array) -> np.array:
+        n_treatments, n_ages = len(treatment_vectors), len(ages)
+
+        # (treatments * ages) x (1 + treatments) grid, age major within each treatment
+        inputs = np.empty((n_treatments, n_ages, 1 + treatment_vectors.shape[1]), dtype=np.float32)
+        inputs[:, :, 0] = ages[None, :]
+        inputs[:, :, 1:] = treatment_vectors[:, None, :]
+
+        with torch.inference_mode():
+            outputs = self.model(torch.from_numpy(inputs.reshape(n_treatments * n_ages, -1)))
+        return outputs.numpy().reshape(n_treatments, n_ages)
+
+
+@lru_cache(maxsize=8)
+def _load_predictor(path: str, modified_time_ns: int, size: int) -> MortalityPredictor:
+    # keyed by the modification time and size too, so an edited model file is loaded again
+    return MortalityPredictor(load_model(path))
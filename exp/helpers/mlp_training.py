@@ -0,0 +1,286 @@
+import copy
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.optim as optim
+
+from dataclasses import dataclass
+from sklearn.model_selection import train_test_split
+from torch.func import functional_call, stack_module_state, vmap
+from typing import Optional
+
+from .mlp import HIDDEN_SIZE, INPUT_SIZE, OUTPUT_SIZE, MLPModel, create_treatment_vector
+from .worker_pool import WorkerPool
+
+# the seeds of `calculate_val_errors` in 005_MLPModel.ipynb
+DEFAULT_VALIDATION_SEEDS = list(range(10, 50, 2))
+
+
+@dataclass
+class TrainingConfig:
+    epochs: int = 10_000
+    learning_rate: float = 0.01
+    hidden_size: int = HIDDEN_SIZE
+    test_size: float = 0.2
+    patience: Optional[int] = None   # epochs without improvement of the validation loss before stopping
+    min_delta: float = 0.0
+
+
+@dataclass
+class SeedResult:
+    seed: int
+    best_val_loss: float
+    best_epoch: int
+    train_losses: np.array
+    val_losses: np.array
+    state_dict: dict
+    elapsed_seconds: float
+
+    def to_model(self) -> MLPModel:
+        """Returns the model with the lowest validation loss"""
+        hidden_size = self.state_dict['fc1.weight'].shape[0]
+        model = MLPModel(INPUT_SIZE, hidden_size, OUTPUT_SIZE)
+        model.load_state_dict(self.state_dict)
+        return model.eval()
+
+
+@dataclass
+class TrainingRun:
+    results: [SeedResult]
+    elapsed_seconds: float
+    mode: str
+
+    def validation_errors(self) -> [float]:
+        return [result.best_val_loss for result in self.results]
+
+    def summary(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'best_val_loss': [result.best_val_loss for result in self.results],
+            'best_epoch': [result.best_epoch for result in self.results],
+            'epochs': [len(result.train_losses) for result in self.results],
+            'seconds': [result.elapsed_seconds for result in self.results]
+        }, index=pd.Index([result.seed for result in self.results], name='seed'))
+
+    def wall_clock(self) -> dict:
+        seconds = np.array([result.elapsed_seconds for result in self.results])
+        epochs = np.array([len(result.train_losses) for result in self.results])
+        return {
+            'mode': self.mode,
+            'total_seconds': self.elapsed_seconds,
+            'seconds_per_seed': self.elapsed_seconds / max(len(self.results), 1),
+            'mean_seed_seconds': float(seconds.mean()) if len(seconds) else np.nan,
+            'max_seed_seconds': float(seconds.max()) if len(seconds) else np.nan,
+            'epochs_per_second': float(epochs.sum() / self.elapsed_seconds) if self.elapsed_seconds > 0 else np.nan
+        }
+
+
+def create_samples(dataset: dict) -> (np.array, np.array):
+    """Returns the (age, treatment vector) inputs and the mortality rate
+       targets of the `MortalityDataset` in 005_MLPModel.ipynb"""
+    inputs, targets = [], []
+    for treatment_key, treatment_data in dataset.items():
+        ages = np.asarray(treatment_data['x'], dtype=np.float32)
+        treatment_vector = np.array(create_treatment_vector(treatment_key), dtype=np.float32)
+
+        inputs.append(np.column_stack([ages, np.tile(treatment_vector, (len(ages), 1))]))
+        targets.append(1 - np.asarray(treatment_data['y'], dtype=np.float32))
+
+    if not inputs:
+        return np.zeros((0, INPUT_SIZE), dtype=np.float32), np.zeros((0, OUTPUT_SIZE), dtype=np.float32)
+    return np.concatenate(inputs).astype(np.float32), np.concatenate(targets)[:, None].astype(np.float32)
+
+def split_samples(n_samples: int, seed: int, test_size: float) -> (np.array, np.array):
+    """The train/validation split of `train_model`, which splits the samples with `random_state=seed`"""
+    train_indices, val_indices = train_test_split(np.arange(n_samples), test_size=test_size, random_state=seed)
+    return train_indices, val_indices
+
+
+class EarlyStopping:
+    """Tracks the best validation loss of a number of independently trained
+       models and stops each of them after `patience` epochs without an
+       improvement of more than `min_delta`"""
+
+    def __init__(self, n_models: int, patience: Optional[int] = None, min_delta: float = 0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+
+        self.best_loss = np.full(n_models, np.inf)
+        self.best_epoch = np.full(n_models, -1)
+        self.n_epochs = np.zeros(n_models, dtype=np.int64)
+        self.active = np.ones(n_models, dtype=bool)
+
+    def update(self, epoch: int, losses: np.array) -> np.array:
+        """Records the validation losses of `epoch` and returns which active models improved"""
+        improved = self.active & (losses < self.best_loss - self.min_delta)
+        self.best_loss = np.where(improved, losses, self.best_loss)
+        self.best_epoch = np.where(improved, epoch, self.best_epoch)
+        self.n_epochs[self.active] = epoch + 1
+
+        if self.patience is not None:
+            self.active &= epoch - self.best_epoch < self.patience
+        return improved
+
+
+def _initialize_model(seed: int, hidden_size: int) -> MLPModel:
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    return MLPModel(INPUT_SIZE, hidden_size, OUTPUT_SIZE)
+
+def train_seed(inputs: np.array, targets: np.array, seed: int, config: TrainingConfig = TrainingConfig()) -> SeedResult:
+    """Trains one model as `train_model(seed, epochs)` does, with full-batch
+       Adam on the `seed` split, and keeps the weights of the epoch with the
+       lowest validation loss"""
+    start_time = time.perf_counter()
+    train_indices, val_indices = split_samples(len(inputs), seed, config.test_size)
+    train_inputs, train_targets = torch.from_numpy(inputs[train_indices]), torch.from_numpy(targets[train_indices])
+    val_inputs, val_targets = torch.from_numpy(inputs[val_indices]), torch.from_numpy(targets[val_indices])
+
+    model = _initialize_model(seed, config.hidden_size)
+    criterion = torch.nn.MSELoss()
+    optimizer = optim.Adam(model.parameters(), lr=config.learning_rate)
+    stopping = EarlyStopping(1, config.patience, config.min_delta)
+
+    train_losses, val_losses = [], []
+    best_state_dict = copy.deepcopy(model.state_dict())
+    for epoch in range(config.epochs):
+        model.train()
+        loss = criterion(model(train_inputs), train_targets)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            val_loss = criterion(model(val_inputs), val_targets).item()
+
+        train_losses.append(loss.item())
+        val_losses.append(val_loss)
+
+        # the state dict references the live parameters, so the best epoch has to be copied
+        if stopping.update(epoch, np.array([val_loss]))[0]:
+            best_state_dict = copy.deepcopy(model.state_dict())
+        if not stopping.active[0]:
+            break
+
+    return SeedResult(seed=seed, best_val_loss=float(stopping.best_loss[0]), best_epoch=int(stopping.best_epoch[0]),
+                      train_losses=np.array(train_losses), val_losses=np.array(val_losses),
+                      state_dict=best_state_dict, elapsed_seconds=time.perf_counter() - start_time)
+
+
+def _create_worker_samples(inputs: np.array, targets: np.array, config: TrainingConfig, n_threads: int) -> tuple:
+    torch.set_num_threads(n_threads)
+    return inputs, targets, config
+
+def _train_worker_seed(samples: tuple, seed: int) -> SeedResult:
+    inputs, targets, config = samples
+    return train_seed(inputs, targets, seed, config)
+
+def train_seeds_parallel(inputs: np.array, targets: np.array, seeds: [int], config: TrainingConfig = TrainingConfig(),
+                         n_workers: int = None, threads_per_worker: int = 1) -> TrainingRun:
+    """Trains one model per seed in a process pool of `n_workers` processes
+       with `threads_per_worker` torch threads each. The small full-batch
+       models do not profit from intra-op threads, so one thread per worker
+       and one worker per core is usually fastest."""
+    start_time = time.perf_counter()
+    if n_workers is None:
+        n_workers = max(1, min(len(seeds), multiprocessing.cpu_count() // threads_per_worker))
+
+    if n_workers <= 1:
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(threads_per_worker)
+        try:
+            results = [train_seed(inputs, targets, seed, config) for seed in seeds]
+        finally:
+            torch.set_num_threads(previous_threads)
+    else:
+        # forking a process after torch started its thread pools can deadlock
+        with WorkerPool((inputs, targets, config, threads_per_worker), n_workers,
+                        create_state=_create_worker_samples, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(_train_worker_seed, seeds))
+
+    return TrainingRun(results=results, elapsed_seconds=time.perf_counter() - start_time, mode='parallel')
+
+
+def train_seeds_vectorized(inputs: np.array, targets: np.array, seeds: [int],
+                           config: TrainingConfig = TrainingConfig()) -> TrainingRun:
+    """Trains the models of all seeds at once as one stacked ensemble.
+
+       The weights of all seeds are stacked and the forward pass is vmapped
+       over them, so every epoch is a single batched pass. Adam is elementwise
+       and the loss is the sum of the per seed losses, so each seed follows
+       the same trajectory as when trained alone (up to float rounding).
+       Stopped seeds keep training with the others, but their curves end and
+       their best weights are frozen at the epoch they stopped."""
+    start_time = time.perf_counter()
+    seeds = list(seeds)
+
+    models = [_initialize_model(seed, config.hidden_size) for seed in seeds]
+    parameters, buffers = stack_module_state(models)
+    base_model = copy.deepcopy(models[0]).to('meta')
+
+    def forward(model_parameters, model_buffers, model_inputs):
+        return functional_call(base_model, (model_parameters, model_buffers), (model_inputs,))
+    batched_forward = vmap(forward)
+
+    splits = [split_samples(len(inputs), seed, config.test_size) for seed in seeds]
+    train_inputs = torch.from_numpy(np.stack([inputs[train_indices] for train_indices, _ in splits]))
+    train_targets = torch.from_numpy(np.stack([targets[train_indices] for train_indices, _ in splits]))
+    val_inputs = torch.from_numpy(np.stack([inputs[val_indices] for _, val_indices in splits]))
+    val_targets = torch.from_numpy(np.stack([targets[val_indices] for _, val_indices in splits]))
+
+    optimizer = optim.Adam(parameters.values(), lr=config.learning_rate)
+    stopping = EarlyStopping(len(seeds), config.patience, config.min_delta)
+
+    train_losses = np.full((config.epochs, len(seeds)), np.nan)
+    val_losses = np.full((config.epochs, len(seeds)), np.nan)
+    best_parameters = {name: parameter.detach().clone() for name, parameter in parameters.items()}
+    elapsed_seconds = np.zeros(len(seeds))
+
+    for epoch in range(config.epochs):
+        losses = ((batched_forward(parameters, buffers, train_inputs) - train_targets) ** 2).mean(dim=(1, 2))
+        optimizer.zero_grad()
+        losses.sum().backward()
+        optimizer.step()
+
+        with torch.no_grad():
+            epoch_val_losses = ((batched_forward(parameters, buffers, val_inputs) - val_targets) ** 2).mean(dim=(1, 2))
+
+        active = stopping.active.copy()
+        train_losses[epoch, active] = losses.detach().numpy()[active]
+        val_losses[epoch, active] = epoch_val_losses.numpy()[active]
+
+        improved = torch.from_numpy(stopping.update(epoch, epoch_val_losses.numpy()))
+        if improved.any():
+            for name, parameter in parameters.items():
+                best_parameters[name][improved] = parameter.detach()[improved]
+
+        elapsed_seconds[active] = time.perf_counter() - start_time
+        if not stopping.active.any():
+            break
+
+    results = []
+    for i, seed in enumerate(seeds):
+        state_dict = {name: parameter[i].clone() for name, parameter in best_parameters.items()}
+        state_dict.update({name: buffer[i].clone() for name, buffer in buffers.items()})
+        n_epochs = stopping.n_epochs[i]
+        results.append(SeedResult(seed=seed, best_val_loss=float(stopping.best_loss[i]),
+                                  best_epoch=int(stopping.best_epoch[i]),
+                                  train_losses=train_losses[:n_epochs, i], val_losses=val_losses[:n_epochs, i],
+                                  state_dict=state_dict, elapsed_seconds=float(elapsed_seconds[i])))
+
+    return TrainingRun(results=results, elapsed_seconds=time.perf_counter() - start_time, mode='vectorized')
+
+
+def calculate_validation_errors(dataset: dict, seeds: [int] = DEFAULT_VALIDATION_SEEDS,
+                                config: TrainingConfig = TrainingConfig(), vectorized: bool = True,
+                                n_workers: int = None, threads_per_worker: int = 1) -> TrainingRun:
+    """`calculate_val_errors` of 005_MLPModel.ipynb: trains one model per seed
+       (i.e. per train/validation split) on `dataset`, either as one stacked
+       ensemble or in a process pool"""
+    inputs, targets = create_samples(dataset)
+    if vectorized:
+        return train_seeds_vectorized(inputs, targets, seeds, config)
+    return train_seeds_parallel(inputs, targets, seeds, config, n_workers=n_workers,
+                                threads_per_worker=threads_per_worker)
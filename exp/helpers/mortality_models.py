@@ -0,0 +1,256 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from scipy.optimize import curve_fit
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+from .batch_gompertz import StackedDatasets, fit_batch, gompertz_warm_start, log_linear_warm_start, stack_datasets
+from .fit_cache import FitCache, compute_fit_key
+from .gompertz import DEFAULT_INITIAL_PARAMETERS, GompertzParameters, gompertz, gompertz_jacobian
+
+
+class MortalityModel(ABC):
+    """A parametric mortality curve f(x, *parameters) with its analytic
+       jacobian, which `curve_fit` and the batched fitter use instead of
+       finite differences"""
+
+    name = None
+    parameter_names = ()
+    initial_parameters = ()
+    # positive parameters that the batched fitter iterates in log space
+    log_parameter_names = ()
+
+    @staticmethod
+    @abstractmethod
+    def function(x, *parameters):
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def jacobian(x, *parameters) -> np.array:
+        """Returns the derivatives of `function` w.r.t. the parameters,
+           stacked along the last axis"""
+
+    def warm_start(self, stacked: StackedDatasets) -> np.array:
+        """Returns the (groups x parameters) starting points of the batched fit"""
+        return np.tile(np.array(self.initial_parameters, dtype=np.float64), (len(stacked.keys), 1))
+
+    @property
+    def n_parameters(self) -> int:
+        return len(self.parameter_names)
+
+    @property
+    def log_parameters(self) -> [int]:
+        return [self.parameter_names.index(name) for name in self.log_parameter_names]
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(self.parameter_names)})'
+
+
+class GompertzModel(MortalityModel):
+    """alpha * exp(beta * x), the model of `gompertz`"""
+
+    name = 'gompertz'
+    parameter_names = ('alpha', 'beta')
+    initial_parameters = DEFAULT_INITIAL_PARAMETERS.to_tuple()
+    log_parameter_names = ('alpha',)
+
+    function = staticmethod(gompertz)
+    jacobian = staticmethod(gompertz_jacobian)
+
+    def warm_start(self, stacked: StackedDatasets) -> np.array:
+        return gompertz_warm_start(stacked, GompertzParameters.from_sequence(self.initial_parameters))
+
+
+class GompertzMakehamModel(MortalityModel):
+    """alpha * exp(beta * x) + gamma, the law of 001_GompertzAssumption.ipynb"""
+
+    name = 'gompertz_makeham'
+    parameter_names = ('alpha', 'beta', 'gamma')
+    initial_parameters = (0.1, 0.085, 0.01)
+    log_parameter_names = ('alpha',)
+
+    @staticmethod
+    def function(x, alpha, beta, gamma):
+        return alpha * np.exp(beta * x) + gamma
+
+    @staticmethod
+    def jacobian(x, alpha, beta, gamma) -> np.array:
+        exponential = np.exp(beta * x)
+        return np.stack([exponential, alpha * x * exponential, np.ones_like(exponential)], axis=-1)
+
+    def warm_start(self, stacked: StackedDatasets) -> np.array:
+        gompertz_start = GompertzModel().warm_start(stacked)
+        return np.hstack([gompertz_start, np.zeros((len(stacked.keys), 1))])
+
+
+class WeibullModel(MortalityModel):
+    """alpha * x^beta"""
+
+    name = 'weibull'
+    parameter_names = ('alpha', 'beta')
+    initial_parameters = (0.1, 2.0)
+    log_parameter_names = ('alpha',)
+
+    @staticmethod
+    def function(x, alpha, beta):
+        return alpha * np.power(x, beta)
+
+    @staticmethod
+    def jacobian(x, alpha, beta) -> np.array:
+        x = np.asarray(x, dtype=np.float64)
+        power = np.power(x, beta)
+        log_x = np.log(np.where(x > 0, x, 1.0))
+        return np.stack([power, alpha * power * log_x], axis=-1)
+
+    def warm_start(self, stacked: StackedDatasets) -> np.array:
+        # log(f) = log(alpha) + beta * log(x) is the Gompertz warm start in log(x)
+        positive = stacked.mask & (stacked.ages > 0)
+        log_ages = np.log(np.where(positive, stacked.ages, 1.0))
+        log_alphas, betas = log_linear_warm_start(log_ages, stacked.mortality_rate, positive,
+                                                  GompertzParameters.from_sequence(self.initial_parameters))
+        return np.stack([np.exp(log_alphas), betas], axis=-1)
+
+
+MODELS = {}
+
+def register_model(model: MortalityModel) -> MortalityModel:
+    if model.name in MODELS:
+        raise ValueError(f'A model named {model.name} is already registered')
+    MODELS[model.name] = model
+    return model
+
+def get_model(name: str) -> MortalityModel:
+    if name not in MODELS:
+        raise KeyError(f'Unknown model {name}, use one of {list(MODELS)}')
+    return MODELS[name]
+
+register_model(GompertzModel())
+register_model(GompertzMakehamModel())
+register_model(WeibullModel())
+
+
+def _resolve_model(model) -> MortalityModel:
+    return get_model(model) if isinstance(model, str) else model
+
+def fit_mortality_model(model,
+                        ages: np.array,
+                        mortality_rate: np.array,
+                        initial_parameters: tuple = None,
+                        max_fit_iterations: int = 50_000,
+                        cache: Optional[FitCache] = None) -> np.array:
+    """Fits `model` (or the name of a registered model) with `curve_fit` and
+       its analytic jacobian, returns the parameters in `parameter_names` order.
+       If a `cache` is given, fits are looked up in and stored in it"""
+    model = _resolve_model(model)
+    p0 = tuple(model.initial_parameters if initial_parameters is None else initial_parameters)
+
+    if cache is not None:
+        key = compute_fit_key(ages, mortality_rate, p0, max_fit_iterations,
+                              method=f'curve_fit_jacobian_{model.name}')
+        cached_parameters = cache.get(key)
+        if cached_parameters is not None:
+            return np.array(cached_parameters)
+
+    predicted_parameters, covariance = curve_fit(model.function, ages, mortality_rate, p0=p0,
+                                                 jac=model.jacobian,
+                                                 maxfev=max_fit_iterations)
+    if cache is not None:
+        cache.put(key, predicted_parameters)
+    return predicted_parameters
+
+
+@dataclass
+class ModelFit:
+    """Parameters and convergence of a batched fit of one model to all groups"""
+    model: MortalityModel
+    keys: [str]
+    parameters: np.array
+    cost: np.array
+    n_points: np.array
+    converged: np.array
+    failed: np.array
+    iterations: np.array
+    elapsed_seconds: float
+
+    def __getitem__(self, key) -> tuple:
+        return tuple(self.parameters[self.keys.index(key)])
+
+    def information_criteria(self) -> (np.array, np.array):
+        """Returns the (AIC, BIC) of the least squares fits of every group"""
+        n_points = np.maximum(self.n_points, 1)
+        with np.errstate(divide='ignore'):
+            log_likelihood_term = n_points * np.log(self.cost / n_points)
+        n_parameters = self.model.n_parameters
+        return log_likelihood_term + 2 * n_parameters, log_likelihood_term + n_parameters * np.log(n_points)
+
+    def to_frame(self) -> pd.DataFrame:
+        aic, bic = self.information_criteria()
+        frame = pd.DataFrame(self.parameters, index=self.keys, columns=list(self.model.parameter_names))
+        frame['cost'] = self.cost
+        frame['aic'] = aic
+        frame['bic'] = bic
+        frame['converged'] = self.converged
+        frame['failed'] = self.failed
+        frame['iterations'] = self.iterations
+        return frame
+
+    def __str__(self) -> str:
+        return (f'{self.model.name}: {int(self.converged.sum())}/{len(self.keys)} groups converged, '
+                f'{int(self.failed.sum())} failed in {self.elapsed_seconds * 1_000:.2f}ms')
+
+
+def fit_mortality_model_batch(model,
+                              stacked: StackedDatasets,
+                              initial_parameters: np.array = None,
+                              max_fit_iterations: int = 200,
+                              tolerance: float = 1.49012e-08) -> ModelFit:
+    """Fits `model` to every group of `stacked` at once with `fit_batch`, the
+       vectorized Levenberg-Marquardt iteration on the analytic jacobian that
+       `fit_gompertz_batch` uses as well. `initial_parameters` defaults to the
+       warm start of the model."""
+    start_time = time.perf_counter()
+    model = _resolve_model(model)
+    n_groups = len(stacked.keys)
+
+    if initial_parameters is None:
+        initial_parameters = model.warm_start(stacked)
+    initial_parameters = np.broadcast_to(np.asarray(initial_parameters, dtype=np.float64),
+                                         (n_groups, model.n_parameters))
+
+    parameters, cost, converged, iterations, failed = fit_batch(model.function, model.jacobian, stacked,
+                                                                initial_parameters,
+                                                                max_fit_iterations=max_fit_iterations,
+                                                                tolerance=tolerance,
+                                                                log_parameters=model.log_parameters)
+    return ModelFit(model=model, keys=list(stacked.keys), parameters=parameters, cost=cost,
+                    n_points=stacked.mask.sum(axis=1), converged=converged, failed=failed, iterations=iterations,
+                    elapsed_seconds=time.perf_counter() - start_time)
+
+
+def compare_models(dataset: dict, models: [str] = None, max_fit_iterations: int = 200) -> pd.DataFrame:
+    """Fits every model (all registered ones by default) to all groups of
+       `dataset` with the batched fitter and returns one row per (group, model)
+       with the parameters, squared error, AIC and BIC. The best model of a
+       group has the lowest AIC."""
+    stacked = stack_datasets(dataset)
+    models = list(MODELS) if models is None else models
+
+    frames = []
+    for model in models:
+        fit = fit_mortality_model_batch(model, stacked, max_fit_iterations=max_fit_iterations)
+        frame = fit.to_frame()
+        frame['seconds'] = fit.elapsed_seconds
+        frames.append(frame)
+
+    models = [_resolve_model(model) for model in models]
+    parameter_names = list(dict.fromkeys([name for model in models for name in model.parameter_names]))
+    comparison = pd.concat(frames, keys=[model.name for model in models], names=['model', 'key'])
+    comparison = comparison[parameter_names + [column for column in frames[0].columns
+                                               if column not in parameter_names]]
+    return comparison.swaplevel().sort_index(level='key', sort_remaining=False)
@@ -1,10 +1,16 @@
 import numpy as np
 
+from collections.abc import Mapping
 from dataclasses import dataclass
-from itertools import combinations
-from typing import Any
+from typing import Any, Optional
 
+from .fit_cache import FitCache
 from .gompertz import *
+from .intervention_slopes import InterventionSlopes
+from .data import NO_INTERVENTION_DATASET_KEY, count_interventions, create_combination_keys
+from .interaction_factors import (InteractionFactors, create_combination_indices,
+                                  create_combination_indices_from_keys, create_design_matrix,
+                                  create_membership_matrix, create_subset_indices, create_subset_matrix)
 
 EPS = 1e-7
 
@@ -19,7 +25,107 @@ class MortalityRateArguments:
     one_intervention_mortality: Any
 
 
+class KeyedMortality(Mapping):
+    """Compact store of the mortality rates of many intervention combinations:
+       one read-only (combinations x ages) array with a key to row index.
+
+       It is a read-only mapping from keys to rows (views), so it can be used
+       wherever a dict of per-key arrays was used, while the bulk operations
+       (log, slopes, ranking, order slices) run on the one contiguous array."""
+
+    __slots__ = ('keys_', 'array', 'index', 'orders', '_log')
+
+    def __init__(self, keys: [str], array: np.array):
+        self.keys_ = list(keys)
+        # a read-only view, so the caller's array stays writeable
+        self.array = np.ascontiguousarray(array, dtype=np.float64).view()
+        self.array.flags.writeable = False
+        if len(self.keys_) != len(self.array):
+            raise ValueError(f'{len(self.keys_)} keys for {len(self.array)} rows')
+
+        self.index = {key: row for row, key in enumerate(self.keys_)}
+        self.orders = np.array([count_interventions(key) for key in self.keys_], dtype=np.int64)
+        self._log = None
+
+    @staticmethod
+    def from_dict(values: dict) -> 'KeyedMortality':
+        keys = list(values.keys())
+        if not keys:
+            return KeyedMortality([], np.zeros((0, 0)))
+        return KeyedMortality(keys, np.stack([np.asarray(values[key], dtype=np.float64) for key in keys]))
+
+    def __getitem__(self, key: str) -> np.array:
+        return self.array[self.index[key]]
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self) -> int:
+        return len(self.keys_)
+
+    def __contains__(self, key) -> bool:
+        return key in self.index
+
+    def __getstate__(self):
+        return self.keys_, self.array
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def log(self) -> 'KeyedMortality':
+        """The log mortality rates, computed once"""
+        if self._log is None:
+            self._log = KeyedMortality(self.keys_, np.log(self.array + EPS))
+        return self._log
+
+    def order(self, n_interventions: int) -> 'KeyedMortality':
+        """Returns the combinations of `n_interventions` interventions"""
+        rows = np.flatnonzero(self.orders == n_interventions)
+        if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+            rows = slice(rows[0], rows[-1] + 1)
+            return KeyedMortality(self.keys_[rows], self.array[rows])
+        return KeyedMortality([self.keys_[row] for row in rows], self.array[rows])
+
+    def slopes(self, ages: np.array) -> np.array:
+        """The log mortality slope of every combination (see `InterventionSlopes.calculate_slopes`)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return InterventionSlopes.calculate_slopes(ages, self.log().array)
+
+    def argmin_slope(self, ages: np.array) -> (str, float):
+        """Returns the combination with the lowest log mortality slope"""
+        slopes = self.slopes(ages)
+        row = int(np.nanargmin(slopes))
+        return self.keys_[row], float(slopes[row])
+
+    def rank(self, ages: np.array) -> [(str, float)]:
+        """Returns all combinations as (key, slope) pairs, best first"""
+        slopes = self.slopes(ages)
+        order = np.argsort(np.where(np.isnan(slopes), np.inf, slopes), kind='stable')
+        return [(self.keys_[row], float(slopes[row])) for row in order]
+
+    def to_numpy(self) -> np.array:
+        return self.array
+
+    def to_dict(self) -> dict:
+        return {key: self.array[row] for key, row in self.index.items()}
+
+    def to_frame(self, ages: np.array = None) -> pd.DataFrame:
+        return pd.DataFrame(self.array, index=pd.Index(self.keys_, name='key'), columns=ages)
+
+    def to_arrow(self):
+        """Returns a pyarrow table of the keys and the rows as fixed size lists,
+           which shares the memory of the array"""
+        import pyarrow as pa
+        n_ages = self.array.shape[1] if self.array.ndim == 2 else 0
+        rows = pa.FixedSizeListArray.from_arrays(pa.array(self.array.reshape(-1)), n_ages)
+        return pa.table({'key': pa.array(self.keys_, type=pa.string()), 'mortality_rate': rows})
+
+
 class MortalityRate:
+    """The predicted mortality rates of a `MortalityRateFactory` model: an
+       array, a dict of arrays by key, or a `KeyedMortality` for the models
+       that opt into it (`AllOrdersMortalityRate`)"""
+
     def __init__(self, values):
         self.values = values
 
@@ -27,19 +133,21 @@ class MortalityRate:
         return self.values
 
     def log(self):
+        if isinstance(self.values, KeyedMortality):
+            return self.values.log()
         if isinstance(self.values, dict):
-            return {key: np.log(value) for key, value in self.values.items()}
-        
+            return {key: np.log(value + EPS) for key, value in self.values.items()}
+
         return np.log(self.values + EPS)
 
 
 class NoInterventionMortalityRate:
-    def __init__(self, arguments: MortalityRateArguments):
-        no_intervention_ages = calculate_ages(arguments.dataset[arguments.intervention_keys])
-        no_intervention_mortality_rate = calculate_mortality_rate(arguments.dataset[arguments.intervention_keys])
+    """Mortality rate of the control group, evaluated from its already fitted
+       `arguments.parameters` instead of fitting it again"""
 
-        predicted_parameters = fit_gompertz_model(no_intervention_ages, no_intervention_mortality_rate)
-        predicted_mortality = gompertz(arguments.evaluation_ages, predicted_parameters.alpha, predicted_parameters.beta)
+    def __init__(self, arguments: MortalityRateArguments):
+        alpha, beta = arguments.parameters[arguments.intervention_keys]
+        predicted_mortality = gompertz(arguments.evaluation_ages, alpha, beta)
         self.mortality_rate = MortalityRate(predicted_mortality)
 
 
@@ -49,16 +157,16 @@ def compute_mortality_per_intervention(arguments: MortalityRateArguments):
     mortality = []
 
     for key in arguments.intervention_keys:
-        mortality_rate = calculate_mortality_rate(arguments.dataset[key].copy())
         alpha, beta = arguments.parameters[key]
         mortality.append(gompertz(arguments.evaluation_ages, alpha, beta))
     return mortality
 
 
-def compute_actual_mortalities(dataset, ages):
-    """Computes the estimated mortality rate against `ages`"""
+def compute_actual_mortalities(dataset, ages, cache: Optional[FitCache] = None):
+    """Computes the estimated mortality rate against `ages`, looking up
+       the fits in `cache` if one is given"""
 
-    parameters = Parameters(dataset.copy()).compute()
+    parameters = Parameters(dataset.copy(), cache=cache).compute()
 
     mortality = {}
     for key in parameters.keys():
@@ -79,74 +187,78 @@ class OneInterventionsMortalityRate:
         self.mortality_rate = MortalityRate(mortality_rates)
 
 
-class TwoInterventionsMortalityRate:
+class CombinationMortalityRate:
+    """Mortality rate of every combination of `order` interventions, i.e. the sum
+       of the single intervention mortality rates plus the interaction factors of
+       all pairs in the combination.
+
+       The `intervention_keys` are matched to their interventions by key if the
+       single intervention names are known, i.e. if `one_intervention_mortality`
+       is a mapping or the `interaction_factors` were created with keys.
+       Otherwise `intervention_keys[c]` must name the c-th combination in
+       lexicographic order (see `create_combination_keys`), and keys in any
+       other order raise a ValueError"""
+
+    def __init__(self, arguments: MortalityRateArguments, order: int):
+        one_interventions = getattr(arguments.interaction_factors, 'one_interventions', None)
+        one_intervention_mortality = arguments.one_intervention_mortality
+        if isinstance(one_intervention_mortality, Mapping):
+            one_interventions = list(one_intervention_mortality.keys()) if one_interventions is None \
+                else one_interventions
+            one_intervention_mortality = [one_intervention_mortality[key] for key in one_interventions]
+
+        n_interventions = len(one_intervention_mortality)
+        intervention_keys = list(arguments.intervention_keys)
+        if one_interventions is not None:
+            combination_indices = tuple(create_combination_indices_from_keys(one_interventions, intervention_keys,
+                                                                              order=order))
+        else:
+            combination_indices = tuple(create_combination_indices(n_interventions, order))
+            _check_lexicographic_keys(intervention_keys, order, n_interventions)
 
-    def __init__(self, arguments: MortalityRateArguments):
-        n_single_iterations = len(arguments.one_intervention_mortality)
+        membership = create_membership_matrix(n_interventions, combination_indices)
+        design = create_design_matrix(n_interventions, combination_indices)
+
+        one_interventions_mortality = np.asarray(one_intervention_mortality)
+        interaction_factors = np.asarray(arguments.interaction_factors.to_numpy())
+
+        single_intervention_contributions = membership @ one_interventions_mortality
+        interactions = design @ interaction_factors.T
+        mortality_rate = single_intervention_contributions + interactions
 
-        interaction_factor_index = 0
         mortality_rates = {}
-        for i in range(n_single_iterations):
-            for j in range(i + 1, n_single_iterations):
-                interaction_factor = np.array([factor[interaction_factor_index] for factor in arguments.interaction_factors.to_numpy()])
-                key = arguments.intervention_keys[interaction_factor_index]
-                single_intervention_contributions = arguments.one_intervention_mortality[i] + arguments.one_intervention_mortality[j]
-                mortality_rates[key] = single_intervention_contributions + interaction_factor
-    
-                interaction_factor_index += 1
-        
+        for combination_index in range(len(combination_indices)):
+            mortality_rates[intervention_keys[combination_index]] = mortality_rate[combination_index]
+
         self.mortality_rate = MortalityRate(mortality_rates)
 
 
-class ThreeInterventionsMortalityRate:
-    INTERVENTION_INDICES = np.array([
-                [0, 1, 3],
-                [0, 2, 4],
-                [1, 2, 5],
-                [3, 4, 5]
-    ])
+def _check_lexicographic_keys(keys: [str], order: int, n_interventions: int) -> None:
+    """Raises a ValueError unless `keys` are all combinations of `order` out of
+       `n_interventions` interventions in lexicographic order, i.e. unless the
+       positional matching of `CombinationMortalityRate` is correct"""
+    n_combinations = len(create_combination_indices(n_interventions, order))
+    if len(keys) != n_combinations:
+        raise ValueError(f'{len(keys)} keys for {n_combinations} combinations of {order} interventions')
+
+    interventions = []
+    for key in keys:
+        for intervention in key.split(','):
+            if intervention not in interventions:
+                interventions.append(intervention)
+    if len(interventions) != n_interventions or create_combination_keys(interventions, order) != keys:
+        raise ValueError(f'The keys {keys} are not in lexicographic order, pass the single intervention keys '
+                         'to `InteractionFactors` to match the combinations by key')
 
+
+class TwoInterventionsMortalityRate(CombinationMortalityRate):
     def __init__(self, arguments: MortalityRateArguments):
-        alpha_parameters, beta_parameters = compute_alpha_and_beta(arguments.dataset)
-        three_interventions_mortality = compute_mortality_per_intervention(arguments)
-        
-        interactions = self._compute_interventions_interactions(arguments.interaction_factors)
-        interventions = self._compute_single_intervention_contributions(arguments.one_intervention_mortality)
-        three_interventions_mortality = interactions + interventions
-        mortality_rate = self._compute_mortality_rate(three_interventions_mortality, arguments.intervention_keys)
-        self.mortality_rate = MortalityRate(mortality_rate)
-    
-    def _compute_interventions_interactions(self, interaction_factors):
-        interaction_factors = interaction_factors.to_numpy()
-    
-        interactions = []
-        for indices in self.INTERVENTION_INDICES:
-            interaction = sum([interaction_factors[:, index] for index in indices])
-            interactions.append(interaction)
-    
-        return np.array(interactions)
-    
-    def _compute_single_intervention_contributions(self, one_interventions_mortality):
-        intervention_matrix = np.array(one_interventions_mortality)
-    
-        three_intervention_indices = list(combinations(range(4), 3))
-    
-        single_interventions = []
-        for indices in three_intervention_indices:
-            intervention_sum = 0
-            for index in indices:
-                intervention_sum += intervention_matrix[index]
-            
-            single_interventions.append(intervention_sum)
-    
-        return np.array(single_interventions)
+        super().__init__(arguments, order=2)
 
-    def _compute_mortality_rate(self, mortality_rate, keys):
-        mortality_rates_map = {}
-        for intervention_index in range(len(mortality_rate)):
-            mortality_rates_map[keys[intervention_index]] = mortality_rate[intervention_index]
-        return mortality_rates_map
 
+class ThreeInterventionsMortalityRate(CombinationMortalityRate):
+    def __init__(self, arguments: MortalityRateArguments):
+        super().__init__(arguments, order=3)
 
 
 class AllInterventionsMortalityRate:
@@ -157,6 +269,42 @@ class AllInterventionsMortalityRate:
         self.mortality_rate = MortalityRate(mortality_rate)
 
 
+class AllOrdersMortalityRate:
+    """Mortality rate of every subset of up to `max_order` of the
+       `arguments.intervention_keys` single interventions (all orders by
+       default) in one sparse matrix product of the subset indicator matrix
+       (see `create_subset_matrix`) and the stacked
+
+           [no intervention mortality; single intervention mortality; interaction factors]
+
+       The no intervention mortality is the Gompertz fit of the control group
+       (`NO_INTERVENTION_DATASET_KEY` in `arguments.parameters`) unless given.
+       The result is a `KeyedMortality` ordered by the number of interventions,
+       where the control group has the key `NO_INTERVENTION_DATASET_KEY`"""
+
+    def __init__(self, arguments: MortalityRateArguments, max_order: int = None, no_intervention_mortality=None):
+        one_interventions = list(arguments.intervention_keys)
+        n_interventions = len(one_interventions)
+        max_order = n_interventions if max_order is None else min(max_order, n_interventions)
+        ages = np.asarray(arguments.evaluation_ages)
+
+        if no_intervention_mortality is None:
+            if NO_INTERVENTION_DATASET_KEY in arguments.parameters.keys():
+                no_intervention_mortality = gompertz(ages, *arguments.parameters[NO_INTERVENTION_DATASET_KEY])
+            else:
+                no_intervention_mortality = np.full(np.shape(ages), np.nan)
+
+        effects = np.vstack([np.asarray(no_intervention_mortality)[None, :],
+                             np.asarray(arguments.one_intervention_mortality),
+                             np.asarray(arguments.interaction_factors.to_numpy()).T])
+        mortality_rate = create_subset_matrix(n_interventions, max_order) @ effects
+
+        subset_indices = create_subset_indices(n_interventions, max_order)
+        keys = [','.join([one_interventions[index] for index in indices]) for indices in subset_indices]
+
+        self.mortality_rate = MortalityRate(KeyedMortality(keys, mortality_rate))
+
+
 class MortalityRateFactory:
     def __init__(self, n_interventions):
         self.n_interventions = n_interventions
@@ -166,14 +314,18 @@ class MortalityRateFactory:
             return NoInterventionMortalityRate(arguments)
         elif self.n_interventions == 1:
             return OneInterventionsMortalityRate(arguments)
+
+        n_single_interventions = len(arguments.one_intervention_mortality)
+        if self.n_interventions > n_single_interventions:
+            raise ValueError(f'There cannot be more than {n_single_interventions} interventions')
+        elif self.n_interventions == n_single_interventions:
+            return AllInterventionsMortalityRate(arguments)
         elif self.n_interventions == 2:
             return TwoInterventionsMortalityRate(arguments)
         elif self.n_interventions == 3:
             return ThreeInterventionsMortalityRate(arguments)
-        elif self.n_interventions == 4:
-            return AllInterventionsMortalityRate(arguments)
         else:
-            raise ValueError('There cannot be more than four interventions')
+            return CombinationMortalityRate(arguments, order=self.n_interventions)
 
 
 def compute_mortality_by_n_interventions(dataset, ages, parameters, intervention_keys):
@@ -181,10 +333,40 @@ def compute_mortality_by_n_interventions(dataset, ages, parameters, intervention
 
     mortality = []
     for key in intervention_keys:
-        mortality_rate = calculate_mortality_rate(dataset[key])
-        
         alpha, beta = parameters[key]
         
         mortality.append(gompertz(ages, alpha, beta))
     
     return mortality
+
+
+def fit_interaction_factors(dataset, parameters, one_interventions: [str], ages) -> InteractionFactors:
+    """Returns the interaction factors against `ages`, fitted to the three
+       intervention groups in `dataset`. These are matched to their
+       interventions by key, so their order in `dataset` does not matter"""
+    one_interventions = list(one_interventions)
+    three_interventions = [key for key in create_combination_keys(one_interventions, 3) if key in dataset]
+
+    one_interventions_mortality = compute_mortality_by_n_interventions(dataset, ages, parameters, one_interventions)
+    three_interventions_mortality = compute_mortality_by_n_interventions(dataset, ages, parameters,
+                                                                         three_interventions)
+    interaction_factors = InteractionFactors(one_interventions_mortality, three_interventions_mortality,
+                                             one_interventions=one_interventions,
+                                             three_interventions=three_interventions)
+    interaction_factors.calculate()
+    return interaction_factors
+
+def compute_all_orders_mortality(dataset, parameters, one_interventions: [str], ages,
+                                 interaction_factors: InteractionFactors = None) -> KeyedMortality:
+    """Returns the mortality rates of all intervention combinations against
+       `ages` (see `AllOrdersMortalityRate`), with the interaction factors of
+       `fit_interaction_factors` unless already fitted ones are given"""
+    one_interventions = list(one_interventions)
+    if interaction_factors is None:
+        interaction_factors = fit_interaction_factors(dataset, parameters, one_interventions, ages)
+
+    one_interventions_mortality = compute_mortality_by_n_interventions(dataset, ages, parameters, one_interventions)
+    arguments = MortalityRateArguments(parameters=parameters, dataset=dataset, intervention_keys=one_interventions,
+                                       interaction_factors=interaction_factors, evaluation_ages=ages,
+                                       one_intervention_mortality=one_interventions_mortality)
+    return AllOrdersMortalityRate(arguments).mortality_rate.value()
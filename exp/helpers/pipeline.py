@@ -0,0 +1,289 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from .data import (NO_INTERVENTION_DATASET_KEY, create_combination_keys, create_dataset_mapping,
+                   extract_four_intervention_keys, extract_one_intervention_keys, load_and_preprocess)
+from .gompertz import Parameters, calculate_ages
+from .interaction_factors import InteractionFactors
+from .intervention_ranking import NO_INTERVENTION_KEY
+from .intervention_slopes import InterventionSlopes
+from .mortality_rate import MortalityRateArguments, MortalityRateFactory, compute_mortality_by_n_interventions
+
+
+
+def hash_value(value: Any) -> str:
+    """Returns a content hash of an input value. Paths of existing files are
+       hashed with their size and modification time, so edited files count
+       as changed inputs"""
+    digest = hashlib.sha1()
+    _update_hash(digest, value)
+    return digest.hexdigest()
+
+def _update_hash(digest, value: Any) -> None:
+    digest.update(type(value).__name__.encode())
+    if value is None:
+        return
+    elif isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        digest.update(f'{array.dtype.str}{array.shape}'.encode())
+        digest.update(array.tobytes() if array.dtype != object else repr(array.tolist()).encode())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, dict):
+        for key in value:
+            _update_hash(digest, key)
+            _update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(str(len(value)).encode())
+        for item in value:
+            _update_hash(digest, item)
+    elif isinstance(value, str) and os.path.isfile(value):
+        stat = os.stat(value)
+        digest.update(f'{os.path.abspath(value)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    else:
+        digest.update(repr(value).encode())
+
+def _contains_strings(value: Any) -> bool:
+    if isinstance(value, str):
+        return True
+    elif isinstance(value, dict):
+        return any([_contains_strings(key) or _contains_strings(item) for key, item in value.items()])
+    elif isinstance(value, (list, tuple)):
+        return any([_contains_strings(item) for item in value])
+    return False
+
+
+@dataclass
+class Node:
+    name: str
+    function: Callable
+    dependencies: [str]
+
+    fingerprint: str = None
+    value: Any = None
+    n_computations: int = 0
+    elapsed_seconds: float = 0.0
+
+
+@dataclass
+class Input:
+    name: str
+    value: Any
+    fingerprint: str = field(init=False)
+    may_refer_to_files: bool = field(init=False)
+
+    def __post_init__(self):
+        self.fingerprint = hash_value(self.value)
+        self.may_refer_to_files = _contains_strings(self.value)
+
+    def refresh(self) -> str:
+        """Rehashes the inputs that may be file paths, since the files can be
+           edited after the input was set, and returns the fingerprint"""
+        if self.may_refer_to_files:
+            self.fingerprint = hash_value(self.value)
+        return self.fingerprint
+
+
+class Pipeline:
+    """Lazy graph of memoized stages.
+
+       Every node is computed from the values of its dependencies on first
+       access only. Its fingerprint is the hash of its name and of the
+       fingerprints of its dependencies, down to the content hashes of the
+       inputs, so a node is only recomputed when an input it (indirectly)
+       depends on changed. File path inputs are rehashed on every access,
+       so editing the file invalidates the nodes that depend on it."""
+
+    def __init__(self):
+        self.inputs = {}
+        self.nodes = {}
+
+    def add_input(self, name: str, value: Any) -> 'Pipeline':
+        self.inputs[name] = Input(name, value)
+        return self
+
+    def set_inputs(self, **values) -> 'Pipeline':
+        for name, value in values.items():
+            if name not in self.inputs:
+                raise KeyError(f'Unknown input {name}')
+            self.inputs[name] = Input(name, value)
+        return self
+
+    def add_node(self, name: str, function: Callable, dependencies: [str] = ()) -> 'Pipeline':
+        """Adds a stage `function(*dependency_values)`"""
+        for dependency in dependencies:
+            if dependency not in self.inputs and dependency not in self.nodes:
+                raise KeyError(f'Unknown dependency {dependency} of {name}')
+        self.nodes[name] = Node(name, function, list(dependencies))
+        return self
+
+    def fingerprint(self, name: str) -> str:
+        if name in self.inputs:
+            return self.inputs[name].refresh()
+
+        node = self.nodes[name]
+        digest = hashlib.sha1(name.encode())
+        for dependency in node.dependencies:
+            digest.update(self.fingerprint(dependency).encode())
+        return digest.hexdigest()
+
+    def is_up_to_date(self, name: str) -> bool:
+        if name in self.inputs:
+            return True
+        return self.nodes[name].fingerprint == self.fingerprint(name)
+
+    def get(self, name: str) -> Any:
+        if name in self.inputs:
+            return self.inputs[name].value
+
+        node = self.nodes[name]
+        fingerprint = self.fingerprint(name)
+        if node.fingerprint != fingerprint:
+            arguments = [self.get(dependency) for dependency in node.dependencies]
+
+            start_time = time.perf_counter()
+            node.value = node.function(*arguments)
+            node.elapsed_seconds = time.perf_counter() - start_time
+            node.fingerprint = fingerprint
+            node.n_computations += 1
+        return node.value
+
+    def __getitem__(self, name: str) -> Any:
+        return self.get(name)
+
+    def invalidate(self, name: str = None) -> None:
+        """Forgets the value of `name` (or of all nodes)"""
+        nodes = self.nodes.values() if name is None else [self.nodes[name]]
+        for node in nodes:
+            node.fingerprint = None
+            node.value = None
+
+    def status(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'up_to_date': [self.is_up_to_date(name) for name in self.nodes],
+            'computations': [node.n_computations for node in self.nodes.values()],
+            'last_seconds': [node.elapsed_seconds for node in self.nodes.values()],
+            'dependencies': [', '.join(node.dependencies) for node in self.nodes.values()]
+        }, index=pd.Index(list(self.nodes), name='node'))
+
+
+def _extract_keys(dataset, one_interventions: [str]) -> dict:
+    """Returns the keys of every order. The three intervention keys are the
+       observed ones in lexicographic order (as in `compute_all_orders_mortality`),
+       not in the dataset order of `extract_three_intervention_keys`"""
+    three_interventions = [key for key in create_combination_keys(one_interventions, 3) if key in dataset]
+    keys = {0: NO_INTERVENTION_DATASET_KEY, 1: one_interventions, 2: create_combination_keys(one_interventions, 2),
+            3: three_interventions}
+    keys[len(one_interventions)] = extract_four_intervention_keys(dataset)
+    return keys
+
+def _compute_evaluation_ages(evaluation_ages, dataset, keys: dict) -> np.array:
+    if evaluation_ages is None:
+        return calculate_ages(dataset[keys[max(keys)]])
+    return np.asarray(evaluation_ages)
+
+def _compute_interaction_factors(one_intervention_mortality, three_intervention_mortality,
+                                 keys: dict) -> InteractionFactors:
+    interaction_factors = InteractionFactors(one_intervention_mortality, three_intervention_mortality,
+                                             one_interventions=keys[1], three_interventions=keys[3])
+    interaction_factors.calculate()
+    return interaction_factors
+
+def _compute_slopes(evaluation_ages, keys: dict, *mortality_rates) -> InterventionSlopes:
+    """Returns the log mortality slopes of every order, with the definition of
+       `InterventionSlopes.calculate_slopes` that all other rankings use. The
+       orders with a single curve (no and all interventions) are stored under
+       their key in `keys`"""
+    slopes = InterventionSlopes()
+    for n_interventions, mortality_rate in enumerate(mortality_rates):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_mortality = mortality_rate.mortality_rate.log()
+        if n_interventions == 0:
+            slopes.slopes[NO_INTERVENTION_KEY] = InterventionSlopes.calculate_slopes(evaluation_ages, log_mortality)
+        elif isinstance(log_mortality, Mapping):
+            order_slopes = InterventionSlopes.calculate_slopes(evaluation_ages, np.array(list(log_mortality.values())))
+            slopes.slopes.update(zip(log_mortality.keys(), order_slopes))
+        else:
+            slopes.slopes[keys[n_interventions]] = InterventionSlopes.calculate_slopes(evaluation_ages, log_mortality)
+    return slopes
+
+
+class SecondOrderPipeline(Pipeline):
+    """The second-order model of 004_SecondOrderModel.ipynb as a lazy pipeline:
+
+           dataset_path -> raw_dataset -> one_interventions, dataset -> keys
+           dataset -> parameters
+           evaluation_ages (input, None = ages of the all interventions group) -> ages
+           parameters, ages -> one/three_intervention_mortality -> interaction_factors
+           ... -> mortality_rate_<n> for n = 0..n_interventions -> slopes
+
+       Changing the `evaluation_ages` input therefore reevaluates the Gompertz
+       curves and everything after them, but not the fits, e.g.
+
+           pipeline = SecondOrderPipeline(DATASET_DIRECTORY)
+           slopes = pipeline['slopes']
+           pipeline.set_inputs(evaluation_ages=np.linspace(1.6, 2.4, 100))
+           slopes = pipeline['slopes']"""
+
+    def __init__(self, dataset_path: str, evaluation_ages: np.array = None, n_interventions: int = 4):
+        super().__init__()
+        self.n_interventions = n_interventions
+
+        self.add_input('dataset_path', dataset_path)
+        self.add_input('evaluation_ages', evaluation_ages)
+
+        self.add_node('raw_dataset', load_and_preprocess, ['dataset_path'])
+        self.add_node('one_interventions', extract_one_intervention_keys, ['raw_dataset'])
+        self.add_node('dataset', create_dataset_mapping, ['raw_dataset', 'one_interventions'])
+        self.add_node('keys', _extract_keys, ['dataset', 'one_interventions'])
+        self.add_node('parameters', lambda dataset: Parameters(dataset).compute(), ['dataset'])
+        self.add_node('ages', _compute_evaluation_ages, ['evaluation_ages', 'dataset', 'keys'])
+
+        self.add_node('one_intervention_mortality',
+                      lambda dataset, ages, parameters, keys: compute_mortality_by_n_interventions(
+                          dataset, ages, parameters, keys[1]),
+                      ['dataset', 'ages', 'parameters', 'keys'])
+        self.add_node('three_intervention_mortality',
+                      lambda dataset, ages, parameters, keys: compute_mortality_by_n_interventions(
+                          dataset, ages, parameters, keys[3]),
+                      ['dataset', 'ages', 'parameters', 'keys'])
+        self.add_node('interaction_factors', _compute_interaction_factors,
+                      ['one_intervention_mortality', 'three_intervention_mortality', 'keys'])
+
+        for order in range(n_interventions + 1):
+            dependencies = ['parameters', 'dataset', 'keys', 'ages']
+            if order >= 2:
+                dependencies += ['interaction_factors', 'one_intervention_mortality']
+            self.add_node(self.mortality_rate_node(order), self._create_mortality_rate_stage(order), dependencies)
+
+        self.add_node('slopes', _compute_slopes,
+                      ['ages', 'keys'] + [self.mortality_rate_node(order) for order in range(n_interventions + 1)])
+
+    @staticmethod
+    def mortality_rate_node(n_interventions: int) -> str:
+        return f'mortality_rate_{n_interventions}'
+
+    def mortality_rate(self, n_interventions: int):
+        return self.get(self.mortality_rate_node(n_interventions))
+
+    @staticmethod
+    def _create_mortality_rate_stage(n_interventions: int) -> Callable:
+        def compute_mortality_rate(parameters, dataset, keys, ages, interaction_factors=None,
+                                   one_intervention_mortality=None):
+            intervention_keys = keys[n_interventions] if n_interventions in keys \
+                else create_combination_keys(keys[1], n_interventions)
+            arguments = MortalityRateArguments(parameters=parameters, dataset=dataset,
+                                               intervention_keys=intervention_keys,
+                                               interaction_factors=interaction_factors, evaluation_ages=ages,
+                                               one_intervention_mortality=one_intervention_mortality)
+            return MortalityRateFactory(n_interventions).create(arguments)
+        return compute_mortality_rate
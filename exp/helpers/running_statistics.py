@@ -0,0 +1,113 @@
+import numpy as np
+
+
+class RunningMoments:
+    """Streaming mean and variance (Welford) of a vector of statistics"""
+
+    def __init__(self, n_statistics: int):
+        self.count = np.zeros(n_statistics)
+        self.mean = np.zeros(n_statistics)
+        self.m2 = np.zeros(n_statistics)
+
+    def update(self, values: np.array) -> None:
+        valid = np.isfinite(values)
+        values = np.where(valid, values, 0.0)
+
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0.0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += delta * np.where(valid, values - self.mean, 0.0)
+
+    def variance(self) -> np.array:
+        return np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), np.nan)
+
+
+class RunningQuantile:
+    """Streaming estimate of the `quantile` of each of a vector of statistics
+       with the P-square algorithm (Jain & Chlamtac, 1985), which keeps five
+       markers per statistic instead of every observation. Non-finite values
+       are ignored."""
+
+    N_MARKERS = 5
+
+    def __init__(self, n_statistics: int, quantile: float):
+        self.quantile = quantile
+
+        self.heights = np.zeros((n_statistics, self.N_MARKERS))
+        self.positions = np.tile(np.arange(1.0, self.N_MARKERS + 1), (n_statistics, 1))
+        self.desired_positions = np.tile([1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5],
+                                         (n_statistics, 1)).astype(np.float64)
+        self.increments = np.array([0, quantile / 2, quantile, (1 + quantile) / 2, 1])
+
+        self.count = np.zeros(n_statistics, dtype=np.int64)
+
+    def update(self, values: np.array) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values)
+
+        # the first five observations of each statistic initialize its markers
+        initializing = valid & (self.count < self.N_MARKERS)
+        if initializing.any():
+            rows = np.flatnonzero(initializing)
+            self.heights[rows, self.count[rows]] = values[rows]
+            self.count[rows] += 1
+            completed = rows[self.count[rows] == self.N_MARKERS]
+            self.heights[completed] = np.sort(self.heights[completed], axis=1)
+
+        updating = valid & ~initializing & (self.count >= self.N_MARKERS)
+        if updating.any():
+            self._update_markers(np.flatnonzero(updating), values)
+
+    def _update_markers(self, rows: np.array, values: np.array) -> None:
+        heights = self.heights[rows]
+        positions = self.positions[rows]
+        desired_positions = self.desired_positions[rows]
+        x = values[rows]
+
+        heights[:, 0] = np.minimum(heights[:, 0], x)
+        heights[:, -1] = np.maximum(heights[:, -1], x)
+
+        # cell k such that heights[k] <= x < heights[k + 1]
+        cell = np.clip((heights[:, 1:-1] <= x[:, None]).sum(axis=1), 0, self.N_MARKERS - 2)
+        positions += np.arange(self.N_MARKERS)[None, :] > cell[:, None]
+        desired_positions += self.increments
+
+        for i in range(1, self.N_MARKERS - 1):
+            difference = desired_positions[:, i] - positions[:, i]
+            move_up = (difference >= 1) & (positions[:, i + 1] - positions[:, i] > 1)
+            move_down = (difference <= -1) & (positions[:, i - 1] - positions[:, i] < -1)
+            moving = move_up | move_down
+            if not moving.any():
+                continue
+
+            direction = np.where(move_up, 1.0, -1.0)
+            previous_height, height, next_height = heights[:, i - 1], heights[:, i], heights[:, i + 1]
+            previous_position, position, next_position = positions[:, i - 1], positions[:, i], positions[:, i + 1]
+
+            parabolic = height + direction / (next_position - previous_position) * (
+                (position - previous_position + direction) * (next_height - height) / (next_position - position) +
+                (next_position - position - direction) * (height - previous_height) / (position - previous_position))
+
+            neighbour_height = np.where(move_up, next_height, previous_height)
+            neighbour_position = np.where(move_up, next_position, previous_position)
+            linear = height + direction * (neighbour_height - height) / (neighbour_position - position)
+
+            use_parabolic = (previous_height < parabolic) & (parabolic < next_height)
+            new_height = np.where(use_parabolic, parabolic, linear)
+
+            heights[:, i] = np.where(moving, new_height, height)
+            positions[:, i] = np.where(moving, position + direction, position)
+
+        self.heights[rows] = heights
+        self.positions[rows] = positions
+        self.desired_positions[rows] = desired_positions
+        self.count[rows] += 1
+
+    def value(self) -> np.array:
+        estimate = self.heights[:, 2].copy()
+
+        # fall back to the exact quantile while there are less than five observations
+        for row in np.flatnonzero(self.count < self.N_MARKERS):
+            observations = self.heights[row, :self.count[row]]
+            estimate[row] = np.quantile(observations, self.quantile) if len(observations) > 0 else np.nan
+        return estimate
@@ -0,0 +1,141 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataclasses import dataclass
+
+from .batch_gompertz import fit_gompertz_batch, stack_datasets
+from .data import SEX_COLUMN, count_interventions, create_dataset_mapping, extract_four_intervention_keys, \
+                  extract_one_intervention_keys, load_and_preprocess
+from .gompertz import Parameters, calculate_ages, calculate_mortality_rate, fit_gompertz_model
+from .interaction_factors import InteractionFactors
+from .intervention_slopes import InterventionSlopes
+from .mortality_rate import KeyedMortality, compute_all_orders_mortality, fit_interaction_factors
+
+COHORT_COLUMN = 'cohort'
+SITE_COLUMN = 'site'
+STRATUM_COLUMNS = (SEX_COLUMN, COHORT_COLUMN, SITE_COLUMN)
+
+FINAL_DATASET_DIRECTORY = os.path.join('..', 'dat', 'final_datasets')
+FINAL_DATASET_FILES = ('female_final.csv', 'male_final.csv')
+
+
+def load_combined_dataset(paths: [str] = None) -> pd.DataFrame:
+    """Loads and concatenates the (sex specific) final datasets into one frame"""
+    if paths is None:
+        paths = [os.path.join(FINAL_DATASET_DIRECTORY, file_name) for file_name in FINAL_DATASET_FILES]
+    return pd.concat([load_and_preprocess(path) for path in paths], ignore_index=True)
+
+
+@dataclass
+class Stratum:
+    """The grouped data of one (sex, cohort, site) stratum"""
+    key: tuple
+    one_interventions: [str]
+    dataset: object
+    parameters: Parameters = None
+    evaluation_ages: np.array = None
+    interaction_factors: InteractionFactors = None
+    mortality_rate: KeyedMortality = None
+
+
+class StratifiedAnalysis:
+    """Runs the second-order model for every stratum of a combined frame at once.
+
+       The rows are split by the `STRATUM_COLUMNS` present in the frame (e.g.
+       sex for the final datasets), so every group is identified by the
+       hierarchical key (sex, cohort, site, category). The Gompertz curves of
+       the groups of all strata are fitted together in one vectorized batch,
+       after which the interaction model and the slope ranking run per
+       stratum. `run` returns one tidy table of all strata, e.g.
+
+           analysis = StratifiedAnalysis(load_combined_dataset())
+           results = analysis.run()
+           results[results['rank'] == 1]"""
+
+    def __init__(self, combined: pd.DataFrame, stratum_columns: [str] = None, evaluation_ages: np.array = None,
+                 max_fit_iterations: int = 200):
+        if stratum_columns is None:
+            stratum_columns = [column for column in STRATUM_COLUMNS if column in combined.columns]
+
+        self.combined = combined
+        self.stratum_columns = list(stratum_columns)
+        self.evaluation_ages = evaluation_ages
+        self.max_fit_iterations = max_fit_iterations
+
+        self.strata = self._create_strata()
+        self.report = None
+
+    def _create_strata(self) -> {tuple: Stratum}:
+        strata = {}
+        if not self.stratum_columns:
+            groups = [((), self.combined)]
+        else:
+            groups = self.combined.groupby(self.stratum_columns, sort=False, dropna=False)
+
+        for key, rows in groups:
+            key = key if isinstance(key, tuple) else (key,)
+            one_interventions = extract_one_intervention_keys(rows)
+            strata[key] = Stratum(key=key, one_interventions=one_interventions,
+                                  dataset=create_dataset_mapping(rows, one_interventions))
+        return strata
+
+    def fit(self) -> 'StratifiedAnalysis':
+        """Fits all groups of all strata in one batch. The groups the batch
+           did not converge on are refitted with `curve_fit`, as in `CrossValidation`"""
+        stacked = stack_datasets({(stratum_key, key): stratum.dataset[key]
+                                  for stratum_key, stratum in self.strata.items() for key in stratum.dataset})
+        fitted, self.report = fit_gompertz_batch(stacked, max_fit_iterations=self.max_fit_iterations)
+        for row in np.flatnonzero(~self.report.converged):
+            stratum_key, key = self.report.keys[row]
+            group = self.strata[stratum_key].dataset[key]
+            fitted[(stratum_key, key)] = fit_gompertz_model(calculate_ages(group), calculate_mortality_rate(group))
+
+        for stratum_key, stratum in self.strata.items():
+            stratum.parameters = Parameters.from_dict(stratum.dataset, {
+                key: fitted[(stratum_key, key)].to_tuple() for key in stratum.dataset})
+        return self
+
+    def evaluation_ages_of(self, stratum: Stratum) -> np.array:
+        """The given evaluation ages, or the ages of the all interventions group of the stratum"""
+        if self.evaluation_ages is not None:
+            return np.asarray(self.evaluation_ages)
+        return calculate_ages(stratum.dataset[extract_four_intervention_keys(stratum.dataset)])
+
+    def run(self) -> pd.DataFrame:
+        """Returns one row per stratum and intervention combination with the
+           Gompertz parameters of the observed groups, the log mortality slope
+           (see `InterventionSlopes.calculate_slopes`) and the rank of the slope in the stratum"""
+        start_time = time.perf_counter()
+        if any([stratum.parameters is None for stratum in self.strata.values()]):
+            self.fit()
+
+        frames = []
+        for stratum_key, stratum in self.strata.items():
+            ages = self.evaluation_ages_of(stratum)
+            interaction_factors = fit_interaction_factors(stratum.dataset, stratum.parameters,
+                                                          stratum.one_interventions, ages)
+            mortality = compute_all_orders_mortality(stratum.dataset, stratum.parameters, stratum.one_interventions,
+                                                     ages, interaction_factors=interaction_factors)
+            stratum.evaluation_ages, stratum.interaction_factors, stratum.mortality_rate = \
+                ages, interaction_factors, mortality
+            with np.errstate(invalid='ignore', divide='ignore'):
+                slopes = InterventionSlopes.calculate_slopes(ages, mortality.log().to_numpy())
+
+            keys = list(mortality.keys())
+            frame = pd.DataFrame({column: value for column, value in zip(self.stratum_columns, stratum_key)},
+                                 index=range(len(keys)))
+            frame['key'] = keys
+            frame['n_interventions'] = [count_interventions(key) for key in keys]
+            frame['observed'] = [key in stratum.dataset for key in keys]
+            frame['alpha'] = [stratum.parameters.alphas.get(key, np.nan) for key in keys]
+            frame['beta'] = [stratum.parameters.betas.get(key, np.nan) for key in keys]
+            frame['slope'] = slopes
+            frame['rank'] = frame['slope'].rank(method='min').astype('Int64')
+            frames.append(frame)
+
+        results = pd.concat(frames, ignore_index=True)
+        results.attrs['elapsed_seconds'] = time.perf_counter() - start_time
+        return results
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+_worker_state = None
+
+def _initialize_worker(state, create_state) -> None:
+    global _worker_state
+    _worker_state = state if create_state is None else create_state(*state)
+
+def _call_worker(function, *arguments):
+    return function(_worker_state, *arguments)
+
+
+class WorkerPool:
+    """Maps functions over a process pool whose workers each hold one copy of
+       a shared `state`, e.g. the dataset, which is sent once per worker
+       instead of once per task. Mapped functions are called as
+       `function(state, *items)` and must be defined at module level.
+
+       With `create_state`, every worker builds its state as
+       `create_state(*state)` instead, e.g. a renderer. For `n_workers` <= 1
+       the functions run in this process without a pool, and a created state
+       with a `close` method is closed at the end of the `with` block.
+       `map` keeps the order of the items, like `executor.map`."""
+
+    def __init__(self, state=None, n_workers: int = 1, create_state=None, mp_context=None,
+                 max_tasks_per_child: int = None):
+        self.state = state
+        self.n_workers = n_workers
+        self.create_state = create_state
+        self.mp_context = mp_context
+        self.max_tasks_per_child = max_tasks_per_child
+
+        self.executor = None
+        self.local_state = None
+
+    def __enter__(self) -> 'WorkerPool':
+        if self.n_workers <= 1:
+            self.local_state = self.state if self.create_state is None else self.create_state(*self.state)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=self.mp_context,
+                                                initializer=_initialize_worker,
+                                                initargs=(self.state, self.create_state),
+                                                max_tasks_per_child=self.max_tasks_per_child)
+        return self
+
+    def __exit__(self, *exception) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        elif self.create_state is not None and hasattr(self.local_state, 'close'):
+            self.local_state.close()
+        self.local_state = None
+
+    def map(self, function, *iterables, chunk_size: int = 1, with_state: bool = True):
+        """Returns an iterator over `function(state, *items)` (or `function(*items)`
+           without `with_state`) for the items of `iterables`"""
+        if self.executor is None:
+            return map(partial(function, self.local_state) if with_state else function, *iterables)
+        return self.executor.map(partial(_call_worker, function) if with_state else function, *iterables,
+                                 chunksize=chunk_size)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+EXP_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FINAL_DATASET_DIRECTORY = os.path.join(EXP_DIRECTORY, '..', 'dat', 'final_datasets')
+
+# the helpers are a namespace package next to the notebooks
+if EXP_DIRECTORY not in sys.path:
+    sys.path.insert(0, EXP_DIRECTORY)
+
+
+@pytest.fixture(scope='session')
+def female_dataset_path() -> str:
+    return os.path.join(FINAL_DATASET_DIRECTORY, 'female_final.csv')
+
+@pytest.fixture(scope='session')
+def male_dataset_path() -> str:
+    return os.path.join(FINAL_DATASET_DIRECTORY, 'male_final.csv')
+
+@pytest.fixture(scope='session')
+def female_raw_dataset(female_dataset_path):
+    from helpers.data import load_and_preprocess
+    return load_and_preprocess(female_dataset_path)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from helpers.artifacts import ArtifactStore, compute_dataset_hash
+from helpers.pipeline import SecondOrderPipeline
+
+
+@pytest.fixture
+def store(tmp_path) -> ArtifactStore:
+    return ArtifactStore(str(tmp_path))
+
+@pytest.fixture(scope='module')
+def pipeline(female_dataset_path):
+    return SecondOrderPipeline(female_dataset_path)
+
+
+def test_arrays_round_trip(store):
+    arrays = {'matrix': np.arange(12.0).reshape(3, 4), 'labels': np.array([3, 1, 2], dtype=np.int32)}
+    key = store.save('example', 'hash', arrays, keys={'matrix': ['a', 'b', 'c']}, metadata={'seed': 42},
+                     code_version='v1')
+
+    for mmap in (True, False):
+        artifact = store.load(key, mmap=mmap)
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(artifact.arrays[name], array)
+            assert artifact.arrays[name].dtype == array.dtype
+        assert artifact.manifest['keys'] == {'matrix': ['a', 'b', 'c']}
+        assert artifact.metadata == {'seed': 42}
+
+def test_artifacts_are_keyed_by_data_and_code(store):
+    key = store.save('example', 'hash', {'values': np.zeros(2)}, code_version='v1')
+    assert store.find('example', 'hash', code_version='v1').key == key
+    assert store.find('example', 'other hash', code_version='v1') is None
+    assert store.find('example', 'hash', code_version='v2') is None
+
+    # existing artifacts are kept unless overwritten
+    store.save('example', 'hash', {'values': np.ones(2)}, code_version='v1')
+    np.testing.assert_array_equal(store.load(key).arrays['values'], np.zeros(2))
+    store.save('example', 'hash', {'values': np.ones(2)}, code_version='v1', overwrite=True)
+    np.testing.assert_array_equal(store.load(key).arrays['values'], np.ones(2))
+
+def test_pipeline_results_round_trip(store, pipeline):
+    key = store.save_pipeline(pipeline)
+    artifact = store.find('second_order', compute_dataset_hash(pipeline['dataset_path']))
+    assert artifact.key == key
+
+    parameters = artifact.parameters()
+    assert list(parameters) == list(pipeline['parameters'].keys())
+    for parameter_key, value in parameters.items():
+        assert value.to_tuple() == tuple(pipeline['parameters'][parameter_key])
+
+    np.testing.assert_array_equal(artifact.interaction_factors(), pipeline['interaction_factors'].to_numpy())
+    np.testing.assert_array_equal(artifact.evaluation_ages(), pipeline['ages'])
+
+    mortality_rate = artifact.mortality_rate()
+    for order in range(1, pipeline.n_interventions):
+        for mortality_key, values in pipeline.mortality_rate(order).mortality_rate.value().items():
+            np.testing.assert_array_equal(mortality_rate[mortality_key], values)
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from helpers.batch_gompertz import StackedDatasets, fit_batch, fit_gompertz_batch, stack_datasets
+from helpers.data import create_dataset_mapping, extract_one_intervention_keys
+from helpers.gompertz import calculate_ages, calculate_mortality_rate, fit_gompertz_model, gompertz, \
+                             gompertz_jacobian
+from helpers.mortality_models import MODELS, MortalityModel, fit_mortality_model, fit_mortality_model_batch
+
+
+@pytest.fixture(scope='module')
+def dataset(female_raw_dataset):
+    return create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset))
+
+@pytest.fixture(scope='module')
+def stacked(dataset):
+    return stack_datasets(dataset)
+
+
+def test_batch_fit_matches_curve_fit(dataset, stacked):
+    parameters, report = fit_gompertz_batch(stacked)
+    assert report.converged.all()
+    assert not report.failed.any()
+
+    for key in dataset:
+        expected = fit_gompertz_model(calculate_ages(dataset[key]), calculate_mortality_rate(dataset[key]))
+        np.testing.assert_allclose(parameters[key].to_tuple(), expected.to_tuple(), rtol=2e-4)
+
+def test_batch_fit_does_not_depend_on_the_other_groups(dataset, stacked):
+    parameters, _ = fit_gompertz_batch(stacked)
+    for key in list(dataset)[:3]:
+        alone, _ = fit_gompertz_batch(stack_datasets({key: dataset[key]}))
+        np.testing.assert_allclose(alone[key].to_tuple(), parameters[key].to_tuple(), rtol=1e-10)
+
+def test_padding_is_ignored():
+    ages = np.linspace(1.6, 2.4, 20)
+    mortality_rate = gompertz(ages, 0.002, 2.5)
+    padded = StackedDatasets(keys=['a', 'b'], ages=np.vstack([ages, np.where(ages < 2, ages, 0.0)]),
+                             mortality_rate=np.vstack([mortality_rate, np.where(ages < 2, mortality_rate, 0.0)]),
+                             mask=np.vstack([np.ones(len(ages), dtype=bool), ages < 2]))
+    parameters, report = fit_gompertz_batch(padded)
+    assert report.converged.all()
+    for key in padded.keys:
+        np.testing.assert_allclose(parameters[key].to_tuple(), (0.002, 2.5), rtol=1e-6)
+
+
+def stack_one_group(ages: np.array, mortality_rate: np.array) -> StackedDatasets:
+    return StackedDatasets(keys=['group'], ages=np.array([ages], dtype=np.float64),
+                           mortality_rate=np.array([mortality_rate], dtype=np.float64),
+                           mask=np.ones((1, len(ages)), dtype=bool))
+
+def test_groups_with_one_age_fail():
+    _, report = fit_gompertz_batch(stack_one_group(np.full(10, 2.0), np.linspace(0.01, 0.3, 10)))
+    assert not report.converged[0]
+    assert report.failed[0]
+    assert report.iterations[0] == 0
+
+def test_groups_without_mortality_fail():
+    _, report = fit_gompertz_batch(stack_one_group(np.linspace(1.6, 2.4, 10), np.zeros(10)))
+    assert not report.converged[0]
+    assert report.failed[0]
+    assert report.iterations[0] == 0
+
+def test_singular_normal_equations_fail():
+    ages = np.linspace(1.6, 2.4, 10)
+
+    # the curve does not depend on its second parameter
+    def function(x, a, b):
+        return a * np.exp(x)
+
+    def jacobian(x, a, b):
+        return np.stack([np.exp(x), np.zeros_like(x * b)], axis=-1)
+
+    _, _, converged, iterations, failed = fit_batch(function, jacobian, stack_one_group(ages, 0.01 * np.exp(ages)),
+                                                    np.array([[0.02, 1.0]]))
+    assert not converged[0]
+    assert failed[0]
+    assert iterations[0] == 1
+
+def test_failed_groups_do_not_affect_the_others(dataset):
+    key = next(iter(dataset))
+    ages, mortality_rate = calculate_ages(dataset[key]), calculate_mortality_rate(dataset[key])
+    stacked = StackedDatasets(keys=[key, 'degenerate'], ages=np.vstack([ages, np.full(len(ages), 2.0)]),
+                              mortality_rate=np.vstack([mortality_rate, np.zeros(len(ages))]),
+                              mask=np.ones((2, len(ages)), dtype=bool))
+    parameters, report = fit_gompertz_batch(stacked)
+    alone, _ = fit_gompertz_batch(stack_datasets({key: dataset[key]}))
+    assert report.converged.tolist() == [True, False]
+    assert report.failed.tolist() == [False, True]
+    np.testing.assert_allclose(parameters[key].to_tuple(), alone[key].to_tuple(), rtol=1e-10)
+
+
+@pytest.mark.parametrize('name', list(MODELS))
+def test_analytic_jacobians_match_finite_differences(name):
+    model = MODELS[name]
+    ages = np.linspace(1.6, 2.4, 7)
+    parameters = np.array(model.initial_parameters, dtype=np.float64) + 0.01
+
+    step = 1e-7
+    expected = np.stack([(model.function(ages, *(parameters + step * unit))
+                          - model.function(ages, *(parameters - step * unit))) / (2 * step)
+                         for unit in np.eye(len(parameters))], axis=-1)
+    np.testing.assert_allclose(model.jacobian(ages, *parameters), expected, rtol=1e-5, atol=1e-10)
+
+def test_gompertz_model_shares_the_gompertz_curve():
+    ages = np.linspace(1.6, 2.4, 7)
+    np.testing.assert_array_equal(MODELS['gompertz'].jacobian(ages, 0.002, 2.5), gompertz_jacobian(ages, 0.002, 2.5))
+
+def test_model_batch_fit_matches_curve_fit(dataset, stacked):
+    fit = fit_mortality_model_batch('gompertz', stacked)
+    assert fit.converged.all()
+    for row, key in enumerate(fit.keys):
+        expected = fit_mortality_model('gompertz', calculate_ages(dataset[key]), calculate_mortality_rate(dataset[key]))
+        np.testing.assert_allclose(fit.parameters[row], expected, rtol=2e-4)
+
+def test_models_must_implement_the_curve():
+    class Incomplete(MortalityModel):
+        parameter_names = ('alpha',)
+
+    with pytest.raises(TypeError):
+        Incomplete()
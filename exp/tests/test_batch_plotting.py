@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from helpers.batch_plotting import SUPPORTED_FORMATS, FigureRenderer, create_render_job, render_batch
+from helpers.data import NO_INTERVENTION_DATASET_KEY
+from helpers.mortality_rate import compute_all_orders_mortality
+from helpers.pipeline import SecondOrderPipeline
+
+
+@pytest.fixture(scope='module')
+def pipeline(female_dataset_path):
+    return SecondOrderPipeline(female_dataset_path)
+
+@pytest.fixture(scope='module')
+def log_mortality(pipeline):
+    return compute_all_orders_mortality(pipeline['dataset'], pipeline['parameters'], pipeline['one_interventions'],
+                                        pipeline['ages']).log()
+
+@pytest.fixture(scope='module')
+def jobs(pipeline, log_mortality) -> list:
+    """One job per order, as `cli.run_plots` creates them"""
+    one_interventions = pipeline['one_interventions']
+    four_interventions_key = next(iter(log_mortality.order(len(one_interventions))))
+    orders = [
+        (log_mortality[NO_INTERVENTION_DATASET_KEY], NO_INTERVENTION_DATASET_KEY),
+        (log_mortality.order(1), one_interventions),
+        (log_mortality.order(2), one_interventions),
+        (log_mortality.order(3).to_dict(), list(log_mortality.order(3).keys())),
+        (log_mortality[four_interventions_key], four_interventions_key)
+    ]
+    return [create_render_job(f'order-{n_interventions}', n_interventions, pipeline['dataset'], pipeline['ages'],
+                              values, keys)
+            for n_interventions, (values, keys) in enumerate(orders)]
+
+def assert_written(paths: [[str]], jobs: list, directory, formats: [str]) -> None:
+    assert len(paths) == len(jobs)
+    for job, job_paths in zip(jobs, paths):
+        assert job_paths == [os.path.join(str(directory), f'{job.name}.{file_format}') for file_format in formats]
+        for path in job_paths:
+            assert os.path.getsize(path) > 0
+
+
+def test_every_order_renders_in_every_format(tmp_path, jobs):
+    paths = render_batch(jobs, str(tmp_path), formats=SUPPORTED_FORMATS)
+    assert_written(paths, jobs, tmp_path, SUPPORTED_FORMATS)
+
+def test_workers_render_every_job(tmp_path, jobs):
+    paths = render_batch(jobs, str(tmp_path), n_workers=2, chunk_size=2)
+    assert_written(paths, jobs, tmp_path, ['png'])
+
+def test_reused_layouts_hide_stale_panels_and_lines(tmp_path, pipeline, log_mortality):
+    three_interventions = log_mortality.order(3).to_dict()
+    two_interventions = log_mortality.order(2).to_dict()
+    fewer_three_interventions = dict(list(three_interventions.items())[:3])
+    fewer_two_interventions = dict(list(two_interventions.items())[:2])
+
+    with FigureRenderer() as renderer:
+        for name, n_interventions, values in [('all-3', 3, three_interventions), ('fewer-3', 3, fewer_three_interventions),
+                                              ('all-2', 2, two_interventions), ('fewer-2', 2, fewer_two_interventions)]:
+            job = create_render_job(name, n_interventions, pipeline['dataset'], pipeline['ages'], values)
+            renderer.render(job, str(tmp_path))
+
+        # four and three panels both take two rows, so the second job reused the layout of the first
+        _, panels = renderer.layouts[('panels', 2)]
+        assert [panel.axis.get_visible() for panel in panels] == [True, True, True, False]
+        assert [panel.axis.get_ylabel() for panel in panels[:3]] == ['Mortality Rate'] * 3
+
+        _, (panel,) = renderer.layouts['lines']
+        visible_lines = [line for line in panel.axis.get_lines() if line.get_visible()]
+        assert [line.get_label() for line in visible_lines] == list(fewer_two_interventions)
+        assert [text.get_text() for text in panel.axis.get_legend().get_texts()] == list(fewer_two_interventions)
@@ -0,0 +1,54 @@
+import copy
+
+import numpy as np
+import pytest
+
+from helpers import benchmarks
+from helpers.benchmarks import BenchmarkScale, compare_results, load_results, run_benchmarks, save_results
+
+BENCHMARK_NAMES = ['load_and_preprocess', 'create_dataset_mapping', 'Parameters.compute',
+                   'InteractionFactors.calculate', 'MortalityRateFactory(0)', 'MortalityRateFactory(1)',
+                   'MortalityRateFactory(2)', 'MortalityRateFactory(3)', 'MortalityRateFactory(4)',
+                   'InterventionSlopes ranking', 'KeyedMortality.argmin_slope',
+                   'InterventionSlopes ranking (per key)']
+
+
+@pytest.fixture(scope='module')
+def results() -> dict:
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setitem(benchmarks.SCALES, 'tiny', BenchmarkScale(n_groups=4, points_per_group=20,
+                                                                      n_interventions=4, n_evaluation_ages=10,
+                                                                      n_repeats=2))
+        return run_benchmarks('tiny')
+
+def scale_times(results: dict, factor: float) -> dict:
+    scaled = copy.deepcopy(results)
+    for result in scaled['results']:
+        result['median_seconds'] *= factor
+    return scaled
+
+
+def test_every_benchmark_is_measured(results):
+    assert [result['name'] for result in results['results']] == BENCHMARK_NAMES
+    for result in results['results']:
+        assert result['scale'] == 'tiny'
+        assert result['n_repeats'] == 2
+        assert 0 < result['min_seconds'] <= result['median_seconds']
+    assert results['metadata']['scale'] == 'tiny'
+    assert results['metadata']['parameters']['n_groups'] == 4
+
+def test_saved_results_load_back(tmp_path, results):
+    path = save_results(results, str(tmp_path / 'run.json'))
+    assert load_results(path) == results
+
+def test_slower_runs_are_regressions(results):
+    unchanged = compare_results(results, results)
+    np.testing.assert_array_equal(unchanged['ratio'], 1.0)
+    assert not unchanged['regression'].any() and not unchanged['improvement'].any()
+
+    slower = compare_results(results, scale_times(results, 1.5), threshold=1.2)
+    assert slower['regression'].all() and not slower['improvement'].any()
+
+    faster = compare_results(results, scale_times(results, 0.5), threshold=1.2)
+    assert faster['improvement'].all() and not faster['regression'].any()
+    assert list(faster.index) == [('tiny', name) for name in BENCHMARK_NAMES]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from helpers.bootstrap import Bootstrap
+from helpers.pipeline import SecondOrderPipeline
+
+
+@pytest.fixture(scope='module')
+def pipeline(female_dataset_path):
+    return SecondOrderPipeline(female_dataset_path)
+
+def create_bootstrap(pipeline, max_fit_iterations: int) -> Bootstrap:
+    return Bootstrap(pipeline['dataset'], pipeline['one_interventions'], pipeline['ages'],
+                     max_fit_iterations=max_fit_iterations)
+
+
+def test_converged_replicates_are_all_ranked(pipeline):
+    result = create_bootstrap(pipeline, max_fit_iterations=200).run(10)
+    assert result.n_ranked_replicates == result.n_replicates
+    assert result.ranking_intervals['p_best'].sum() == pytest.approx(1.0)
+
+def test_non_converged_replicates_are_not_ranked(pipeline):
+    # three iterations are not enough for any group to converge
+    result = create_bootstrap(pipeline, max_fit_iterations=3).run(10)
+    assert result.n_ranked_replicates == 0
+    assert result.parameter_intervals['alpha_mean'].isna().all()
+    assert result.ranking_intervals[['slope_mean', 'rank_mean', 'p_best']].isna().all().all()
+
+def test_results_do_not_depend_on_the_number_of_workers(pipeline):
+    bootstrap = create_bootstrap(pipeline, max_fit_iterations=200)
+    serial = bootstrap.run(6, n_workers=1, chunk_size=2)
+    parallel = bootstrap.run(6, n_workers=2, chunk_size=2)
+    np.testing.assert_allclose(serial.ranking_intervals['slope_mean'], parallel.ranking_intervals['slope_mean'])
+
+def test_missing_three_intervention_groups_are_skipped(pipeline):
+    dataset = dict(pipeline['dataset'])
+    del dataset[pipeline['keys'][3][0]]
+    bootstrap = Bootstrap(dataset, pipeline['one_interventions'], pipeline['ages'])
+    result = bootstrap.run(4)
+    assert result.n_ranked_replicates == result.n_replicates
+    assert result.ranking_intervals['slope_mean'].notna().all()
+
+def test_missing_single_intervention_groups_are_reported(pipeline):
+    dataset = dict(pipeline['dataset'])
+    del dataset[pipeline['one_interventions'][0]]
+    with pytest.raises(ValueError, match=pipeline['one_interventions'][0]):
+        Bootstrap(dataset, pipeline['one_interventions'], pipeline['ages'])
@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+import pytest
+
+from helpers.cli import DEFAULT_OUTPUT_DIRECTORY, DEFAULT_STAGES, create_parser, load_filtered_dataset, main
+
+
+def parse_run(*arguments: str):
+    return create_parser().parse_args(['run', *arguments])
+
+
+def test_parser_reads_the_run_options():
+    arguments = create_parser().parse_args(['run', '--dataset', 'a.csv', '--dataset', 'b.csv', '--sex', 'female',
+                                            '--stages', 'second-order', 'plots', '--workers', '2',
+                                            '--format', 'svg', '--format', 'pdf'])
+    assert arguments.command == 'run'
+    assert arguments.dataset == ['a.csv', 'b.csv']
+    assert arguments.sex == ['female']
+    assert arguments.cohort is None
+    assert arguments.stages == ['second-order', 'plots']
+    assert arguments.workers == 2
+    assert arguments.format == ['svg', 'pdf']
+
+    defaults = create_parser().parse_args(['run'])
+    assert defaults.stages == list(DEFAULT_STAGES)
+    assert defaults.output == DEFAULT_OUTPUT_DIRECTORY
+
+def test_parser_rejects_unknown_stages():
+    with pytest.raises(SystemExit):
+        create_parser().parse_args(['run', '--stages', 'unknown'])
+
+def test_sex_filter_keeps_its_rows(female_dataset_path, male_dataset_path):
+    arguments = parse_run('--dataset', female_dataset_path, '--dataset', male_dataset_path, '--sex', 'male')
+    combined = load_filtered_dataset(arguments)
+    assert len(combined) == len(pd.read_csv(male_dataset_path))
+    assert (combined['sex'] == 'male').all()
+
+def test_missing_filter_columns_are_parser_errors(tmp_path, female_dataset_path, capsys):
+    with pytest.raises(SystemExit) as error:
+        main(['run', '--dataset', female_dataset_path, '--cohort', 'C2004', '--output', str(tmp_path)])
+    assert error.value.code == 2
+    assert 'no cohort column' in capsys.readouterr().err
+
+def test_second_order_stage_writes_its_results(tmp_path, female_dataset_path, male_dataset_path):
+    assert main(['run', '--dataset', female_dataset_path, '--dataset', male_dataset_path,
+                 '--stages', 'second-order', '--output', str(tmp_path)]) == 0
+    assert os.listdir(tmp_path) == ['second_order.csv']
+
+    results = pd.read_csv(tmp_path / 'second_order.csv')
+    assert set(results['sex']) == {'female', 'male'}
+    assert results.groupby('sex')['rank'].min().eq(1).all()
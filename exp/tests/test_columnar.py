@@ -0,0 +1,54 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from conftest import EXP_DIRECTORY, FINAL_DATASET_DIRECTORY
+from helpers import columnar
+from helpers.columnar import convert_csv_to_columnar, is_columnar_up_to_date, load_columnar, \
+                             load_dataset, read_csv
+
+ITP_DATASET_PATH = os.path.join(EXP_DIRECTORY, '..', 'dat', 'ITP1_data', 'Lifespan_C2004.csv')
+
+
+@pytest.fixture(params=[os.path.join(FINAL_DATASET_DIRECTORY, 'female_final.csv'), ITP_DATASET_PATH],
+                ids=['final', 'itp'])
+def csv_path(request, tmp_path) -> str:
+    # the columnar copy is written next to the csv, so convert a copy of it
+    path = os.path.join(tmp_path, os.path.basename(request.param))
+    shutil.copy(request.param, path)
+    return path
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip_matches_csv(csv_path, mmap):
+    expected = read_csv(csv_path)
+    loaded = load_columnar(convert_csv_to_columnar(csv_path), mmap=mmap)
+    pd.testing.assert_frame_equal(loaded.astype(object), expected.astype(object))
+
+def test_categorical_round_trip_matches_csv(csv_path):
+    expected = read_csv(csv_path)
+    loaded = load_columnar(convert_csv_to_columnar(csv_path), categorical=True)
+    pd.testing.assert_frame_equal(loaded.astype(object), expected.astype(object))
+
+def test_stale_copies_are_not_loaded(csv_path):
+    assert not is_columnar_up_to_date(csv_path)
+    convert_csv_to_columnar(csv_path)
+    assert is_columnar_up_to_date(csv_path)
+
+    with open(csv_path, 'a') as file:
+        file.write('\n')
+    os.utime(csv_path, ns=(0, 0))
+    assert not is_columnar_up_to_date(csv_path)
+    pd.testing.assert_frame_equal(load_dataset(csv_path).astype(object), read_csv(csv_path).astype(object))
+
+def test_load_dataset_uses_the_columnar_copy(csv_path, monkeypatch):
+    expected = read_csv(csv_path)
+    convert_csv_to_columnar(csv_path)
+
+    def fail(*arguments, **keyword_arguments):
+        raise AssertionError('the csv file was parsed')
+
+    monkeypatch.setattr(columnar, 'read_csv', fail)
+    pd.testing.assert_frame_equal(load_dataset(csv_path).astype(object), expected.astype(object))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from helpers import cross_validation
+from helpers.cross_validation import CrossValidation
+
+
+@pytest.fixture(scope='module')
+def validation(female_raw_dataset):
+    return CrossValidation(female_raw_dataset, n_splits=5, n_repeats=2)
+
+
+def test_batch_fits_match_curve_fit(validation):
+    batch = validation.run(fit_method='batch')
+    expected = validation.run(fit_method='curve_fit')
+    assert batch.n_unique_fits == expected.n_unique_fits
+    np.testing.assert_allclose(batch.scores()['mse'], expected.scores()['mse'], rtol=1e-4)
+
+def test_small_runs_do_not_start_a_pool(validation, monkeypatch):
+    pool_sizes = []
+
+    class RecordingPool(cross_validation.WorkerPool):
+        def __init__(self, state=None, n_workers: int = 1, **keyword_arguments):
+            pool_sizes.append(n_workers)
+            super().__init__(state, n_workers, **keyword_arguments)
+
+    monkeypatch.setattr(cross_validation, 'WorkerPool', RecordingPool)
+    validation.run(n_workers=4)
+    assert pool_sizes == [1]
+
+def test_unknown_fit_methods_raise(validation):
+    with pytest.raises(ValueError):
+        validation.run(fit_method='other')
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import EXP_DIRECTORY
+from helpers.data import CATEGORY_COLUMN, SEX_COLUMN, X_SNAPPING_DISTANCE_IN_DAYS, GroupedDataset, \
+                         _load_rmr_datasets_rowwise, clean_survival_curves, create_canonical_intervention_key, \
+                         create_dataset_mapping, extract_one_intervention_keys, load_rmr_datasets, snap_x
+
+RMR_DIRECTORY = os.path.join(EXP_DIRECTORY, '..', 'dat', 'RMR_data')
+
+
+def create_dict_mapping(dataset: pd.DataFrame, single_interventions: []) -> dict:
+    """The dict of copied DataFrames that `create_dataset_mapping` used to return"""
+    dataset_by_category = {}
+    for intervention in dataset[CATEGORY_COLUMN].unique():
+        key = create_canonical_intervention_key(intervention, single_interventions)
+        dataset_category = dataset[dataset[CATEGORY_COLUMN] == intervention].copy()
+        dataset_by_category[key] = dataset_category.drop([SEX_COLUMN, CATEGORY_COLUMN], axis=1)
+    return dataset_by_category
+
+def snap_x_pointwise(x: np.array, groups: np.array, distance: float = X_SNAPPING_DISTANCE_IN_DAYS) -> np.array:
+    """The point by point merging of `preprocess_data` in 002_ExtractingPointsFromPlot.ipynb"""
+    snapped = np.array(x, dtype=np.float64)
+    for i in range(1, len(snapped)):
+        if groups[i] == groups[i - 1] and abs(snapped[i] - snapped[i - 1]) <= distance:
+            snapped[i] = min(snapped[i], snapped[i - 1])
+    return snapped
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_grouped_dataset_matches_dict_mapping(female_raw_dataset, shuffle):
+    raw_dataset = female_raw_dataset.sample(frac=1, random_state=0) if shuffle else female_raw_dataset
+    one_interventions = extract_one_intervention_keys(raw_dataset)
+    grouped = create_dataset_mapping(raw_dataset, one_interventions)
+    expected = create_dict_mapping(raw_dataset, one_interventions)
+
+    assert isinstance(grouped, GroupedDataset)
+    assert list(grouped) == list(expected)
+    for key in expected:
+        pd.testing.assert_frame_equal(grouped[key], expected[key])
+        x, y = grouped.xy(key)
+        np.testing.assert_array_equal(x, expected[key]['x'])
+        np.testing.assert_array_equal(y, expected[key]['y'])
+
+def test_grouped_dataset_is_read_only(female_raw_dataset):
+    grouped = create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset))
+    x, _ = grouped.xy(next(iter(grouped)))
+    with pytest.raises(ValueError):
+        x[0] = 0.0
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_groups_are_views_of_the_sorted_columns(female_raw_dataset, shuffle):
+    raw_dataset = female_raw_dataset.sample(frac=1, random_state=0) if shuffle else female_raw_dataset
+    grouped = create_dataset_mapping(raw_dataset, extract_one_intervention_keys(raw_dataset))
+    for key in grouped:
+        for column, values in grouped.arrays(key).items():
+            assert np.shares_memory(grouped[key][column].to_numpy(), values)
+            assert np.shares_memory(values, grouped.columns[column])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_snap_x_matches_pointwise_merging(seed):
+    rng = np.random.default_rng(seed)
+    # steps around the snapping distance give long chains of merges and splits
+    x = np.cumsum(rng.choice([-1.5, 0.5, 1.0, 1.9, 2.0, 2.1, 5.0], size=500))
+    groups = np.repeat(np.arange(5), 100)
+    np.testing.assert_array_equal(snap_x(x, groups), snap_x_pointwise(x, groups))
+
+def test_snap_x_does_not_merge_across_groups():
+    np.testing.assert_array_equal(snap_x([1.0, 2.0, 2.5], [0, 1, 1]), [1.0, 2.0, 2.0])
+    assert len(snap_x(np.array([]), np.array([]))) == 0
+
+def test_vectorized_cleaning_matches_rowwise_cleaning():
+    expected = _load_rmr_datasets_rowwise(RMR_DIRECTORY)
+    cleaned = load_rmr_datasets(RMR_DIRECTORY)
+
+    assert list(cleaned) == list(expected)
+    for sex in expected:
+        np.testing.assert_array_equal(cleaned[sex][['x', 'y']].to_numpy(dtype=np.float64),
+                                      expected[sex][['x', 'y']].to_numpy(dtype=np.float64))
+        assert cleaned[sex][CATEGORY_COLUMN].tolist() == expected[sex][CATEGORY_COLUMN].tolist()
+
+def test_cleaned_curves_are_monotonic():
+    rng = np.random.default_rng(0)
+    dataset = pd.DataFrame({'x': np.round(rng.uniform(0, 100, 200), 1), 'y': rng.uniform(0, 1, 200),
+                            SEX_COLUMN: 'female', CATEGORY_COLUMN: np.repeat(['a', 'b'], 100)})
+    cleaned = clean_survival_curves(dataset)
+    for _, curve in cleaned.groupby(CATEGORY_COLUMN):
+        assert (np.diff(curve['x']) >= 0).all()
+        assert (np.diff(curve['y']) <= 0).all()
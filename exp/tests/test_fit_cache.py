@@ -0,0 +1,83 @@
+import numpy as np
+
+from helpers.batch_gompertz import BatchParameters
+from helpers.data import create_dataset_mapping, extract_one_intervention_keys
+from helpers.fit_cache import FitCache, compute_fit_key
+from helpers.gompertz import DEFAULT_INITIAL_PARAMETERS, Parameters, compute_alpha_and_beta, fit_gompertz_model, \
+                             gompertz
+from helpers.mortality_rate import compute_actual_mortalities
+
+AGES = np.linspace(1.6, 2.4, 20)
+MORTALITY_RATE = gompertz(AGES, 0.002, 2.5)
+P0 = DEFAULT_INITIAL_PARAMETERS.to_tuple()
+
+
+def test_keys_are_stable():
+    key = compute_fit_key(AGES, MORTALITY_RATE, P0, 100)
+    # the same content in another container (or dtype) gives the same key
+    assert compute_fit_key(list(AGES), MORTALITY_RATE, P0, 100) == key
+    assert compute_fit_key(np.arange(5), MORTALITY_RATE[:5], P0, 100) == \
+           compute_fit_key(np.arange(5.0), MORTALITY_RATE[:5], P0, 100)
+    assert compute_fit_key(AGES.copy(), MORTALITY_RATE.copy(), tuple(P0), 100) == key
+
+def test_keys_change_with_every_input():
+    key = compute_fit_key(AGES, MORTALITY_RATE, P0, 100)
+    assert compute_fit_key(AGES + 1e-12, MORTALITY_RATE, P0, 100) != key
+    assert compute_fit_key(AGES, MORTALITY_RATE[::-1], P0, 100) != key
+    assert compute_fit_key(AGES, MORTALITY_RATE, (0.2, 0.085), 100) != key
+    assert compute_fit_key(AGES, MORTALITY_RATE, P0, 101) != key
+    assert compute_fit_key(AGES, MORTALITY_RATE, P0, 100, method='other') != key
+    assert compute_fit_key(AGES[:-1], MORTALITY_RATE[:-1], P0, 100) != key
+
+def test_hits_and_misses():
+    cache = FitCache()
+    first = fit_gompertz_model(AGES, MORTALITY_RATE, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+
+    second = fit_gompertz_model(AGES, MORTALITY_RATE, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+    assert second.to_tuple() == first.to_tuple()
+
+    fit_gompertz_model(AGES, MORTALITY_RATE * 1.01, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+def test_least_recently_used_entries_are_evicted():
+    cache = FitCache(max_entries=2)
+    cache.put('a', (1.0, 2.0))
+    cache.put('b', (3.0, 4.0))
+    cache.get('a')
+    cache.put('c', (5.0, 6.0))
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+def test_entries_persist_on_disk(tmp_path):
+    FitCache(directory=str(tmp_path)).put('key', (1.0, 2.0))
+
+    cache = FitCache(directory=str(tmp_path))
+    assert 'key' in cache
+    assert cache.get('key') == (1.0, 2.0)
+    assert cache.hits == 1
+
+def test_batch_fits_use_the_cache_only_when_given(female_raw_dataset):
+    dataset = create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset))
+    uncached = BatchParameters(dataset).compute()
+    assert uncached.report.keys == list(dataset)
+
+    cache = FitCache()
+    first = BatchParameters(dataset, cache=cache).compute()
+    second = BatchParameters(dataset, cache=cache).compute()
+    assert first.report.keys == list(dataset)
+    assert second.report.keys == []
+    assert second.alphas == first.alphas == uncached.alphas
+
+def test_refits_of_the_same_data_hit_a_shared_cache(female_raw_dataset):
+    dataset = create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset))
+    cache = FitCache()
+    parameters = Parameters(dataset, cache=cache).compute()
+    assert (cache.hits, cache.misses) == (0, len(dataset))
+
+    alphas, betas = compute_alpha_and_beta(dataset, cache=cache)
+    mortality = compute_actual_mortalities(dataset, AGES, cache=cache)
+    assert (cache.hits, cache.misses) == (2 * len(dataset), len(dataset))
+    assert alphas == parameters.alphas and betas == parameters.betas
+    for key in dataset:
+        np.testing.assert_array_equal(mortality[key], gompertz(AGES, *parameters[key]))
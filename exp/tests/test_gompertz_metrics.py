@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from scipy.integrate import quad
+
+from helpers.gompertz import GompertzParameters
+from helpers.gompertz_metrics import CUMULATIVE_FORM, HAZARD_FORM, compute_gompertz_metrics, \
+                                     mean_remaining_lifespan, median_remaining_lifespan, rank_by_log_slope, \
+                                     restricted_mean_survival, survival
+
+# (alpha, beta) of fits in years (cumulative form) and of human-like hazards
+PARAMETERS = {
+    CUMULATIVE_FORM: [(0.0015, 2.56), (1.5e-05, 4.25), (0.00025, 3.36)],
+    HAZARD_FORM: [(0.0001, 0.09), (0.01, 3.0), (0.5, 0.1)]
+}
+
+
+def survival_function(alpha: float, beta: float, form: str):
+    def survival_at(age: float) -> float:
+        # quad samples ages at which the survival underflows to zero
+        with np.errstate(over='ignore'):
+            return survival(alpha, beta, [age], form=form)[0, 0]
+    return survival_at
+
+def integrate_survival(alpha: float, beta: float, form: str, start: float, end: float) -> float:
+    return quad(survival_function(alpha, beta, form), start, end, limit=200, epsabs=1e-12)[0]
+
+def cases():
+    return [(form, alpha, beta) for form, parameters in PARAMETERS.items() for alpha, beta in parameters]
+
+
+@pytest.mark.parametrize('form, alpha, beta', cases())
+@pytest.mark.parametrize('age', [0.0, 1.0])
+def test_mean_remaining_lifespan_matches_integration(form, alpha, beta, age):
+    end = -np.log(alpha) / beta if form == CUMULATIVE_FORM else np.inf
+    expected = integrate_survival(alpha, beta, form, age, end) / survival_function(alpha, beta, form)(age)
+    assert mean_remaining_lifespan(alpha, beta, age=age, form=form) == pytest.approx(expected, rel=1e-6)
+
+@pytest.mark.parametrize('form, alpha, beta', cases())
+@pytest.mark.parametrize('age', [0.0, 1.0])
+def test_median_remaining_lifespan_halves_the_survivors(form, alpha, beta, age):
+    median = median_remaining_lifespan(alpha, beta, age=age, form=form)
+    survival_at = survival_function(alpha, beta, form)
+    assert survival_at(age + median) == pytest.approx(survival_at(age) / 2, rel=1e-9)
+
+@pytest.mark.parametrize('form, alpha, beta', cases())
+@pytest.mark.parametrize('horizon', [0.5, 2.0, 40.0])
+def test_restricted_mean_survival_matches_integration(form, alpha, beta, horizon):
+    expected = integrate_survival(alpha, beta, form, 0.0, horizon)
+    assert restricted_mean_survival(alpha, beta, horizon, form=form) == pytest.approx(expected, rel=1e-6, abs=1e-12)
+
+def test_metrics_are_vectorized():
+    alphas, betas = np.array(PARAMETERS[CUMULATIVE_FORM]).T
+    vectorized = mean_remaining_lifespan(alphas, betas)
+    np.testing.assert_allclose(vectorized, [mean_remaining_lifespan(alpha, beta)
+                                            for alpha, beta in zip(alphas, betas)])
+
+def test_undefined_lifespans_are_nan():
+    assert np.isnan(mean_remaining_lifespan(0.001, -1.0))
+    assert np.isnan(median_remaining_lifespan(-0.001, 1.0))
+
+def test_ranking_by_log_slope():
+    parameters = {key: GompertzParameters(alpha, beta)
+                  for key, (alpha, beta) in zip(['a', 'b', 'c'], PARAMETERS[CUMULATIVE_FORM])}
+    assert list(rank_by_log_slope(parameters).index) == ['a', 'c', 'b']
+
+    metrics = compute_gompertz_metrics(parameters, horizon=2.0)
+    assert list(metrics.index) == ['a', 'b', 'c']
+    np.testing.assert_allclose(metrics['log_slope'], [beta for _, beta in PARAMETERS[CUMULATIVE_FORM]])
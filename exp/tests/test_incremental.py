@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from helpers.data import CATEGORY_COLUMN, load_csv
+from helpers.incremental import IncrementalModel
+
+
+def split_last_rows(raw_dataset, category: str, n_rows: int = 5):
+    """Returns the dataset without the last `n_rows` rows of `category`, and these rows"""
+    last_rows = raw_dataset.index[raw_dataset[CATEGORY_COLUMN] == category][-n_rows:]
+    return raw_dataset.drop(last_rows), raw_dataset.loc[last_rows]
+
+def assert_models_match(model, expected):
+    assert sorted(model.dataset) == sorted(expected.dataset)
+    for key in expected.dataset:
+        np.testing.assert_array_equal(model.dataset[key].to_numpy(), expected.dataset[key].to_numpy())
+    np.testing.assert_allclose(model.mortality_rate.to_numpy(), expected.mortality_rate.to_numpy(), rtol=1e-4)
+
+
+@pytest.mark.parametrize('category', ['Rapamycin', 'no_HSCs', 'None'])
+def test_update_matches_a_model_of_all_rows(female_raw_dataset, category):
+    initial_rows, new_rows = split_last_rows(female_raw_dataset, category)
+    model = IncrementalModel(initial_rows)
+    untouched = {key: frame for key, frame in model.dataset.items()}
+
+    report = model.update(new_rows)
+    assert not report.full_recompute
+    assert len(report.refitted_keys) == 1
+    # only the group that received points is replaced
+    changed = [key for key, frame in model.dataset.items() if frame is not untouched[key]]
+    assert changed == report.refitted_keys
+
+    assert_models_match(model, IncrementalModel(female_raw_dataset))
+
+def test_raw_category_names_are_fixed(female_dataset_path, female_raw_dataset):
+    raw_rows = load_csv(female_dataset_path)
+    for raw_category, category in [('no_Gal_Nav', 'no_Gal-Nav'), (np.nan, 'None')]:
+        is_category = raw_rows[CATEGORY_COLUMN].isna() if category == 'None' \
+            else raw_rows[CATEGORY_COLUMN] == raw_category
+        new_rows = raw_rows[is_category].iloc[-5:]
+        initial_rows, _ = split_last_rows(female_raw_dataset, category)
+
+        model = IncrementalModel(initial_rows)
+        report = model.update(new_rows)
+        assert not report.full_recompute
+        assert_models_match(model, IncrementalModel(female_raw_dataset))
+
+def test_new_categories_rebuild_the_model(female_raw_dataset):
+    is_new_category = female_raw_dataset[CATEGORY_COLUMN] == 'no_mTERT'
+    model = IncrementalModel(female_raw_dataset[~is_new_category])
+    assert 'Rapamycin,HSCs,Gal-Nav' not in model.three_interventions
+
+    report = model.update(female_raw_dataset[is_new_category])
+    assert report.full_recompute
+    assert_models_match(model, IncrementalModel(female_raw_dataset))
@@ -0,0 +1,84 @@
+import sys
+import tracemalloc
+
+import pytest
+
+from scipy.optimize import curve_fit
+
+from helpers import gompertz, instrumentation, mortality_rate
+from helpers.data import create_dataset_mapping, extract_one_intervention_keys
+from helpers.gompertz import Parameters, calculate_ages, calculate_mortality_rate
+from helpers.instrumentation import instrument
+
+
+@pytest.fixture(scope='module')
+def dataset(female_raw_dataset):
+    return create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset))
+
+@pytest.fixture
+def originals(monkeypatch) -> dict:
+    # a notebook namespace with `from helpers.gompertz import *` copies
+    monkeypatch.setattr(sys.modules['__main__'], 'fit_gompertz_model', gompertz.fit_gompertz_model, raising=False)
+    return {
+        (gompertz, 'curve_fit'): gompertz.curve_fit,
+        (gompertz, 'fit_gompertz_model'): gompertz.fit_gompertz_model,
+        (mortality_rate, 'fit_gompertz_model'): mortality_rate.fit_gompertz_model,
+        (sys.modules['__main__'], 'fit_gompertz_model'): gompertz.fit_gompertz_model,
+        (Parameters, 'compute'): Parameters.__dict__['compute']
+    }
+
+def assert_originals(originals: dict) -> None:
+    for (namespace, name), original in originals.items():
+        assert vars(namespace)[name] is original
+        assert not hasattr(original, '__instrumented__')
+
+
+def test_disabled_instrumentation_leaves_the_functions_in_place(originals, dataset):
+    assert not instrumentation.is_enabled()
+    assert_originals(originals)
+
+    Parameters(dataset).compute()
+    assert_originals(originals)
+
+def test_patched_names_are_restored_on_exit(originals):
+    with instrument():
+        assert instrumentation.is_enabled()
+        for (namespace, name), original in originals.items():
+            assert vars(namespace)[name].__instrumented__ is original
+    assert not instrumentation.is_enabled()
+    assert_originals(originals)
+
+    with pytest.raises(ZeroDivisionError):
+        with instrument():
+            1 / 0
+    assert_originals(originals)
+
+def test_curve_fit_evaluations_and_times_are_recorded(dataset):
+    with instrument() as trace:
+        Parameters(dataset).compute()
+    summary = trace.summary()
+
+    assert summary.loc['curve_fit', 'calls'] == len(dataset)
+    assert (summary['total_seconds'] > 0).all()
+
+    expected_evaluations = 0
+    for key in dataset:
+        *_, information, _, _ = curve_fit(gompertz.gompertz, calculate_ages(dataset[key]),
+                                          calculate_mortality_rate(dataset[key]), p0=(0.1, 0.085),
+                                          jac=gompertz.gompertz_jacobian, maxfev=50_000, full_output=True)
+        expected_evaluations += information['nfev']
+    assert summary.loc['curve_fit', 'function_evaluations'] == expected_evaluations
+    # nested calls count the evaluations of the fits they contain
+    assert summary.loc['Parameters.compute', 'function_evaluations'] == expected_evaluations
+    assert summary.loc['Parameters.compute', 'total_seconds'] >= summary.loc['curve_fit', 'total_seconds']
+
+def test_memory_peaks_are_recorded(dataset):
+    was_tracing = tracemalloc.is_tracing()
+    with instrument(memory=True) as trace:
+        Parameters(dataset).compute()
+    frame = trace.to_frame()
+
+    assert frame['peak_bytes'].notna().all()
+    assert (frame['peak_bytes'] >= 0).all()
+    assert frame.loc[frame['name'] == 'Parameters.compute', 'peak_bytes'].iloc[0] == frame['peak_bytes'].max()
+    assert tracemalloc.is_tracing() == was_tracing
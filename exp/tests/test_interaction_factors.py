@@ -0,0 +1,96 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from helpers.data import create_combination_keys
+from helpers.interaction_factors import InteractionFactors, create_combination_indices, create_design_matrix, \
+                                        get_interaction_solver
+
+ONE_INTERVENTIONS = ['Rapamycin', 'HSCs', 'Gal-Nav', 'mTERT']
+
+
+def calculate_with_linear_model(one_interventions_mortality, three_interventions_mortality) -> np.array:
+    """The original per time step pseudo-inverse of `InteractionFactors.LINEAR_MODEL`"""
+    inverse_linear_model = np.linalg.pinv(InteractionFactors.LINEAR_MODEL)
+
+    diffs = []
+    for i, indices in enumerate(combinations(range(4), 3)):
+        diff = np.array(three_interventions_mortality[i], dtype=np.float64)
+        for index in indices:
+            diff = diff - np.array(one_interventions_mortality[index])
+        diffs.append(diff)
+
+    return np.array([inverse_linear_model @ np.array([diff[time_step] for diff in diffs])
+                     for time_step in range(len(diffs[0]))])
+
+@pytest.fixture
+def mortality():
+    rng = np.random.default_rng(0)
+    return rng.uniform(0.01, 0.5, (4, 30)), rng.uniform(0.01, 0.5, (4, 30))
+
+
+def test_design_matrix_is_the_linear_model():
+    design = create_design_matrix(4, tuple(create_combination_indices(4, 3)))
+    np.testing.assert_array_equal(design.toarray(), InteractionFactors.LINEAR_MODEL)
+
+def test_factors_match_linear_model(mortality):
+    one, three = mortality
+    factors = InteractionFactors(one, three)
+    factors.calculate()
+    np.testing.assert_allclose(factors.to_numpy(), calculate_with_linear_model(one, three), rtol=1e-10, atol=1e-14)
+
+def test_inputs_are_not_modified(mortality):
+    one, three = mortality
+    one_copy, three_copy = one.copy(), three.copy()
+    InteractionFactors(one, three).calculate()
+    np.testing.assert_array_equal(one, one_copy)
+    np.testing.assert_array_equal(three, three_copy)
+
+def test_leading_dimensions_are_broadcast(mortality):
+    one, three = mortality
+    rng = np.random.default_rng(1)
+    scales = rng.uniform(0.5, 2.0, (3, 1, 1))
+
+    factors = InteractionFactors(scales * one, scales * three)
+    factors.calculate()
+    for replicate, scale in enumerate(scales):
+        np.testing.assert_allclose(factors.to_numpy()[replicate],
+                                   calculate_with_linear_model(scale * one, scale * three), rtol=1e-10, atol=1e-14)
+
+def test_sparse_solver_is_the_least_squares_solution():
+    n_interventions = 6
+    combination_indices = tuple(create_combination_indices(n_interventions, 3))
+    design = create_design_matrix(n_interventions, combination_indices).toarray()
+    diffs = np.random.default_rng(2).normal(size=(len(combination_indices), 5))
+
+    factors = get_interaction_solver(n_interventions, combination_indices).solve(diffs)
+    np.testing.assert_allclose(factors, np.linalg.pinv(design) @ diffs, rtol=1e-8, atol=1e-12)
+
+def test_rows_are_matched_by_key(mortality):
+    one, three = mortality
+    expected = InteractionFactors(one, three)
+    expected.calculate()
+
+    keys = create_combination_keys(ONE_INTERVENTIONS, 3)
+    shuffled = [3, 1, 0, 2]
+    factors = InteractionFactors(one, three[shuffled], one_interventions=ONE_INTERVENTIONS,
+                                 three_interventions=[keys[row] for row in shuffled])
+    factors.calculate()
+    np.testing.assert_allclose(factors.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+    mapping = InteractionFactors(dict(zip(ONE_INTERVENTIONS, one)), dict(zip(keys, three)))
+    mapping.calculate()
+    np.testing.assert_allclose(mapping.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+def test_mismatched_keys_raise(mortality):
+    one, three = mortality
+    keys = create_combination_keys(ONE_INTERVENTIONS, 3)
+    with pytest.raises(ValueError):
+        InteractionFactors(one, three, combination_indices=list(reversed(create_combination_indices(4, 3))),
+                           one_interventions=ONE_INTERVENTIONS, three_interventions=keys)
+    with pytest.raises(ValueError):
+        InteractionFactors(one, three[:3], one_interventions=ONE_INTERVENTIONS, three_interventions=keys)
+    with pytest.raises(ValueError):
+        InteractionFactors(one, three, one_interventions=ONE_INTERVENTIONS,
+                           three_interventions=keys[:3] + ['Rapamycin,Metformin,mTERT'])
@@ -0,0 +1,60 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from helpers.interaction_factors import InteractionFactors
+from helpers.intervention_ranking import InterventionRanking
+from helpers.intervention_slopes import InterventionSlopes
+
+from conftest import EXP_DIRECTORY
+
+
+def test_slopes_do_not_depend_on_the_mortality_level():
+    ages = np.linspace(1.6, 2.4, 20)
+    log_mortality = np.array([level + 3.0 * ages for level in (-9.0, -5.0, -1.0)])
+    np.testing.assert_allclose(InterventionSlopes.calculate_slopes(ages, log_mortality), 3.0)
+
+def test_slopes_of_leading_dimensions():
+    ages = np.linspace(0.0, 2.0, 5)
+    log_mortality = np.arange(2 * 3 * 5, dtype=np.float64).reshape(2, 3, 5)
+    assert InterventionSlopes.calculate_slopes(ages, log_mortality).shape == (2, 3)
+    np.testing.assert_allclose(InterventionSlopes.calculate_slopes(ages, log_mortality), 2.0)
+
+def test_add_intervention_slopes_matches_the_notebook_definition():
+    ages = np.linspace(1.6, 2.4, 20)
+    log_mortality = np.array([-9.0 + 3.0 * ages, -4.0 + 2.0 * ages])
+
+    slopes = InterventionSlopes()
+    slopes.add_intervention_slopes(['a', 'b'], ages, log_mortality)
+    expected = InterventionSlopes()
+    for key, row in zip(['a', 'b'], log_mortality):
+        expected.add_intervention_slope(key, ages, row)
+    assert slopes.slopes == pytest.approx(expected.slopes)
+
+
+def test_top_k_matches_ranking_all_combinations():
+    rng = np.random.default_rng(0)
+    ages = np.linspace(1.6, 2.4, 30)
+    n_interventions = 5
+    log_alphas = rng.uniform(-8, -5, (n_interventions, 1))
+    betas = rng.uniform(2, 4, (n_interventions, 1))
+    one_intervention_mortality = np.exp(log_alphas + betas * ages)
+    three_intervention_mortality = rng.uniform(0.5, 1.5, (10, 1)) * one_intervention_mortality[:3].sum(axis=0)
+    interaction_factors = InteractionFactors(one_intervention_mortality, three_intervention_mortality)
+    interaction_factors.calculate()
+
+    ranking = InterventionRanking([f'i{index}' for index in range(n_interventions)], one_intervention_mortality,
+                                  interaction_factors, ages)
+    top = ranking.top_k(k=4)
+
+    everything = ranking.top_k(k=2 ** n_interventions)
+    assert [key for key, _ in top] == [key for key, _ in everything[:4]]
+    assert [slope for _, slope in everything] == sorted([slope for _, slope in everything])
+
+def test_analysis_modules_do_not_import_pyplot():
+    code = ('import sys\n'
+            'import helpers.stratified, helpers.mortality_rate, helpers.pipeline\n'
+            'assert "matplotlib.pyplot" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], cwd=EXP_DIRECTORY, check=True)
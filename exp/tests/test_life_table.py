@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.life_table import AGE_IN_DAYS_COLUMN, AT_RISK_COLUMN, CENSORED_COLUMN, COHORT_COLUMN, DEATH_COLUMN, \
+                               DEATHS_COLUMN, GROUP_COLUMN, PROBABILITY_OF_DEATH_PER_PERIOD_COLUMN, STATUS_COLUMN, \
+                               LifeTableBuilder, build_itp_life_tables
+
+BIN_PERIOD_IN_DAYS = 13
+COHORTS = ('C2004', 'C2005')
+
+
+def group_ages(data: pd.DataFrame, bin_period_in_days: int) -> pd.DataFrame:
+    """`group_ages` of 001_GompertzAssumption.ipynb"""
+    data = data[[DEATH_COLUMN, AGE_IN_DAYS_COLUMN]]
+    data = data.groupby(AGE_IN_DAYS_COLUMN).sum()
+
+    grouped_data_by_time_period = data.groupby(lambda x: (x // bin_period_in_days)).sum()
+    grouped_data_by_time_period.index.name = f'age(per {bin_period_in_days} days)'
+    return grouped_data_by_time_period
+
+def calculate_running_alive_counts(data: pd.DataFrame) -> pd.DataFrame:
+    """`calculate_running_alive_counts` of 001_GompertzAssumption.ipynb"""
+    total = data.sum()
+    running_alive = total - data.cumsum()
+
+    running_alive.index += 1
+    running_alive = pd.concat([pd.DataFrame([total]), running_alive])[:-1]
+    return running_alive
+
+
+def create_records(censored: bool) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n_records = 120
+    status = np.where(rng.random(n_records) < 0.25, 'removed', 'dead') if censored else np.full(n_records, 'dead')
+    return pd.DataFrame({
+        COHORT_COLUMN: rng.choice(COHORTS, n_records),
+        GROUP_COLUMN: rng.choice(['Control', 'Rapa'], n_records),
+        STATUS_COLUMN: status,
+        DEATH_COLUMN: (status == 'dead').astype(np.int64),
+        AGE_IN_DAYS_COLUMN: rng.integers(300, 1_200, n_records)
+    })
+
+def build_from_files(records: pd.DataFrame, directory) -> LifeTableBuilder:
+    for cohort in COHORTS:
+        records[records[COHORT_COLUMN] == cohort].to_csv(directory / f'Lifespan_{cohort}.csv', sep=';',
+                                                         index=False, encoding='utf-8-sig')
+    # chunks smaller than a cohort make the counts span several updates
+    return build_itp_life_tables(str(directory), bin_period_in_days=BIN_PERIOD_IN_DAYS, chunk_size=7)
+
+
+def test_cohorts_are_not_merged(tmp_path):
+    records = create_records(censored=True)
+    builder = build_from_files(records, tmp_path)
+    assert sorted(builder.group_keys) == sorted(records.groupby([COHORT_COLUMN, GROUP_COLUMN]).groups)
+
+@pytest.mark.parametrize('censored', [False, True])
+def test_life_tables_match_the_notebook(tmp_path, censored):
+    records = create_records(censored)
+    builder = build_from_files(records, tmp_path)
+
+    for key, group in records.groupby([COHORT_COLUMN, GROUP_COLUMN]):
+        life_table = builder.life_table(key)
+        dead_counts = group_ages(group, BIN_PERIOD_IN_DAYS)
+        running_alive_counts = calculate_running_alive_counts(dead_counts)
+        bins = dead_counts.index.to_numpy()
+
+        np.testing.assert_array_equal(life_table.loc[bins, DEATHS_COLUMN], dead_counts[DEATH_COLUMN])
+        assert life_table[DEATHS_COLUMN].sum() == dead_counts[DEATH_COLUMN].sum()
+
+        # the notebook counts the animals that die, censored animals are also at risk until they leave
+        censored_bins = (group[group[DEATH_COLUMN] == 0][AGE_IN_DAYS_COLUMN] // BIN_PERIOD_IN_DAYS).to_numpy()
+        still_censored = np.array([(censored_bins >= period).sum() for period in bins])
+        np.testing.assert_array_equal(life_table.loc[bins, AT_RISK_COLUMN],
+                                      running_alive_counts[DEATH_COLUMN].to_numpy() + still_censored)
+        assert life_table[CENSORED_COLUMN].sum() == len(censored_bins)
+
+        if not censored:
+            chance_of_death = dead_counts[DEATH_COLUMN].to_numpy() / \
+                              (running_alive_counts[DEATH_COLUMN].to_numpy() + 1e-9)
+            np.testing.assert_allclose(life_table.loc[bins, PROBABILITY_OF_DEATH_PER_PERIOD_COLUMN],
+                                       chance_of_death, rtol=1e-6)
+
+def test_chunks_give_the_counts_of_one_pass(tmp_path):
+    records = create_records(censored=True)
+    chunked = build_from_files(records, tmp_path)
+    single_pass = LifeTableBuilder(bin_period_in_days=BIN_PERIOD_IN_DAYS).update(records)
+
+    for key in single_pass.group_keys:
+        pd.testing.assert_frame_equal(chunked.life_table(key), single_pass.life_table(key))
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from torch.utils.data import DataLoader
+
+from helpers.mlp import ALL_TREATMENTS, HIDDEN_SIZE, INPUT_SIZE, OUTPUT_SIZE, MLPModel, MortalityPredictor, \
+                        create_treatment_vector, load_model
+
+AGES = np.arange(580, 900, 20)
+TREATMENT_VECTORS = [create_treatment_vector(','.join(ALL_TREATMENTS[:n_treatments]))
+                     for n_treatments in range(len(ALL_TREATMENTS) + 1)]
+
+
+def make_predictions(model, ages, treatment):
+    """`make_predictions` of 005_MLPModel.ipynb"""
+    input_data = []
+    for age in ages:
+        sample = {
+            'input': torch.tensor([age] + treatment, dtype=torch.float32),
+        }
+        input_data.append(sample)
+
+    prediction_data_loader = DataLoader(input_data, batch_size=len(input_data), shuffle=False)
+    model.eval()
+
+    predictions = []
+    with torch.no_grad():
+        for batch in prediction_data_loader:
+            output = model(batch['input'])
+            predictions.extend(output.squeeze().tolist())
+    return predictions
+
+def save_random_model(path, seed: int) -> None:
+    torch.manual_seed(seed)
+    torch.save(MLPModel(INPUT_SIZE, HIDDEN_SIZE, OUTPUT_SIZE).state_dict(), path)
+
+
+@pytest.fixture(scope='module')
+def model() -> MLPModel:
+    return load_model()
+
+def test_surface_matches_the_notebook_predictions(model):
+    surface = MortalityPredictor(model).predict_surface(AGES, TREATMENT_VECTORS)
+    assert surface.shape == (len(TREATMENT_VECTORS), len(AGES))
+    for vector, predictions in zip(TREATMENT_VECTORS, surface):
+        np.testing.assert_allclose(predictions, make_predictions(model, AGES, vector), rtol=1e-5, atol=1e-7)
+
+def test_cached_predictions_are_bounded(model):
+    predictor = MortalityPredictor(model, max_cached_predictions=2)
+    surface = predictor.predict_surface(AGES, TREATMENT_VECTORS)
+    assert len(predictor.cache) == 2
+
+    # the most recently used entries are kept and give the same predictions
+    np.testing.assert_array_equal(predictor.predict_surface(AGES, TREATMENT_VECTORS[-2:]), surface[-2:])
+    np.testing.assert_array_equal(predictor.predict(AGES, TREATMENT_VECTORS[0]), surface[0])
+    assert len(predictor.cache) == 2
+
+def test_edited_model_files_are_loaded_again(tmp_path):
+    path = str(tmp_path / 'model.pth')
+    save_random_model(path, seed=0)
+    predictor = MortalityPredictor.load(path)
+    assert MortalityPredictor.load(path) is predictor
+
+    save_random_model(path, seed=1)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    reloaded = MortalityPredictor.load(path)
+    assert reloaded is not predictor
+    assert not np.allclose(reloaded.predict(AGES, TREATMENT_VECTORS[1]), predictor.predict(AGES, TREATMENT_VECTORS[1]))
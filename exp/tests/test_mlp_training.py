@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import torch
+
+from helpers.data import create_dataset_mapping, extract_one_intervention_keys
+from helpers.mlp_training import EarlyStopping, TrainingConfig, create_samples, train_seed, train_seeds_parallel, \
+                                 train_seeds_vectorized
+
+SEEDS = [10, 12, 14]
+
+
+@pytest.fixture(scope='module')
+def samples(female_raw_dataset) -> (np.array, np.array):
+    return create_samples(create_dataset_mapping(female_raw_dataset, extract_one_intervention_keys(female_raw_dataset)))
+
+def assert_same_training(result, expected, rtol: float = 1e-4):
+    assert result.seed == expected.seed
+    assert result.best_epoch == expected.best_epoch
+    np.testing.assert_allclose(result.train_losses, expected.train_losses, rtol=rtol)
+    np.testing.assert_allclose(result.val_losses, expected.val_losses, rtol=rtol)
+    for name, parameter in expected.state_dict.items():
+        torch.testing.assert_close(result.state_dict[name], parameter, rtol=rtol, atol=1e-5)
+
+
+def test_ensemble_members_train_like_single_seeds(samples):
+    inputs, targets = samples
+    config = TrainingConfig(epochs=30)
+    run = train_seeds_vectorized(inputs, targets, SEEDS, config)
+    for result in run.results:
+        assert_same_training(result, train_seed(inputs, targets, result.seed, config))
+
+def test_parallel_runner_trains_like_single_seeds(samples):
+    inputs, targets = samples
+    config = TrainingConfig(epochs=10)
+    run = train_seeds_parallel(inputs, targets, SEEDS[:2], config, n_workers=2)
+    assert [result.seed for result in run.results] == SEEDS[:2]
+    for result in run.results:
+        assert_same_training(result, train_seed(inputs, targets, result.seed, config), rtol=1e-6)
+
+def test_early_stopping_waits_patience_epochs():
+    stopping = EarlyStopping(2, patience=2, min_delta=0.1)
+    for epoch, losses in enumerate([[1.0, 1.0], [0.5, 0.95], [0.6, 0.8], [0.45, 0.75], [0.3, 0.6]]):
+        stopping.update(epoch, np.array(losses))
+
+    # the first model improved by less than min_delta at epoch 3, so it stopped after epochs 2 and 3
+    np.testing.assert_array_equal(stopping.active, [False, True])
+    np.testing.assert_array_equal(stopping.best_epoch, [1, 4])
+    np.testing.assert_array_equal(stopping.best_loss, [0.5, 0.6])
+    np.testing.assert_array_equal(stopping.n_epochs, [4, 5])
+
+def test_stopped_seeds_end_their_curves(samples):
+    inputs, targets = samples
+    config = TrainingConfig(epochs=300, patience=5, min_delta=1e-3)
+    single = train_seed(inputs, targets, SEEDS[0], config)
+    assert len(single.train_losses) == single.best_epoch + config.patience + 1 < config.epochs
+
+    run = train_seeds_vectorized(inputs, targets, SEEDS, config)
+    assert_same_training(run.results[0], single)
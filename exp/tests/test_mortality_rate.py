@@ -0,0 +1,57 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from helpers.mortality_rate import EPS, KeyedMortality, MortalityRate
+
+
+def test_dict_values_are_returned_unchanged():
+    values = {'Rapamycin': np.array([0.1, 0.2]), 'HSCs': np.array([0.3, 0.4])}
+    mortality_rate = MortalityRate(values)
+
+    assert mortality_rate.value() is values
+    log_mortality = mortality_rate.log()
+    assert isinstance(log_mortality, dict)
+    np.testing.assert_array_equal(log_mortality['HSCs'], np.log(values['HSCs'] + EPS))
+
+def test_array_log_adds_eps():
+    values = np.array([0.0, 0.5])
+    np.testing.assert_array_equal(MortalityRate(values).log(), np.log(values + EPS))
+    assert np.isfinite(MortalityRate({'Rapamycin': values}).log()['Rapamycin']).all()
+
+def test_keyed_mortality_is_opt_in():
+    keyed = KeyedMortality(['', 'a', 'b', 'a,b'], np.arange(8, dtype=np.float64).reshape(4, 2) + 1)
+    mortality_rate = MortalityRate(keyed)
+
+    assert mortality_rate.value() is keyed
+    assert isinstance(mortality_rate.log(), KeyedMortality)
+    np.testing.assert_array_equal(mortality_rate.log()['a,b'], np.log(keyed['a,b'] + EPS))
+
+
+@pytest.fixture
+def keyed() -> KeyedMortality:
+    keys = ['', 'a', 'b', 'c', 'a,b', 'a,c', 'b,c', 'a,b,c']
+    return KeyedMortality(keys, np.exp(np.linspace(-5, -1, 3)[None, :] * np.arange(1, 9)[:, None] / 8))
+
+def test_keyed_mortality_is_a_read_only_mapping(keyed):
+    assert len(keyed) == 8 and 'a,c' in keyed and 'c,a' not in keyed
+    assert keyed.to_dict().keys() == dict(keyed).keys()
+    with pytest.raises(ValueError):
+        keyed['a'][0] = 1.0
+
+def test_keyed_mortality_does_not_freeze_the_callers_array():
+    array = np.ones((2, 3))
+    keyed = KeyedMortality(['', 'a'], array)
+    assert np.shares_memory(keyed.to_numpy(), array)
+    assert array.flags.writeable and not keyed.to_numpy().flags.writeable
+
+def test_keyed_mortality_orders(keyed):
+    assert list(keyed.order(2).keys()) == ['a,b', 'a,c', 'b,c']
+    np.testing.assert_array_equal(keyed.order(2).to_numpy(), keyed.to_numpy()[4:7])
+    assert list(keyed.order(0).keys()) == ['']
+
+def test_keyed_mortality_pickles(keyed):
+    restored = pickle.loads(pickle.dumps(keyed))
+    assert list(restored.keys()) == list(keyed.keys())
+    np.testing.assert_array_equal(restored.to_numpy(), keyed.to_numpy())
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from scipy.optimize import curve_fit
+
+from helpers import gompertz
+from helpers.data import NO_INTERVENTION_DATASET_KEY, extract_three_intervention_keys
+from helpers.intervention_ranking import NO_INTERVENTION_KEY
+from helpers.intervention_slopes import InterventionSlopes
+from helpers.mortality_rate import EPS, compute_all_orders_mortality
+from helpers.pipeline import Pipeline, SecondOrderPipeline
+
+
+@pytest.fixture(scope='module')
+def pipeline(female_dataset_path):
+    return SecondOrderPipeline(female_dataset_path)
+
+@pytest.fixture(scope='module')
+def reference(pipeline):
+    return compute_all_orders_mortality(pipeline['dataset'], pipeline['parameters'], pipeline['one_interventions'],
+                                        pipeline['ages'])
+
+
+def test_dataset_order_of_three_intervention_keys_is_not_lexicographic(pipeline):
+    # the reason the keys must be matched to their interventions by name
+    assert extract_three_intervention_keys(pipeline['dataset']) != pipeline['keys'][3]
+    assert sorted(extract_three_intervention_keys(pipeline['dataset'])) == sorted(pipeline['keys'][3])
+
+@pytest.mark.parametrize('n_interventions', [1, 2, 3])
+def test_mortality_rates_match_all_orders_model(pipeline, reference, n_interventions):
+    mortality_rate = pipeline.mortality_rate(n_interventions).mortality_rate.value()
+    assert sorted(mortality_rate.keys()) == sorted(reference.order(n_interventions).keys())
+    for key in mortality_rate:
+        np.testing.assert_allclose(mortality_rate[key], reference[key], rtol=1e-10, atol=1e-12)
+
+def test_all_interventions_mortality_matches_all_orders_model(pipeline, reference):
+    mortality_rate = pipeline.mortality_rate(4).mortality_rate.value()
+    np.testing.assert_allclose(mortality_rate, reference[','.join(pipeline['one_interventions'])], rtol=1e-10)
+
+def test_slopes_match_all_orders_model(pipeline, reference):
+    slopes = pipeline['slopes'].slopes
+    for key in pipeline['keys'][2] + pipeline['keys'][3]:
+        expected = InterventionSlopes.calculate_slopes(pipeline['ages'], np.log(reference[key] + EPS))
+        assert slopes[key] == pytest.approx(expected, rel=1e-6)
+
+def test_slopes_rank_the_all_interventions_group(pipeline, reference):
+    all_interventions_key = pipeline['keys'][len(pipeline['one_interventions'])]
+    expected = dict(zip(reference.keys(), reference.slopes(pipeline['ages'])))
+    expected = expected[','.join(pipeline['one_interventions'])]
+    # the model predicts a negative mortality for all four interventions of the female data
+    assert pipeline['slopes'].slopes[all_interventions_key] == pytest.approx(expected, rel=1e-6, nan_ok=True)
+
+def test_slopes_pick_the_same_best_intervention_as_the_all_orders_model(pipeline, reference):
+    slopes = dict(pipeline['slopes'].slopes)
+    no_intervention_slope = slopes.pop(NO_INTERVENTION_KEY)
+    all_interventions_key = pipeline['keys'][len(pipeline['one_interventions'])]
+    slopes[','.join(pipeline['one_interventions'])] = slopes.pop(all_interventions_key)
+    expected = dict(zip(reference.keys(), reference.slopes(pipeline['ages'])))
+
+    assert no_intervention_slope == pytest.approx(expected[NO_INTERVENTION_DATASET_KEY], rel=1e-6)
+    expected = {key: expected[key] for key in slopes}
+    assert min(slopes, key=lambda key: np.nan_to_num(slopes[key], nan=np.inf)) == \
+        min(expected, key=lambda key: np.nan_to_num(expected[key], nan=np.inf))
+
+def test_changed_evaluation_ages_do_not_refit(female_dataset_path, monkeypatch):
+    n_fits = []
+    def counting_curve_fit(*arguments, **keyword_arguments):
+        n_fits.append(1)
+        return curve_fit(*arguments, **keyword_arguments)
+    monkeypatch.setattr(gompertz, 'curve_fit', counting_curve_fit)
+
+    pipeline = SecondOrderPipeline(female_dataset_path)
+    pipeline['slopes']
+    assert len(n_fits) == len(pipeline['dataset'])
+
+    pipeline.set_inputs(evaluation_ages=np.linspace(1.6, 2.4, 50))
+    pipeline['slopes']
+    mortality_rate = pipeline.mortality_rate(2).mortality_rate.value()
+
+    assert len(n_fits) == len(pipeline['dataset'])
+    assert pipeline.nodes['parameters'].n_computations == 1
+    assert len(next(iter(mortality_rate.values()))) == 50
+
+def test_edited_input_files_are_read_again(tmp_path):
+    path = tmp_path / 'input.txt'
+    path.write_text('old')
+    pipeline = Pipeline().add_input('path', str(path)).add_node('read', lambda file_path: open(file_path).read(),
+                                                               ['path'])
+    assert pipeline['read'] == 'old'
+    assert pipeline.is_up_to_date('read')
+
+    path.write_text('edited')
+    assert not pipeline.is_up_to_date('read')
+    assert pipeline['read'] == 'edited'
+    assert pipeline.nodes['read'].n_computations == 2
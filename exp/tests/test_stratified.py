@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from helpers.gompertz import Parameters
+from helpers.mortality_rate import compute_all_orders_mortality
+from helpers.stratified import StratifiedAnalysis, load_combined_dataset
+
+
+@pytest.fixture(scope='module')
+def analysis(female_dataset_path, male_dataset_path):
+    analysis = StratifiedAnalysis(load_combined_dataset([female_dataset_path, male_dataset_path]))
+    analysis.run()
+    return analysis
+
+
+def test_every_stratum_keeps_its_interaction_factors(analysis):
+    for stratum in analysis.strata.values():
+        factors = stratum.interaction_factors
+        assert factors is not None
+        assert factors.one_interventions == stratum.one_interventions
+        assert all([key in stratum.dataset for key in factors.three_interventions])
+        assert factors.to_numpy().shape[0] == len(stratum.evaluation_ages)
+
+def test_kept_interaction_factors_reproduce_the_mortality_rates(analysis):
+    for stratum in analysis.strata.values():
+        refitted = compute_all_orders_mortality(stratum.dataset, stratum.parameters, stratum.one_interventions,
+                                                stratum.evaluation_ages)
+        for key in refitted.keys():
+            np.testing.assert_allclose(stratum.mortality_rate[key], refitted[key], rtol=1e-12)
+
+def test_groups_the_batch_did_not_converge_on_are_refitted(female_raw_dataset):
+    # a single iteration leaves every group unconverged, so all of them fall back to curve_fit
+    analysis = StratifiedAnalysis(female_raw_dataset, max_fit_iterations=1).fit()
+    assert not analysis.report.converged.any()
+
+    for stratum in analysis.strata.values():
+        expected = Parameters(stratum.dataset).compute()
+        for key in stratum.dataset:
+            assert stratum.parameters[key] == expected[key]
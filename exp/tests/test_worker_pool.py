@@ -0,0 +1,38 @@
+import pytest
+
+from helpers.worker_pool import WorkerPool
+
+
+class Offset:
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.closed = False
+
+    def add(self, value: int) -> int:
+        return self.offset + value
+
+    def close(self) -> None:
+        self.closed = True
+
+def add_state(state: int, value: int) -> int:
+    return state + value
+
+def negate(value: int) -> int:
+    return -value
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_map_passes_the_state_and_keeps_the_order(n_workers):
+    with WorkerPool(10, n_workers) as pool:
+        assert list(pool.map(add_state, range(20), chunk_size=3)) == [10 + value for value in range(20)]
+        assert list(pool.map(negate, range(5), with_state=False)) == [0, -1, -2, -3, -4]
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_workers_create_their_state(n_workers):
+    with WorkerPool((5,), n_workers, create_state=Offset) as pool:
+        assert list(pool.map(Offset.add, [1, 2, 3])) == [6, 7, 8]
+
+def test_created_local_state_is_closed():
+    with WorkerPool((5,), 1, create_state=Offset) as pool:
+        state = pool.local_state
+    assert state.closed